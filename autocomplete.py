@@ -0,0 +1,89 @@
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+from hoikuen_store import HoikuenSnapshot
+from text_index import normalize_text
+
+# 読み仮名のカラム (データにあれば補完のキーに加える)
+READING_COLUMNS = ("名称カナ", "フリガナ", "ふりがな")
+
+# 名称の先頭から取り除いた別名も補完のキーにする (「区立〇〇保育園」を「〇〇」でも)
+ALIAS_PREFIXES = tuple(normalize_text(p) for p in ("渋谷区立", "区立", "私立"))
+
+# 返す件数の上限
+MAX_SUGGESTIONS = 20
+
+
+def name_aliases(name: str) -> List[str]:
+    """
+    名称の正規化したキーと別名
+    """
+    key = normalize_text(name)
+    keys = [key]
+    for prefix in ALIAS_PREFIXES:
+        if key.startswith(prefix) and len(key) > len(prefix):
+            keys.append(key[len(prefix) :])
+    return keys
+
+
+class PrefixIndex:
+    """
+    正規化したキーのソート済み配列による前方一致索引
+
+    キーは名称・別名・読み仮名。検索は二分探索で範囲を求め、先頭から順に返す。
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, int]]):
+        pairs = sorted(set(entries))
+        self.keys = [key for key, _ in pairs]
+        self.rows = [row for _, row in pairs]
+
+    def search(self, prefix: str, limit: int) -> List[int]:
+        """
+        キーが prefix で始まる行番号 (重複なし, 最大 limit 件)
+        """
+        prefix = normalize_text(prefix)
+        if not prefix or limit <= 0:
+            return []
+        rows: Dict[int, None] = {}
+        start = bisect_left(self.keys, prefix)
+        for i in range(start, len(self.keys)):
+            if not self.keys[i].startswith(prefix):
+                break
+            rows.setdefault(self.rows[i])
+            if len(rows) >= limit:
+                break
+        return list(rows)
+
+
+def build_prefix_index(snapshot: HoikuenSnapshot) -> PrefixIndex:
+    df = snapshot.df
+    entries = [
+        (key, row)
+        for row, name in enumerate(df.get_column("名称").to_list())
+        for key in name_aliases(name or "")
+    ]
+    for column in READING_COLUMNS:
+        if column in df.columns:
+            entries.extend(
+                (normalize_text(reading), row)
+                for row, reading in enumerate(df.get_column(column).to_list())
+                if reading
+            )
+    return PrefixIndex(entries)
+
+
+def get_prefix_index(snapshot: HoikuenSnapshot) -> PrefixIndex:
+    return snapshot.derived("prefix_index", build_prefix_index)
+
+
+def suggest_names(
+    snapshot: HoikuenSnapshot, prefix: str, limit: int = 10
+) -> List[Dict[str, str]]:
+    """
+    入力途中の文字列に前方一致する保育園の名称とハッシュ (パーマリンク用)
+    """
+    limit = min(limit, MAX_SUGGESTIONS)
+    rows = get_prefix_index(snapshot).search(prefix, limit)
+    names = snapshot.df.get_column("名称")
+    return [{"name": names[row], "h": snapshot.names.hashes[row]} for row in rows]
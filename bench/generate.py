@@ -0,0 +1,278 @@
+"""
+ベンチマーク用の合成データを作る
+
+    python -m bench.generate 10000 bench/data/10000
+
+アプリと同じ区ごとの構成 (wards.py) で書き出す。最初の区 (渋谷区) は
+{出力先}/data/hoikuen.csv と {出力先}/data/geojson/shibuya_*.geojson、
+ほかの区は {出力先}/data/wards/{区のコード}/ (ward.json・hoikuen.csv・geojson/)。
+カラム・値の形式は本物のデータと同じ (「（なし）」・空欄・"2.0" なども含む)。
+
+施設数が多い場合は区を増やして渋谷区の周りに並べる (1区あたり約 100 施設)。
+区が MAX_WARDS を超える場合は区を増やさずに1区あたりの施設数を増やす。
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+from typing import Any, Dict, List, Tuple
+
+from form_filter import get_nursery_type
+from geo_sources import GEO_LAYER_FILES
+from hoikuen_store import DEFAULT_HOIKUEN_CSV
+from wards import SHIBUYA, WARD_GEO_FILES, WARDS_DIR
+
+# 1区あたりの施設数の目安 (渋谷区は約 100)
+FACILITIES_PER_WARD = 100
+# 区の数の上限 (区ごとにスナップショット・空間結合を作るので増やしすぎない)
+MAX_WARDS = 16
+# 区の大きさ (緯度/経度) と最初の区 (渋谷区) の南西の角は渋谷区の範囲に合わせる
+WARD_SIZE = (
+    SHIBUYA.bounds.north - SHIBUYA.bounds.south,
+    SHIBUYA.bounds.east - SHIBUYA.bounds.west,
+)
+ORIGIN = (SHIBUYA.bounds.south, SHIBUYA.bounds.west)
+WARD_NAMES = ["渋谷区", "新宿区", "港区", "目黒区", "世田谷区", "中野区", "杉並区", "品川区"]
+WARD_CODES = [
+    "shibuya", "shinjuku", "minato", "meguro", "setagaya", "nakano", "suginami", "shinagawa"
+]  # fmt: skip
+# 書き出す形式が変わったら上げる (bench.run が作り直す)
+GENERATOR_VERSION = 2
+TOWNS = ["神南", "宇田川町", "代々木", "千駄ヶ谷", "神宮前", "恵比寿", "広尾", "笹塚", "幡ヶ谷", "初台"]
+
+HOIKUEN_COLUMNS = [
+    "名称", "所在地", "種別", "開始時間", "終了時間", "延長保育終了時間",
+    "0歳児", "1歳児", "2歳児", "3歳児", "4歳児", "5歳児",
+    "3歳児から5歳児", "4歳児から5歳児", "利用可能曜日",
+    "園庭の有無", "駐輪場の有無", "ベビーカー置き場の有無",
+    "障害児の受け入れ体制", "病児保育事業の実施", "収容定員_合計", "緯度", "経度",
+]  # fmt: skip
+
+
+def count_wards(n: int) -> int:
+    return min(MAX_WARDS, max(1, -(-n // FACILITIES_PER_WARD)))
+
+
+def ward_name(ward: int) -> str:
+    if ward < len(WARD_NAMES):
+        return WARD_NAMES[ward]
+    return f"第{ward + 1}区"
+
+
+def ward_code(ward: int) -> str:
+    if ward < len(WARD_CODES):
+        return WARD_CODES[ward]
+    return f"ward{ward + 1:02d}"
+
+
+def ward_origin(ward: int, n_wards: int) -> Tuple[float, float]:
+    """
+    区の南西の角 (区を正方形に近い格子状に並べる)
+    """
+    columns = max(1, round(n_wards**0.5))
+    row, column = divmod(ward, columns)
+    return (ORIGIN[0] + row * WARD_SIZE[0], ORIGIN[1] + column * WARD_SIZE[1])
+
+
+def random_point(rng: random.Random, origin: Tuple[float, float]) -> Tuple[float, float]:
+    return (
+        origin[0] + rng.uniform(0, WARD_SIZE[0]),
+        origin[1] + rng.uniform(0, WARD_SIZE[1]),
+    )
+
+
+def vacancy(rng: random.Random) -> str:
+    return rng.choice(["0", "0", "1", "2", "3", "（なし）", ""])
+
+
+def hoikuen_rows(n: int, rng: random.Random) -> List[List[Dict[str, Any]]]:
+    """
+    区ごとの施設
+    """
+    n_wards = count_wards(n)
+    types = list(get_nursery_type().values())
+    rows: List[List[Dict[str, Any]]] = [[] for _ in range(n_wards)]
+    for i in range(n):
+        ward = i % n_wards
+        lat, lon = random_point(rng, ward_origin(ward, n_wards))
+        town = rng.choice(TOWNS)
+        # 3歳児から5歳児でまとめている施設 (年齢ごとは空欄)
+        grouped = rng.random() < 0.2
+        row = {
+            "名称": f"{ward_name(ward)}{rng.choice(['', 'ひかり', 'さくら', 'シブヤ'])}保育園{i}",
+            "所在地": f"東京都{ward_name(ward)}{town}{rng.randint(1, 5)}-{rng.randint(1, 30)}",
+            "種別": rng.choice(types),
+            "開始時間": rng.choice(["07:00", "07:15", "07:30"]),
+            "終了時間": rng.choice(["18:00", "18:15", "18:30"]),
+            "延長保育終了時間": rng.choice(["", "19:00", "19:30", "20:00", "21:00"]),
+            "0歳児": vacancy(rng),
+            "1歳児": vacancy(rng),
+            "2歳児": vacancy(rng),
+            "3歳児": "" if grouped else vacancy(rng),
+            "4歳児": "" if grouped else vacancy(rng),
+            "5歳児": "" if grouped else vacancy(rng),
+            "3歳児から5歳児": f"{rng.randint(0, 5)}.0" if grouped else "（なし）",
+            "4歳児から5歳児": "（なし）",
+            "利用可能曜日": rng.choice(["", "月〜金", "月〜土", "月〜日"]),
+            "園庭の有無": rng.choice(["", "あり", "なし", "有り"]),
+            "駐輪場の有無": rng.choice(["", "あり", "なし", "有り"]),
+            "ベビーカー置き場の有無": rng.choice(["", "あり", "なし", "有り"]),
+            "障害児の受け入れ体制": rng.choice(["", "あり", "なし"]),
+            "病児保育事業の実施": rng.choice(["", "あり", "なし"]),
+            "収容定員_合計": rng.choice(["", str(rng.randint(12, 250))]),
+            "緯度": f"{lat:.6f}",
+            "経度": f"{lon:.6f}",
+        }
+        rows[ward].append(row)
+    return rows
+
+
+def feature(geometry: Dict[str, Any], **properties: Any) -> Dict[str, Any]:
+    return {"type": "Feature", "properties": properties, "geometry": geometry}
+
+
+def geojson_layers(
+    ward: int, n_wards: int, rng: random.Random
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    区のバス停・バスルート・学校・小学校区 (区ごとに同じ数)
+    """
+    layers: Dict[str, List[Dict[str, Any]]] = {name: [] for name in GEO_LAYER_FILES}
+    origin = ward_origin(ward, n_wards)
+    stops = []
+    for i in range(200):
+        lat, lon = random_point(rng, origin)
+        stops.append([lon, lat])
+        layers["bus_stop"].append(
+            feature(
+                {"type": "Point", "coordinates": [lon, lat]},
+                bus_stop_name=f"{ward_name(ward)}停{i}",
+                bus_operator=rng.choice(["都営", "東急", "京王"]),
+                route_number=f"渋{rng.randint(10, 99)}",
+            )
+        )
+    for i in range(10):
+        line = rng.sample(stops, 8)
+        layers["bus_route"].append(
+            feature({"type": "LineString", "coordinates": line}, route_name=f"路線{i}")
+        )
+    for i in range(40):
+        lat, lon = random_point(rng, origin)
+        layers["school"].append(
+            feature(
+                {"type": "Point", "coordinates": [lon, lat]},
+                school_name=f"{ward_name(ward)}学校{i}",
+                school_class=rng.choice(["小学校", "幼稚園"]),
+            )
+        )
+    # 区を 4x4 に分けた小学校区
+    dlat, dlon = WARD_SIZE[0] / 4, WARD_SIZE[1] / 4
+    for r in range(4):
+        for c in range(4):
+            south, west = origin[0] + r * dlat, origin[1] + c * dlon
+            ring = [
+                [west, south],
+                [west + dlon, south],
+                [west + dlon, south + dlat],
+                [west, south + dlat],
+                [west, south],
+            ]
+            layers["school_area"].append(
+                feature(
+                    {"type": "Polygon", "coordinates": [ring]},
+                    school_name=f"{ward_name(ward)}学校区{r}{c}",
+                )
+            )
+    return layers
+
+
+def write_geojson(path: str, features: List[Dict[str, Any]]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f, ensure_ascii=False)
+
+
+def write_ward(
+    out_dir: str, ward: int, n_wards: int, rows: List[Dict[str, Any]], rng: random.Random
+) -> str:
+    """
+    区の保育園データと地図レイヤーを書き出す (渋谷区以外は ward.json も)
+
+    Returns:
+        保育園データ (CSV) のパス
+    """
+    if ward == 0:
+        csv_path = os.path.join(out_dir, DEFAULT_HOIKUEN_CSV)
+        geo_files = GEO_LAYER_FILES
+    else:
+        ward_dir = os.path.join(out_dir, WARDS_DIR, ward_code(ward))
+        os.makedirs(ward_dir, exist_ok=True)
+        south, west = ward_origin(ward, n_wards)
+        north, east = south + WARD_SIZE[0], west + WARD_SIZE[1]
+        meta = {
+            "name": ward_name(ward),
+            "center": [(south + north) / 2, (west + east) / 2],
+            "bounds": [south, west, north, east],
+        }
+        with open(os.path.join(ward_dir, "ward.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        csv_path = os.path.join(ward_dir, "hoikuen.csv")
+        geo_files = {
+            name: os.path.join(WARDS_DIR, ward_code(ward), path)
+            for name, path in WARD_GEO_FILES.items()
+        }
+
+    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=HOIKUEN_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    for name, features in geojson_layers(ward, n_wards, rng).items():
+        write_geojson(os.path.join(out_dir, geo_files[name]), features)
+    return csv_path
+
+
+def generate(n: int, out_dir: str, seed: int = 0) -> str:
+    """
+    施設数 n の合成データを out_dir/data に書き出す
+
+    前に書き出した区のディレクトリ (data/wards) は消してから書き出す。
+    最後に out_dir/generated.json (施設数・区の数・形式のバージョン) を書き出す。
+
+    Returns:
+        渋谷区の保育園データ (CSV) のパス
+    """
+    rng = random.Random(seed)
+    shutil.rmtree(os.path.join(out_dir, WARDS_DIR), ignore_errors=True)
+    wards = hoikuen_rows(n, rng)
+    paths = [write_ward(out_dir, ward, len(wards), rows, rng) for ward, rows in enumerate(wards)]
+    manifest = {"n": n, "seed": seed, "wards": len(wards), "version": GENERATOR_VERSION}
+    with open(os.path.join(out_dir, "generated.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return paths[0]
+
+
+def read_manifest(out_dir: str) -> Dict[str, Any] | None:
+    """
+    generate が書き出した generated.json (なければ None)
+    """
+    try:
+        with open(os.path.join(out_dir, "generated.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成データを作る")
+    parser.add_argument("n", type=int, help="施設数")
+    parser.add_argument("out_dir")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(generate(args.n, args.out_dir, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+同じ結果を返すはずの実装どうしの比較
+
+    python -m bench.parity [--size 1000] [--forms 300] [--seed 0]
+
+合成データ (bench.generate, bench/data/{施設数}) でランダムな検索フォームを作り、
+次を確かめる。違いがあれば終了コード 1 を返す。bench.run も計測の前に同じ確認をする。
+
+* フィルターエンジン (polars / bitmap) の結果が filter_data と同じ
+* 地図のレンダラー (folium / fast) の地図が同じ (要素名・空白・出力順の違いは無視する)
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+from typing import Any, Dict, List, Tuple
+
+from bench.run import REPO_ROOT, ensure_data, make_app
+
+# ランダムに選ぶチェックボックス
+CHECKBOX_FIELDS = [
+    "garden",
+    "bicycle_parking",
+    "stroller_area",
+    "disability_acceptance",
+    "sick_child_care",
+    "saturday",
+    "sunday",
+]
+
+
+def random_form_items(
+    rng: random.Random, names: List[str], districts: List[str]
+) -> List[Tuple[str, str]]:
+    """
+    ランダムな検索フォームの項目
+
+    年齢は 3〜5歳児 (3歳児から5歳児でまとめている施設の空き状況) と、空欄・「（なし）」で
+    空き状況が null の施設も対象になるように 0〜5歳から選ぶ。
+    """
+    from form_filter import FilterForm
+
+    form = FilterForm(meta={"csrf": False})
+    items = [(name, "y") for name in CHECKBOX_FIELDS if rng.random() < 0.15]
+    items += [("type", code) for code in rng.sample("123456", rng.randint(0, 6))]
+    items += [("age_availability", code) for code in rng.sample("012345", rng.randint(0, 2))]
+    for field in [form.start_time, form.end_time, form.extended_end_time]:
+        items.append((field.name, rng.choice(field.choices)[0]))
+    if rng.random() < 0.5:
+        items.append(("capacity_min", str(rng.choice([0, 20, 60, 120]))))
+    if rng.random() < 0.5:
+        items.append(("capacity_max", str(rng.choice([30, 100, 200, 250]))))
+    if districts and rng.random() < 0.2:
+        items.append(("school_district_name", rng.choice(districts)))
+    if rng.random() < 0.2:
+        items.append(("bus_stop_within", str(rng.choice([50, 100, 300]))))
+    if rng.random() < 0.2:
+        items.append(("elementary_school_within", str(rng.choice([100, 300, 1000]))))
+    if rng.random() < 0.15:
+        name = rng.choice(names)
+        start = rng.randrange(len(name))
+        items.append(("nursery_name", name[start : start + rng.randint(1, 4)]))
+    if rng.random() < 0.1:
+        items.append(("address", rng.choice(["神南", "代々木", "渋谷区 宇田川町"])))
+    return items
+
+
+def check_filter_engines(n_forms: int = 300, seed: int = 0) -> List[str]:
+    """
+    ランダムなフォームで filter_snapshot の各エンジンと filter_data の結果を比べる
+    (リクエストのコンテキストの中で呼ぶ)
+
+    Returns:
+        結果が違ったフォームと件数の説明 (すべて同じなら空)
+    """
+    from werkzeug.datastructures import MultiDict
+
+    import hoiku
+    from form_filter import FilterForm
+    from hoikuen_store import get_hoikuen_snapshot
+    from spatial_join import SCHOOL_DISTRICT_COLUMN
+
+    snapshot = get_hoikuen_snapshot()
+    names = snapshot.df.get_column("名称").to_list()
+    districts = snapshot.df.get_column(SCHOOL_DISTRICT_COLUMN).drop_nulls().unique().to_list()
+    rng = random.Random(seed)
+    mismatches = []
+    for _ in range(n_forms):
+        items = random_form_items(rng, names, sorted(districts))
+        form = FilterForm(MultiDict(items))
+        expected = hoiku.filter_data(snapshot.lazy(), form)
+        for engine in ["polars", "bitmap"]:
+            result = hoiku.filter_snapshot(snapshot, form, engine)
+            if not result.equals(expected):
+                mismatches.append(
+                    f"filter_snapshot.{engine}: {result.height} 件"
+                    f" (filter_data: {expected.height} 件) {items}"
+                )
+    return mismatches
+
+
+# 保育園マーカーの出力 (DispatcherIcon・SharedIconMarker・Tooltip / FastNurseryMarkers)
+GROUP_RE = re.compile(r"var (\w+) = L\.featureGroup\(\s*\{\s*\}\s*\);")
+ICON_RE = re.compile(r"let (\w+) = L\.icon\((\{[^}]*\})\);")
+CLICK_RE = re.compile(r"(\w+)\.on\('click', function \(e\) \{(.*?)\}\);", re.DOTALL)
+ADD_GROUP_RE = re.compile(r"(\w+)\.addTo\((map_\w+)\);")
+MARKER_RE = re.compile(
+    r"var (\w+) = L\.marker\(\s*\[([-\d.e]+), ([-\d.e]+)\],\s*"
+    r"\{icon: (\w+), \"query\": (\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*')\}\s*"
+    r"\)\.addTo\((\w+)\);\s*"
+    r"\1\.bindTooltip\(\s*`<div style=\"([^\"]*)\">\s*((?:[^`\\]|\\.)*?)\s*</div>`,"
+    r"\s*\{\s*\"sticky\": true,?\s*\}\s*\);"
+)
+# 地図を比べる行数の上限 (folium は施設数が多いと遅い)
+MAX_MAP_ROWS = 2000
+# folium の要素名 (クラス名_uuid)
+ELEMENT_NAME_RE = re.compile(r"\b([A-Za-z][A-Za-z_]*?)_[0-9a-f]{32}\b")
+
+
+def normalize_js(text: str) -> str:
+    return " ".join(text.split())
+
+
+def unescape_js(text: str) -> str:
+    """
+    JS の文字列リテラル ('...'・`...`) のエスケープを戻す
+    """
+    return re.sub(r"\\(.)", r"\1", text)
+
+
+def parse_nursery_map(html: str) -> Tuple[List[Any], str]:
+    """
+    地図の HTML を保育園マーカーのグループと、それ以外の部分に分ける
+
+    Returns:
+        グループ (アイコン・クリック処理・マーカーの集合) のソートしたリストと、
+        マーカー部分を除いて要素名を連番にした HTML
+    """
+    groups = {m.group(1) for m in GROUP_RE.finditer(html)}
+    icons = {m.group(1): normalize_js(m.group(2)) for m in ICON_RE.finditer(html)}
+    clicks = {
+        m.group(1): normalize_js(m.group(2).replace(m.group(1), "GROUP"))
+        for m in CLICK_RE.finditer(html)
+        if m.group(1) in groups
+    }
+    added = {m.group(1) for m in ADD_GROUP_RE.finditer(html) if m.group(1) in groups}
+    markers: Dict[str, List[Any]] = {group: [] for group in groups}
+    group_icons: Dict[str, set] = {group: set() for group in groups}
+    for m in MARKER_RE.finditer(html):
+        _, lat, lon, icon, query, group, style, tooltip = m.groups()
+        if query.startswith('"'):
+            query = json.loads(query)
+        else:
+            query = unescape_js(query[1:-1])
+        markers[group].append((float(lat), float(lon), query, unescape_js(tooltip), style))
+        group_icons[group].add(icons.get(icon))
+    parsed = sorted(
+        (
+            sorted(group_icons[group], key=str),
+            clicks.get(group),
+            group in added,
+            sorted(markers[group]),
+        )
+        for group in groups
+    )
+
+    rest = html
+    for pattern in [MARKER_RE, GROUP_RE, ICON_RE, CLICK_RE]:
+        rest = pattern.sub("", rest)
+    rest = ADD_GROUP_RE.sub(lambda m: "" if m.group(1) in groups else m.group(0), rest)
+    names: Dict[str, str] = {}
+
+    def rename(m: re.Match) -> str:
+        return names.setdefault(m.group(0), f"{m.group(1)}_{len(names)}")
+
+    return parsed, normalize_js(ELEMENT_NAME_RE.sub(rename, rest))
+
+
+def check_map_renderers(n_forms: int = 20, seed: int = 0) -> List[str]:
+    """
+    先頭の行・ランダムなフォームで絞り込んだ行 (どちらも MAX_MAP_ROWS 行まで)・
+    引用符を含む名称で、レンダラーごとの地図を比べる (リクエストのコンテキストの中で呼ぶ)
+
+    名称には ` \\ ${ を含めない (folium はツールチップでエスケープしない)。
+
+    Returns:
+        地図が違ったデータの説明 (すべて同じなら空)
+    """
+    import polars as pl
+    from werkzeug.datastructures import MultiDict
+
+    import hoiku
+    from form_filter import FilterForm
+    from hoikuen_store import get_hoikuen_snapshot
+    from mapping import MAP_RENDERERS
+
+    snapshot = get_hoikuen_snapshot()
+    names = snapshot.df.get_column("名称").to_list()
+    rng = random.Random(seed)
+    frames = {
+        "head": snapshot.df.head(MAX_MAP_ROWS),
+        "empty": snapshot.df.head(0),
+        "quotes": snapshot.df.head(3).with_columns(
+            pl.format("{}'\"<b>&{}", pl.col("名称"), pl.int_range(pl.len())).alias("名称")
+        ),
+    }
+    for i in range(n_forms):
+        items = random_form_items(rng, names, [])
+        df = hoiku.filter_snapshot(snapshot, FilterForm(MultiDict(items)))
+        frames[f"form{i}"] = df.head(MAX_MAP_ROWS)
+
+    mismatches = []
+    for label, df in frames.items():
+        parsed = {
+            renderer: parse_nursery_map(build(df).get_root().render())
+            for renderer, build in MAP_RENDERERS.items()
+        }
+        (reference, expected), *others = parsed.items()
+        if len(expected[0]) != df.get_column("種別").n_unique():
+            mismatches.append(f"{reference}[{label}]: 種別ごとのグループが読み取れません")
+        markers = sum(len(group[3]) for group in expected[0])
+        if markers != df.height:
+            mismatches.append(f"{reference}[{label}]: マーカー {markers} 件 ({df.height} 行)")
+        for renderer, result in others:
+            if result[0] != expected[0]:
+                mismatches.append(f"{renderer}[{label}]: マーカーが {reference} と違います")
+            if result[1] != expected[1]:
+                mismatches.append(f"{renderer}[{label}]: マーカー以外が {reference} と違います")
+    return mismatches
+
+
+def run_checks(n_forms: int, seed: int) -> List[str]:
+    """
+    すべての比較 (データのディレクトリで呼ぶ)
+    """
+    app = make_app()
+    with app.test_request_context():
+        return check_filter_engines(n_forms, seed) + check_map_renderers(
+            max(1, n_forms // 10), seed
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="同じ結果を返すはずの実装どうしの比較")
+    parser.add_argument("--size", type=int, default=1000, help="施設数")
+    parser.add_argument("--forms", type=int, default=300, help="ランダムなフォームの数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data_dir = ensure_data(args.size)
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(data_dir)
+    from build_snapshots import build_ward_snapshots
+    from wards import get_ward
+
+    build_ward_snapshots(get_ward(None))
+    mismatches = run_checks(args.forms, args.seed)
+    for line in mismatches:
+        print(f"MISMATCH {line}")
+    if mismatches:
+        sys.exit(1)
+    print(f"OK: {args.forms} 件のフォームで結果・地図が一致しました", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
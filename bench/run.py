@@ -0,0 +1,485 @@
+"""
+ベンチマーク
+
+    python -m bench.run [--sizes 100,1000,10000,100000] [--save bench/baselines/local.json]
+    python -m bench.run --sizes 100,1000 --compare bench/baselines/local.json
+
+施設数ごとに合成データ (bench.generate, bench/data/{施設数} に作って使い回す) を用意し、
+別プロセスで次を計測する。計測の前に bench.parity でフィルターエンジンの結果と
+地図のレンダラーの出力を比べ、違いがあれば失敗する。
+
+* データの読み込み (load_hoikuen_csv, スナップショット)
+* hoiku.py のフィルター関数ごとの filter
+* 代表的なフォームの組み合わせでの compile_filter (キャッシュの有無) / filter_data / filter_snapshot
+* 地図の作成 (folium / fast)
+* Flask のテストクライアントでの /search_result, /view, /list などのレスポンス
+* 1つの区と複数の区の検索、名称ハッシュ → 区の索引 (ward/*)
+
+結果は JSON (ベンチマーク名 → 回数・最小・中央値・p95 [ms])。--compare で比較し、
+中央値が threshold 倍より遅くなったものがあれば終了コード 1 を返す。
+ネットワークには接続しない (地図のタイル・CDN は HTML に埋め込まれるだけ)。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import types
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+DATA_DIR = os.path.join(REPO_ROOT, "bench", "data")
+# 計測の前に結果を比べるランダムなフォームの数 (bench.parity)
+PARITY_FORMS = 100
+
+# 代表的なフォームの組み合わせ (FilterForm の項目)
+ALL_TYPES = [("type", code) for code in ["1", "2", "3", "4", "5", "6"]]
+FORMS: Dict[str, List[tuple]] = {
+    "default": ALL_TYPES,
+    "ages": ALL_TYPES + [("age_availability", "0"), ("age_availability", "1")],
+    "weekend_facilities": ALL_TYPES
+    + [("saturday", "y"), ("garden", "y"), ("stroller_area", "y")],
+    "private_only": [("type", "3"), ("type", "4")],
+    "name": ALL_TYPES + [("nursery_name", "さくら")],
+    "address": ALL_TYPES + [("address", "渋谷区 神南")],
+    "narrow": [("type", "1"), ("type", "3")]
+    + [("age_availability", "2"), ("sunday", "y"), ("capacity_min", "60")]
+    + [("start_time", "07/00/07/15"), ("extended_end_time", "20/00/21/30")],
+    "nearby_k10": ALL_TYPES + [("lat", "35.66"), ("lon", "139.70"), ("k", "10")],
+    "radius_1km": ALL_TYPES + [("lat", "35.66"), ("lon", "139.70"), ("radius", "1000")],
+}
+
+# ベンチマークのテンプレートがない場合の代わり (地図の HTML とデータを埋め込むだけ)
+STAND_IN_TEMPLATES = {
+    "hoikuen/index.html": "{{ form }}",
+    "hoikuen/search_result.html": "{{ map_html|safe }}{{ data }}{{ messages }}",
+    "hoikuen/map.html": "{{ map_html|safe }}",
+    "hoikuen/view.html": "{{ row }}",
+    "hoikuen/view_full.html": "{{ row }}",
+    "hoikuen/view_error.html": "{{ messages }}",
+    "hoikuen/list.html": "{{ df }}",
+    "hoikuen/list_full.html": "{{ df }}",
+}
+
+
+class Timer:
+    """
+    関数を繰り返し実行して時間を集計する
+
+    少なくとも min_runs 回、合計が budget 秒を超えるか repeat 回になるまで実行する。
+    """
+
+    def __init__(self, repeat: int, budget: float, min_runs: int = 3):
+        self.repeat = repeat
+        self.budget = budget
+        self.min_runs = min_runs
+        self.results: Dict[str, Dict[str, float]] = {}
+
+    def measure(
+        self, name: str, func: Callable[[], Any], setup: Callable[[], Any] | None = None
+    ) -> None:
+        times: List[float] = []
+        total = 0.0
+        while len(times) < self.repeat and (len(times) < self.min_runs or total < self.budget):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            times.append(elapsed * 1000)
+            total += elapsed
+        times.sort()
+        self.results[name] = {
+            "n": len(times),
+            "min_ms": round(times[0], 4),
+            "median_ms": round(statistics.median(times), 4),
+            "p95_ms": round(times[min(len(times) - 1, int(len(times) * 0.95))], 4),
+        }
+        print(f"  {name}: {self.results[name]['median_ms']:.3f} ms", file=sys.stderr)
+
+
+def ensure_version_module() -> None:
+    """
+    アプリのバージョン (__version__.py、デプロイ時に作る) がなければ仮のものを使う
+    """
+    try:
+        import __version__  # noqa: F401
+    except ModuleNotFoundError:
+        module = types.ModuleType("__version__")
+        module.VERSION = "bench"  # type: ignore[attr-defined]
+        sys.modules["__version__"] = module
+
+
+def make_app():
+    """
+    ベンチマーク用の Flask アプリ (views_hoikuen の関数を登録する)
+    """
+    from flask import Flask
+    from jinja2 import ChoiceLoader, DictLoader, FileSystemLoader
+
+    ensure_version_module()
+    import views_hoikuen as views
+
+    app = Flask(__name__, root_path=REPO_ROOT)
+    app.config.update(SECRET_KEY="bench", WTF_CSRF_ENABLED=False, TESTING=True)
+    app.jinja_loader = ChoiceLoader(
+        [
+            FileSystemLoader(os.path.join(REPO_ROOT, "templates")),
+            DictLoader(STAND_IN_TEMPLATES),
+        ]
+    )
+    routes = {
+        "/hoikuen/": views.fn_hoikuen_index,
+        "/hoikuen/search_result": views.fn_hoikuen_search_result,
+        "/hoikuen/view": views.fn_hoikuen_view,
+        "/hoikuen/list": views.fn_hoikuen_list,
+        "/hoikuen/markers": views.fn_hoikuen_markers,
+        "/hoikuen/map_shell": views.fn_hoikuen_map_shell,
+        "/hoikuen/viewport": views.fn_hoikuen_viewport,
+        "/hoikuen/suggest": views.fn_hoikuen_suggest,
+        "/hoikuen/metrics": views.fn_hoikuen_metrics,
+    }
+    for rule, func in routes.items():
+        app.add_url_rule(rule, view_func=func, methods=["GET", "POST"])
+    return app
+
+
+def bench_load(timer: Timer, csv_path: str) -> None:
+    from hoikuen_store import HoikuenStore, file_digest
+    from util import build_hoikuen_snapshot, load_hoikuen_csv, load_hoikuen_table
+
+    timer.measure("load/load_hoikuen_csv", lambda: load_hoikuen_csv(csv_path).collect())
+    digest = file_digest(csv_path)
+    build_hoikuen_snapshot(csv_path, digest)
+    timer.measure("load/load_hoikuen_table(snapshot)", lambda: load_hoikuen_table(csv_path, digest))
+    timer.measure("load/HoikuenStore.get(cold)", lambda: HoikuenStore(csv_path).get())
+
+
+def bench_filter_helpers(timer: Timer) -> None:
+    import polars as pl
+
+    import hoiku
+    from hoikuen_store import get_hoikuen_snapshot
+
+    df = get_hoikuen_snapshot().df
+    helpers = {
+        "cond_holiday": hoiku.cond_holiday(pl.col("利用可能曜日"), 1, 0),
+        "cond_list": hoiku.cond_list(pl.col("種別"), ["区立保育園", "私立保育園"]),
+        "start_time": hoiku.start_time(pl.col("開始時間"), (7, 15)),
+        "end_time": hoiku.end_time(pl.col("終了時間"), (18, 15)),
+        "between_num_filter": hoiku.between_num_filter(pl.col("収容定員_合計"), 30, 120),
+        "vacancy_by_age": hoiku.vacancy_by_age(["0歳児", "1歳児"]),
+        "has_or_not": hoiku.has_or_not(pl.col("園庭の有無"), 1),
+        "str_contain_filter": hoiku.str_contain_filter(pl.col("名称"), "さくら"),
+        "str_eq_filter": hoiku.str_eq_filter(pl.col("小学校区"), "渋谷区学校区11"),
+        "max_num_filter": hoiku.max_num_filter(pl.col("最寄りバス停までの距離"), 200),
+    }
+    for name, expr in helpers.items():
+        timer.measure(f"helper/{name}", lambda expr=expr: df.filter(expr))
+
+
+def bench_forms(timer: Timer, app) -> None:
+    from werkzeug.datastructures import MultiDict
+
+    import hoiku
+    from form_filter import FilterForm
+    from hoikuen_store import get_hoikuen_snapshot
+
+    snapshot = get_hoikuen_snapshot()
+    with app.test_request_context():
+        for name, items in FORMS.items():
+            form = FilterForm(MultiDict(items))
+            # 形ごとのキャッシュなし (build_conditions) ・初回 (cold) ・2回目以降 (warm)
+            timer.measure(
+                f"filter/build_conditions[{name}]", lambda: hoiku.build_conditions(form)
+            )
+            timer.measure(
+                f"filter/compile_filter[{name}]",
+                lambda: hoiku.compile_filter(form),
+                setup=lambda: (hoiku.compiled_cache.clear(), hoiku.condition_cache.clear()),
+            )
+            timer.measure(
+                f"filter/compile_filter.warm[{name}]", lambda: hoiku.compile_filter(form)
+            )
+            timer.measure(
+                f"filter/filter_data[{name}]", lambda: hoiku.filter_data(snapshot.lazy(), form)
+            )
+            for engine in ["polars", "bitmap"]:
+                timer.measure(
+                    f"filter/filter_snapshot.{engine}[{name}]",
+                    lambda: hoiku.filter_snapshot(snapshot, form, engine),
+                    setup=hoiku.filter_cache.clear,
+                )
+
+
+def bench_maps(timer: Timer) -> None:
+    from hoikuen_store import get_hoikuen_snapshot
+    from mapping import MAP_RENDERERS
+
+    df = get_hoikuen_snapshot().df
+    for renderer, build in MAP_RENDERERS.items():
+        timer.measure(
+            f"map/{renderer}", lambda build=build: build(df).get_root().render()
+        )
+
+
+def request(client, method: str, path: str, items: List[tuple]) -> None:
+    """
+    テストクライアントでのリクエスト (200 以外は例外)
+    """
+    from werkzeug.datastructures import MultiDict
+
+    if method == "POST":
+        response = client.post(path, data=MultiDict(items))
+    else:
+        response = client.get(path, query_string=MultiDict(items))
+    response.get_data()  # ストリーミングのレスポンスも最後まで読む
+    if response.status_code != 200:
+        raise RuntimeError(f"{path}: {response.status_code}")
+
+
+def bench_routes(timer: Timer, app) -> None:
+    import hoiku
+    from hoikuen_store import get_hoikuen_snapshot
+
+    name = get_hoikuen_snapshot().df.get_column("名称")[0]
+    client = app.test_client()
+    requests = {
+        "search_result[default]": ("POST", "/hoikuen/search_result", FORMS["default"]),
+        "search_result[ages]": ("POST", "/hoikuen/search_result", FORMS["ages"]),
+        "search_result[narrow]": ("POST", "/hoikuen/search_result", FORMS["narrow"]),
+        "search_result[nearby_k10]": ("POST", "/hoikuen/search_result", FORMS["nearby_k10"]),
+        "search_result?client=1[default]": (
+            "POST", "/hoikuen/search_result?client=1", FORMS["default"]
+        ),
+        "search_result?json=1[default]": (
+            "POST", "/hoikuen/search_result?json=1", FORMS["default"]
+        ),
+        "search_result?json=1[name]": ("POST", "/hoikuen/search_result?json=1", FORMS["name"]),
+        "markers[default]": ("GET", "/hoikuen/markers", FORMS["default"]),
+        "viewport[default]": (
+            "GET",
+            "/hoikuen/viewport",
+            FORMS["default"] + [("bbox", "35.65,139.68,35.67,139.71"), ("zoom", "15")],
+        ),
+        "view?q": ("GET", "/hoikuen/view", [("q", name), ("qex", "y")]),
+        "view?q&json=1": ("GET", "/hoikuen/view", [("q", name), ("json", "y")]),
+        "list?q": ("GET", "/hoikuen/list", [("q", "さくら")]),
+        "list?json=1": ("GET", "/hoikuen/list", [("json", "y")]),
+        "suggest": ("GET", "/hoikuen/suggest", [("q", name[:3])]),
+    }  # fmt: skip
+    for label, (method, path, items) in requests.items():
+        # 絞り込み結果のキャッシュは使わない (毎回フィルターする)
+        timer.measure(
+            f"route/{label}",
+            lambda method=method, path=path, items=items: request(client, method, path, items),
+            setup=hoiku.filter_cache.clear,
+        )
+
+
+def bench_wards(timer: Timer, app) -> None:
+    """
+    1つの区と複数の区の検索・名称ハッシュ → 区の索引
+
+    区の数だけが違う施設数 (100 は1区、1000 は 10区、どちらも1区 100 施設) の
+    ward/*[single] を比べると、区を増やした時の1つの区の検索の遅れがわかる。
+    """
+    from werkzeug.datastructures import MultiDict
+
+    import hoiku
+    from form_filter import FilterForm
+    from spatial_index import union_bbox
+    from wards import DEFAULT_WARD, get_wards, select_wards, ward_of_hash, ward_snapshot
+
+    wards = list(get_wards().values())
+    area = union_bbox([ward.bounds for ward in wards])
+    bbox = ",".join(str(v) for v in area)
+    # 区の境界をまたぐ半径の周辺検索 (渋谷区の北東の角)
+    corner = [("lat", str(wards[0].bounds.north)), ("lon", str(wards[0].bounds.east))]
+    forms = {
+        "single": FORMS["default"] + [("ward", DEFAULT_WARD)],
+        "radius_corner": FORMS["default"] + corner + [("radius", "2000")],
+    }
+    with app.test_request_context():
+        form = FilterForm(MultiDict(FORMS["default"]))
+        timer.measure(
+            "ward/filter_snapshots[single]",
+            lambda: hoiku.filter_snapshots([ward_snapshot(wards[0])], form),
+            setup=hoiku.filter_cache.clear,
+        )
+        timer.measure(
+            "ward/filter_snapshots[all]",
+            lambda: hoiku.filter_snapshots([ward_snapshot(w) for w in wards], form),
+            setup=hoiku.filter_cache.clear,
+        )
+    timer.measure("ward/select_wards[bbox]", lambda: select_wards(None, area))
+
+    # 最後の区の施設 (索引の読み直しは初回だけ)
+    hashstr = ward_snapshot(wards[-1]).names.hashes[-1]
+    timer.measure("ward/ward_of_hash", lambda: ward_of_hash(hashstr))
+    timer.measure("ward/ward_of_hash[missing]", lambda: ward_of_hash("0" * 11))
+
+    client = app.test_client()
+    requests = {
+        "search_result[single]": ("POST", "/hoikuen/search_result", forms["single"]),
+        "search_result[radius_corner]": ("POST", "/hoikuen/search_result", forms["radius_corner"]),
+        "viewport[all]": (
+            "GET", "/hoikuen/viewport", FORMS["default"] + [("bbox", bbox), ("zoom", "13")]
+        ),
+        "view?h": ("GET", "/hoikuen/view", [("h", hashstr)]),
+    }  # fmt: skip
+    for label, (method, path, items) in requests.items():
+        timer.measure(
+            f"ward/{label}",
+            lambda method=method, path=path, items=items: request(client, method, path, items),
+            setup=hoiku.filter_cache.clear,
+        )
+
+
+def run_worker(size: int, data_dir: str, repeat: int, budget: float) -> Dict[str, Any]:
+    """
+    1つの施設数の計測 (データのディレクトリに移動して別プロセスで実行する)
+    """
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(data_dir)
+    csv_path = os.path.join("data", "hoikuen.csv")
+    timer = Timer(repeat, budget)
+
+    print(f"[{size}]", file=sys.stderr)
+    # すべての区の空間結合などのスナップショットと名称ハッシュ → 区の索引を作ってから
+    # 計測する (デプロイ前の build_snapshots.py)
+    from build_snapshots import build_ward_snapshots
+    from hoikuen_store import get_hoikuen_snapshot
+    from wards import build_ward_hash_index, get_wards
+
+    for ward in get_wards().values():
+        build_ward_snapshots(ward)
+    build_ward_hash_index()
+    # 同じ結果を返すはずの実装が食い違っていれば計測しない
+    from bench.parity import run_checks
+
+    mismatches = run_checks(PARITY_FORMS, seed=size)
+    if mismatches:
+        raise RuntimeError("results differ:\n" + "\n".join(mismatches))
+    bench_load(timer, csv_path)
+    get_hoikuen_snapshot(csv_path)
+    app = make_app()
+    bench_filter_helpers(timer)
+    bench_forms(timer, app)
+    with app.test_request_context():
+        bench_maps(timer)
+    bench_routes(timer, app)
+    bench_wards(timer, app)
+    return timer.results
+
+
+def ensure_data(size: int, regenerate: bool = False) -> str:
+    """
+    施設数 size の合成データのディレクトリ (ないか形式が古ければ作る)
+    """
+    from bench.generate import GENERATOR_VERSION, generate, read_manifest
+
+    data_dir = os.path.join(DATA_DIR, str(size))
+    manifest = read_manifest(data_dir)
+    if regenerate or manifest is None or manifest.get("version") != GENERATOR_VERSION:
+        print(f"generating {size} facilities -> {data_dir}", file=sys.stderr)
+        generate(size, data_dir)
+    return data_dir
+
+
+def compare(
+    results: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_diff_ms: float
+) -> List[str]:
+    """
+    基準より中央値が threshold 倍以上遅いベンチマーク
+
+    min_diff_ms 未満の差は誤差として無視する。
+    """
+    regressions = []
+    for size, benches in results["results"].items():
+        base_benches = baseline["results"].get(size, {})
+        for name, stats in benches.items():
+            base = base_benches.get(name)
+            if base is None:
+                continue
+            ratio = stats["median_ms"] / max(base["median_ms"], 1e-9)
+            if ratio > threshold and stats["median_ms"] - base["median_ms"] > min_diff_ms:
+                regressions.append(
+                    f"[{size}] {name}: {base['median_ms']:.3f} -> {stats['median_ms']:.3f} ms"
+                    f" (x{ratio:.2f})"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ベンチマーク")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--repeat", type=int, default=20, help="最大の繰り返し回数")
+    parser.add_argument("--budget", type=float, default=2.0, help="ベンチマークごとの目安 [秒]")
+    parser.add_argument("--regenerate", action="store_true", help="合成データを作り直す")
+    parser.add_argument("--save", help="結果を保存する JSON")
+    parser.add_argument("--compare", help="比較する基準の JSON")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    parser.add_argument("--min-diff", type=float, default=0.5, help="誤差とみなす差 [ms]")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        results = run_worker(args.worker, args.data_dir, args.repeat, args.budget)
+        print(json.dumps(results, ensure_ascii=False))
+        return
+
+    results: Dict[str, Any] = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "budget": args.budget,
+        },
+        "results": {},
+    }
+    for size in [int(s) for s in args.sizes.split(",")]:
+        data_dir = ensure_data(size, args.regenerate)
+        # 施設数ごとに別プロセス (プロセス内キャッシュを持ち越さない)
+        worker = subprocess.run(
+            [
+                sys.executable, "-m", "bench.run",
+                "--worker", str(size), "--data-dir", data_dir,
+                "--repeat", str(args.repeat), "--budget", str(args.budget),
+            ],
+            cwd=REPO_ROOT,
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        )  # fmt: skip
+        results["results"][str(size)] = json.loads(worker.stdout.splitlines()[-1])
+
+    output = json.dumps(results, ensure_ascii=False, indent=1)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"saved: {args.save}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_diff)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"OK: {args.compare} との差は x{args.threshold} 以内", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
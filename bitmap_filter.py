@@ -0,0 +1,110 @@
+from typing import Dict, List
+
+import numpy as np
+import polars as pl
+
+from cache import LRUCache
+from hoikuen_store import HoikuenSnapshot
+
+# これ以下の種類数のカラムは値ごとのビットマップを持つ
+MAX_CARDINALITY = 256
+
+
+class ColumnBitmaps:
+    """
+    1カラム分のビットマップ (値ごとに np.packbits したビット列)
+    """
+
+    def __init__(self, series: pl.Series):
+        self.name = series.name
+        self.values = series.unique(maintain_order=True)
+        self.bitmaps: List[np.ndarray] = []
+        for value in self.values:
+            if value is None:
+                mask = series.is_null()
+            else:
+                mask = (series == value).fill_null(False)
+            self.bitmaps.append(np.packbits(mask.to_numpy()))
+
+    def select(self, condition: pl.Expr) -> np.ndarray:
+        """
+        条件を満たす値のビットマップの OR
+
+        条件は値の一覧に対して評価するので、null の扱いも Polars の filter と同じになる。
+        """
+        matched = (
+            pl.DataFrame([self.values])
+            .select(condition.fill_null(False))
+            .to_series()
+            .to_numpy()
+        )
+        result = np.zeros_like(self.bitmaps[0])
+        for bitmap in (b for b, m in zip(self.bitmaps, matched) if m):
+            result |= bitmap
+        return result
+
+
+class BitmapIndex:
+    """
+    保育園データのビットマップ索引
+
+    種類数の少ないカラム (種別・あり/なし・曜日・空き状況など) は値ごとのビットマップを持ち、
+    条件はビット列の AND で評価する。それ以外のカラムは都度カラムを評価する。
+    """
+
+    def __init__(self, df: pl.DataFrame, max_cardinality: int = MAX_CARDINALITY):
+        self.df = df
+        self.height = df.height
+        self.columns: Dict[str, ColumnBitmaps] = {}
+        # 条件式ごとのビット列 (同じ条件は何度も来る)
+        self._selections = LRUCache(maxsize=1024)
+        if df.height == 0:
+            return
+        for series in df.iter_columns():
+            if series.n_unique() <= max_cardinality:
+                self.columns[series.name] = ColumnBitmaps(series)
+
+    def select(self, condition: pl.Expr) -> np.ndarray | None:
+        """
+        条件を満たす行のビット列。すべての行が対象なら None
+        """
+        names = condition.meta.root_names()
+        if not names:
+            # pl.lit(True) など
+            return None
+        # str() では is_in のリストが省略されるのでシリアライズしたものをキーにする
+        key = condition.meta.serialize()
+        bitmap = self._selections.get(key)
+        if bitmap is not None:
+            return bitmap
+        if len(names) == 1 and names[0] in self.columns:
+            bitmap = self.columns[names[0]].select(condition)
+        else:
+            mask = self.df.select(condition.fill_null(False)).to_series().to_numpy()
+            bitmap = np.packbits(mask)
+        self._selections.set(key, bitmap)
+        return bitmap
+
+    def filter(self, conditions: List[pl.Expr]) -> pl.DataFrame:
+        """
+        すべての条件を満たす行の DataFrame (元の行順)
+        """
+        if self.height == 0:
+            return self.df
+        bitmaps = [b for b in (self.select(c) for c in conditions) if b is not None]
+        if not bitmaps:
+            return self.df
+        selected = np.bitwise_and.reduce(bitmaps)
+        rows = np.flatnonzero(np.unpackbits(selected, count=self.height))
+        return self.df[rows]
+
+
+def get_bitmap_index(snapshot: HoikuenSnapshot) -> BitmapIndex:
+    return snapshot.derived("bitmap_index", lambda s: BitmapIndex(s.df))
+
+
+def filter_bitmap(snapshot: HoikuenSnapshot, conditions: List[pl.Expr]) -> pl.DataFrame:
+    """
+    ビットマップ索引でフィルターする (filter_data と同じ結果を返す)
+    """
+    return get_bitmap_index(snapshot).filter(conditions)
@@ -0,0 +1,62 @@
+"""
+データのスナップショットを作成する
+
+    python build_snapshots.py [区のコード ...]
+
+区ごと (省略時はすべての区、wards.py) に以下を作る。渋谷区の場合:
+
+* 保育園データ: data/hoikuen.arrow (Arrow IPC)
+* 地図レイヤー: data/geojson/*.parquet (GeoParquet, 経度/緯度の列つき)
+* 空間結合: data/hoikuen_joins.arrow (小学校区・最寄りのバス停・最寄りの小学校)
+
+最後にすべての区の名称ハッシュ → 区の索引 (data/ward_hashes.json、固定リンク用) を作る。
+
+CSV・GeoJSON を更新したらデプロイ前に実行する。保育園データ・地図レイヤーの
+スナップショットがない・古い場合はアプリは CSV・GeoJSON から読み込むが、空間結合は
+アプリでは計算しない (この間は小学校区・最寄りのバス停などが null になり、それらでの
+絞り込みは 400 を返す)。作り直したスナップショットはアプリが再起動なしで読み直す。
+"""
+import argparse
+from typing import List, Tuple, cast
+
+from geodata import GeoDataRegistry
+from hoikuen_store import file_digest
+from spatial_join import build_spatial_joins, spatial_joins_path
+from util import build_hoikuen_snapshot, load_hoikuen_table
+from wards import Ward, build_ward_hash_index, get_ward, get_wards, ward_layers
+
+
+def build_ward_snapshots(ward: Ward) -> List[Tuple[str, str]]:
+    """
+    区のスナップショットをすべて作る
+
+    Returns:
+        (元のファイル, 書き出したファイル) のリスト
+    """
+    built = []
+    digest = file_digest(ward.csv)
+    built.append((ward.csv, build_hoikuen_snapshot(ward.csv, digest=digest)))
+
+    layers = cast(GeoDataRegistry, ward_layers([ward]))
+    for name, path in layers.build_cache().items():
+        built.append((layers.files[name], path))
+
+    build_spatial_joins(load_hoikuen_table(ward.csv, digest), ward.csv, digest, layers)
+    built.append((ward.csv, spatial_joins_path(ward.csv)))
+    return built
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="データのスナップショットを作成する")
+    parser.add_argument("wards", nargs="*", help="区のコード (省略時はすべて)")
+    args = parser.parse_args()
+
+    wards = [get_ward(code) for code in args.wards] or list(get_wards().values())
+    for ward in wards:
+        for source, path in build_ward_snapshots(ward):
+            print(f"{source} -> {path}")
+    print(f"wards -> {build_ward_hash_index()}")
+
+
+if __name__ == "__main__":
+    main()
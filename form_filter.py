@@ -6,6 +6,8 @@ from wtforms import (
     SubmitField,
     StringField,
     SelectField,
+    FloatField,
+    IntegerField,
 )
 from wtforms.validators import DataRequired, Optional
 from wtforms.validators import StopValidation, NumberRange
@@ -39,7 +41,6 @@ class QuadNumbersSelectField(SelectField):
     def to_numbers(self) -> List[int]:
         if self.data is None:
             return [0, 0, 0, 0]
-        print("aaa" + self.data)
         numbers = [
             int(x.strip()) for x in self.data.split("/")
         ]  # NOQA: I don't check if len is 4
@@ -117,6 +118,17 @@ class FilterForm(FlaskForm):
     school_district = BooleanField("小学校区", default=False)
     capacity_min = IntegerRangeField("最低定員", default=0, validators=[NumberRange(min=0, max=999)] )
     capacity_max = IntegerRangeField("最大定員", default=200, validators=[NumberRange(min=0, max=999)])
+    # 空間結合したカラム (spatial_join)
+    school_district_name = StringField("小学校区", validators=[Optional()])
+    bus_stop_within = IntegerField("バス停までの距離(m)", validators=[Optional(), NumberRange(min=0, max=50000)])
+    elementary_school_within = IntegerField("小学校までの距離(m)", validators=[Optional(), NumberRange(min=0, max=50000)])
+    # 地点の周辺検索 (lat/lon と radius・k のどちらか)
+    lat = FloatField("緯度", validators=[Optional(), NumberRange(min=-90, max=90)])
+    lon = FloatField("経度", validators=[Optional(), NumberRange(min=-180, max=180)])
+    radius = IntegerField("半径(m)", validators=[Optional(), NumberRange(min=1, max=50000)])
+    k = IntegerField("件数", validators=[Optional(), NumberRange(min=1, max=1000)])
+    # 区 (wards.py のコード。省略時は渋谷区、周辺検索では地点の周りの区)
+    ward = StringField("区", validators=[Optional()])
     submit = SubmitField("この条件で探す")
 
     def to_dict(self):
@@ -0,0 +1,29 @@
+"""
+地図レイヤーの元ファイル (GeoJSON)
+
+ETag や空間結合のキャッシュの確認はファイルの mtime だけで済むので、
+geodata (geopandas を使うレジストリ) を読み込まずに使えるようにここに置く。
+"""
+import os
+from typing import Dict
+
+# 地図に重ねるレイヤー (国土数値情報)
+GEO_LAYER_FILES = {
+    "bus_stop": "data/geojson/shibuya_busstop.geojson",
+    "bus_route": "data/geojson/shibuya_busline.geojson",
+    "school": "data/geojson/shibuya_school.geojson",
+    "school_area": "data/geojson/shibuya_schoolarea.geojson",
+}
+
+
+def source_versions(files: Dict[str, str]) -> Dict[str, int | None]:
+    """
+    レイヤー名 → 元ファイルの mtime (ファイルがなければ None)
+    """
+    versions: Dict[str, int | None] = {}
+    for name, filename in files.items():
+        try:
+            versions[name] = os.stat(filename).st_mtime_ns
+        except FileNotFoundError:
+            versions[name] = None
+    return versions
@@ -0,0 +1,178 @@
+import os
+import threading
+from typing import TYPE_CHECKING, Dict, Hashable, List
+
+from geo_sources import GEO_LAYER_FILES, source_versions
+from metrics import stage
+
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+# 経度/緯度の列を事前に計算するポイントレイヤー
+POINT_LAYERS = {"bus_stop", "school"}
+
+
+class GeoDataRegistry:
+    """
+    GeoJSON レイヤーのプロセス内キャッシュ
+
+    各レイヤーは初めて必要になった時に読み込み、以降は元ファイルの mtime が変わるまで
+    メモリ上のものを使う。GeoParquet のキャッシュ (build_cache) が GeoJSON より新しければ
+    そちらを読む。
+    """
+
+    def __init__(self, files: Dict[str, str] = GEO_LAYER_FILES, name: str = "shibuya"):
+        self.files = files
+        self.name = name  # 区のコード (キャッシュのキー)
+        self._lock = threading.Lock()
+        # レイヤー名 → (読み込み時のファイル mtime, レイヤー)
+        self._layers: Dict[str, tuple[int, "gpd.GeoDataFrame"]] = {}
+        # 学校の種類 → (学校レイヤーのバージョン, 絞り込んだレイヤー)
+        self._school_classes: Dict[str, tuple[int, "gpd.GeoDataFrame"]] = {}
+
+    def get(self, name: str) -> "gpd.GeoDataFrame":
+        """
+        レイヤーを取得 (元ファイルが更新されていれば読み直す)
+
+        ポイントレイヤーには「経度」「緯度」の列が追加済み
+        """
+        return self._get(name)[1]
+
+    def _get(self, name: str) -> tuple[int, "gpd.GeoDataFrame"]:
+        version = os.stat(self.files[name]).st_mtime_ns
+        cached = self._layers.get(name)
+        if cached is not None and cached[0] == version:
+            return cached
+        with self._lock:
+            cached = self._layers.get(name)
+            if cached is None or cached[0] != version:
+                with stage("geodata_load"):
+                    cached = self._layers[name] = (version, self._load(name))
+            return cached
+
+    def version(self, name: str) -> int:
+        """
+        レイヤーのバージョン (読み込んだファイルの mtime)
+        """
+        return self._get(name)[0]
+
+    def source_versions(self) -> Dict[str, int | None]:
+        """
+        全レイヤーの元ファイルの mtime (レイヤーは読み込まない、ファイルがなければ None)
+        """
+        return source_versions(self.files)
+
+    def school_class(self, school_class: str) -> "gpd.GeoDataFrame":
+        """
+        学校レイヤーを種類 (小学校 / 幼稚園) で絞り込んだもの
+        """
+        version, school = self._get("school")
+        cached = self._school_classes.get(school_class)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with self._lock:
+            cached = self._school_classes.get(school_class)
+            if cached is None or cached[0] != version:
+                layer = school[school["school_class"] == school_class]
+                cached = self._school_classes[school_class] = (version, layer)
+            return cached[1]
+
+    def _load(self, name: str) -> "gpd.GeoDataFrame":
+        filename = self.files[name]
+        cache_path = geo_cache_path(filename)
+        if (
+            os.path.exists(cache_path)
+            and os.stat(cache_path).st_mtime_ns >= os.stat(filename).st_mtime_ns
+        ):
+            import geopandas as gpd
+
+            return gpd.read_parquet(cache_path)
+        return read_geo_layer(name, filename)
+
+    def build_cache(self) -> Dict[str, str]:
+        """
+        全レイヤーを GeoParquet に書き出す (GeoJSON がないレイヤーは飛ばす)
+
+        Returns:
+            レイヤー名 → 書き出したファイルのパス
+        """
+        paths = {}
+        for name, filename in self.files.items():
+            if not os.path.exists(filename):
+                continue
+            path = geo_cache_path(filename)
+            tmp_path = path + ".tmp"
+            read_geo_layer(name, filename).to_parquet(tmp_path)
+            os.replace(tmp_path, path)
+            paths[name] = path
+        return paths
+
+
+def geo_cache_path(filename: str) -> str:
+    """
+    GeoJSON に対応する GeoParquet のパス
+    """
+    return os.path.splitext(filename)[0] + ".parquet"
+
+
+def read_geo_layer(name: str, filename: str) -> "gpd.GeoDataFrame":
+    """
+    GeoJSON を読み込み、ポイントレイヤーには「経度」「緯度」の列を追加する
+    """
+    import geopandas as gpd
+
+    layer = gpd.read_file(filename)
+    if name in POINT_LAYERS:
+        layer["経度"] = layer.geometry.x
+        layer["緯度"] = layer.geometry.y
+    return layer
+
+
+class MergedGeoData:
+    """
+    複数の区のレイヤーを連結したもの (GeoDataRegistry と同じ読み出し方)
+
+    区ごとのレイヤーは各 GeoDataRegistry が読み込んだものを使う。
+    """
+
+    def __init__(self, registries: List[GeoDataRegistry]):
+        self.registries = registries
+        self.name = "+".join(registry.name for registry in registries)
+        self._lock = threading.Lock()
+        # (レイヤー名 or (レイヤー名, 学校の種類)) → (バージョン, 連結したレイヤー)
+        self._layers: Dict[Hashable, tuple[Hashable, "gpd.GeoDataFrame"]] = {}
+
+    def _merged(self, key: Hashable, name: str, parts: List["gpd.GeoDataFrame"]):
+        import pandas as pd
+        import geopandas as gpd
+
+        version = self.version(name)
+        with self._lock:
+            cached = self._layers.get(key)
+            if cached is None or cached[0] != version:
+                merged = gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), crs=parts[0].crs)
+                cached = self._layers[key] = (version, merged)
+            return cached[1]
+
+    def get(self, name: str) -> "gpd.GeoDataFrame":
+        return self._merged(name, name, [r.get(name) for r in self.registries])
+
+    def school_class(self, school_class: str) -> "gpd.GeoDataFrame":
+        parts = [r.school_class(school_class) for r in self.registries]
+        return self._merged(("school", school_class), "school", parts)
+
+    def version(self, name: str) -> Hashable:
+        return tuple(registry.version(name) for registry in self.registries)
+
+    def source_versions(self) -> Dict[str, int | None]:
+        return {
+            f"{registry.name}/{name}": version
+            for registry in self.registries
+            for name, version in registry.source_versions().items()
+        }
+
+
+# 区ごとのレイヤー、または複数の区を連結したレイヤー
+GeoLayers = GeoDataRegistry | MergedGeoData
+
+geodata = GeoDataRegistry()
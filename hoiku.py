@@ -1,6 +1,67 @@
+import logging
+import math
+import os
+import numpy as np
 import polars as pl
-import datetime
+from typing import Any, Callable, Hashable, NamedTuple
+from cache import LRUCache
+from metrics import register_cache
+from logger import get_logger, log_event
 from form_filter import FilterForm, get_nursery_type, get_age_availability
+from hoikuen_store import HoikuenSnapshot
+from bitmap_filter import filter_bitmap
+from spatial_index import DISTANCE_COLUMN, BBox, NearbyQuery, filter_nearby
+from spatial_join import (
+    NEAREST_BUS_STOP_DISTANCE_COLUMN,
+    NEAREST_SCHOOL_DISTANCE_COLUMN,
+    SCHOOL_DISTRICT_COLUMN,
+)
+from text_index import get_text_index, search_text, text_contains
+
+# フィルターエンジン ("polars" または "bitmap")
+FILTER_ENGINE = os.environ.get("FILTER_ENGINE", "polars")
+
+# 絞り込みに影響しないフォーム項目 (地図のレイヤー表示など)
+NON_FILTER_FIELDS = {
+    "bus_stop",
+    "bus_route",
+    "kindergarten",
+    "elementary_school",
+    "school_district",
+    "ward",  # 区はどのスナップショットを読むかを決める
+    "submit",
+    "csrf_token",
+}
+
+# 地点の周辺検索の項目 (build_conditions の条件式には含まれない)
+NEARBY_FIELDS = {"lat", "lon", "radius", "k"}
+
+# 部分一致検索の項目 → カラム (名称・所在地の索引で候補を絞る)
+TEXT_FIELDS = {"nursery_name": "名称", "address": "所在地"}
+
+# 空間結合のカラムで絞り込む項目 → カラム (空間結合のキャッシュがなければ絞り込めない)
+SPATIAL_JOIN_FIELDS = {
+    "school_district_name": SCHOOL_DISTRICT_COLUMN,
+    "bus_stop_within": NEAREST_BUS_STOP_DISTANCE_COLUMN,
+    "elementary_school_within": NEAREST_SCHOOL_DISTANCE_COLUMN,
+}
+
+# filter_data の結果キャッシュ
+filter_cache = register_cache(
+    "filter",
+    LRUCache(
+        maxsize=int(os.environ.get("FILTER_CACHE_SIZE", "256")),
+        ttl=float(os.environ.get("FILTER_CACHE_TTL", "600")),
+    ),
+)
+
+# 条件の形 (filter_shape_key) → 常に真でない条件 (データに依存しないので期限なし)
+compiled_cache = register_cache("compiled_filter", LRUCache(maxsize=1024))
+
+# (条件の名前, 値) → 条件式
+condition_cache = register_cache("filter_condition", LRUCache(maxsize=4096))
+
+log = get_logger("filter")
 
 
 def cond_holiday(column: pl.Expr, saturday_flg: int, sunday_flg: int) -> pl.Expr:
@@ -73,12 +134,8 @@ def vacancy_by_age(age_list: list) -> pl.Expr:
         return pl.lit(True)
 
     # 指定された年齢の空きが1以上の行を返す
-    conditions = []
-    for col in age_list:
-        condition = f'(pl.col("{col}") >= 1)'
-        conditions.append(condition)
-    conditions = " & ".join(conditions)  # or検索にする場合は&を|に置き換えでいけるはず
-    return eval(conditions)
+    conditions = [pl.col(col) >= 1 for col in age_list]
+    return pl.all_horizontal(conditions)  # or検索にする場合は any_horizontal
 
 
 def has_or_not(column: pl.Expr, condition: int) -> pl.Expr:
@@ -86,7 +143,7 @@ def has_or_not(column: pl.Expr, condition: int) -> pl.Expr:
     'あり'/'なし'の二値をとるカラムのフィルター
     """
     if condition == 1:
-        return (column == "あり") | (column == "有り")
+        return column.is_in(["あり", "有り"])
     else:
         return pl.lit(True)
 
@@ -94,96 +151,380 @@ def has_or_not(column: pl.Expr, condition: int) -> pl.Expr:
 def str_contain_filter(column: pl.Expr, condition: str|None) -> pl.Expr:
     """
     文字列が含まれる行をフィルターする
+
+    全角/半角・ひらがな/カタカナ・空白の違いは無視し、正規表現ではなく文字列として探す。
     """
     if condition is None:
         return pl.lit(True)
     else:
-        return column.str.contains(condition)
+        return text_contains(column, condition)
+
+
+def str_eq_filter(column: pl.Expr, condition: str|None) -> pl.Expr:
+    """
+    文字列が一致する行をフィルターする
+    """
+    if not condition:
+        return pl.lit(True)
+    return column == condition
+
+
+def max_num_filter(column: pl.Expr, num_max: int|None) -> pl.Expr:
+    """
+    数値が指定値以下の行をフィルターする (値のない行は除く)
+    """
+    if num_max is None:
+        return pl.lit(True)
+    return column <= num_max
+
+
+class CompiledFilter(NamedTuple):
+    """
+    フォームをコンパイルしたフィルター条件
+    """
+
+    conditions: list[pl.Expr]  # 常に真の条件を除いた条件式 (カラムごと)
+    expr: pl.Expr | None  # すべての条件の AND (条件がなければ None)
+
+
+def is_always_true(expr: pl.Expr) -> bool:
+    return expr.meta.eq(pl.lit(True))
+
+
+def b_to_i(val: bool) -> int:
+    """
+    Converts a boolean value to 1 or 0
+    """
+    return 1 if val else 0
+
+
+def codes_to_names(codes: list[str], code_dict: dict[str, str]) -> tuple[str, ...]:
+    return tuple(code_dict[code] for code in codes if code in code_dict)
+
+
+class Condition(NamedTuple):
+    """
+    フォームの項目から作る条件式
+
+    values でフォームから値を取り出し、build で値から条件式を作る。
+    同じ値の条件式は condition_cache のものを使い回す。
+    """
+
+    name: str  # 条件の名前 (condition_cache のキー)
+    values: Callable[[FilterForm], tuple]
+    build: Callable[..., pl.Expr]
+
+    def bind(self, form: FilterForm) -> pl.Expr:
+        values = self.values(form)
+        return condition_cache.get_or_set((self.name, values), lambda: self.build(*values))
+
+
+def form_conditions(form: FilterForm) -> list[Condition]:
+    """
+    フォームの項目ごとの条件のリスト
+
+    年齢はチェックされた年齢ごとに1つ (filter_shape_key に年齢のコードが含まれる)。
+    名称・所在地の部分一致は含まない (索引で引く、text_candidates)。
+    """
+
+    def has_or_not_condition(column: str, field: str) -> Condition:
+        return Condition(
+            column,
+            lambda f: (b_to_i(getattr(f, field).data),),
+            lambda flg: has_or_not(pl.col(column), flg),
+        )
+
+    def max_num_condition(column: str, field: str) -> Condition:
+        return Condition(
+            column,
+            lambda f: (getattr(f, field).data,),
+            lambda num_max: max_num_filter(pl.col(column), num_max),
+        )
+
+    ages = codes_to_names(form.age_availability.data or [], get_age_availability())
+    return [
+        Condition(
+            "利用可能曜日",
+            lambda f: (b_to_i(f.saturday.data), b_to_i(f.sunday.data)),
+            lambda saturday, sunday: cond_holiday(pl.col("利用可能曜日"), saturday, sunday),
+        ),
+        Condition(
+            "種別",
+            lambda f: codes_to_names(f.type.data or [], get_nursery_type()),
+            lambda *names: cond_list(pl.col("種別"), list(names)),
+        ),
+        Condition(
+            "開始時間",
+            lambda f: tuple(f.start_time.to_numbers()[2:4]),
+            lambda *hh_and_mm: start_time(pl.col("開始時間"), hh_and_mm),
+        ),
+        Condition(
+            "終了時間",
+            lambda f: tuple(f.end_time.to_numbers()[0:2]),
+            lambda *hh_and_mm: end_time(pl.col("終了時間"), hh_and_mm),
+        ),
+        Condition(
+            "延長保育終了時間",
+            lambda f: tuple(f.extended_end_time.to_numbers()[0:2]),
+            lambda *hh_and_mm: end_time(pl.col("延長保育終了時間"), hh_and_mm),
+        ),
+        # 年齢ごとに分けても AND なので結果は同じ (ビットマップ索引は1カラムずつ引く)
+        *[
+            Condition(age, lambda f: (), lambda age=age: vacancy_by_age([age]))
+            for age in ages
+        ],
+        has_or_not_condition("園庭の有無", "garden"),
+        has_or_not_condition("駐輪場の有無", "bicycle_parking"),
+        has_or_not_condition("ベビーカー置き場の有無", "stroller_area"),
+        has_or_not_condition("障害児の受け入れ体制", "disability_acceptance"),
+        has_or_not_condition("病児保育事業の実施", "sick_child_care"),
+        Condition(
+            "収容定員_合計",
+            lambda f: (f.capacity_min.data, f.capacity_max.data),
+            lambda num_min, num_max: between_num_filter(
+                pl.col("収容定員_合計"), num_min, num_max,
+                num_max_breaker=200, num_infinite=999
+            ),
+        ),
+        Condition(
+            SCHOOL_DISTRICT_COLUMN,
+            lambda f: (f.school_district_name.data,),
+            lambda name: str_eq_filter(pl.col(SCHOOL_DISTRICT_COLUMN), name),
+        ),
+        max_num_condition(NEAREST_BUS_STOP_DISTANCE_COLUMN, "bus_stop_within"),
+        max_num_condition(NEAREST_SCHOOL_DISTANCE_COLUMN, "elementary_school_within"),
+    ]
+
+
+def compile_filter(form: FilterForm) -> CompiledFilter:
+    """
+    フォームを1つの条件式にまとめる
+
+    どの条件が常に真になるかは値ではなく条件の形 (filter_shape_key) で決まるので、
+    形ごとに常に真でない条件だけをキャッシュし、フォームの値を当てはめる
+    (値ごとの条件式も condition_cache で使い回す)。
+    名称・所在地の部分一致は含まない (索引で引く、text_candidates)。
+    """
+
+    def compile() -> tuple[Condition, ...]:
+        return tuple(c for c in form_conditions(form) if not is_always_true(c.bind(form)))
+
+    active = compiled_cache.get_or_set(filter_shape_key(form), compile)
+    if log.isEnabledFor(logging.DEBUG):
+        log_event(
+            log,
+            logging.DEBUG,
+            "time_ranges",
+            start_time=form.start_time.to_numbers(),
+            end_time=form.end_time.to_numbers(),
+            extended_end_time=form.extended_end_time.to_numbers(),
+        )
+    conditions = [c.bind(form) for c in active]
+    expr = pl.all_horizontal(conditions) if conditions else None
+    return CompiledFilter(conditions, expr)
+
+
+def filter_conditions(form: FilterForm) -> list[pl.Expr]:
+    """
+    フォームからフィルター条件式のリストを作る (常に真の条件は含まない)
+    """
+    return compile_filter(form).conditions
+
+
+def build_conditions(form: FilterForm) -> list[pl.Expr]:
+    """
+    フォームからフィルター条件式のリストを作る (キャッシュを使わない)
+
+    Args:
+        form: フィルター条件フォームデータ
+    Returns:
+        行を残す条件式のリスト (すべて満たす行を残す、常に真の条件も含む)
+    """
+    return [c.build(*c.values(form)) for c in form_conditions(form)]
 
 
 def filter_data(lf: pl.LazyFrame, form: FilterForm) -> pl.DataFrame:
     """
     LazyFrameからフィルターした結果のdataframeを返す
 
+    名称・所在地の部分一致 (TEXT_FIELDS) は他の条件の後に文字列を正規化して調べる
+    (filter_snapshot は索引で候補を絞るのでここを通らない)。
+
     Args:
         lf: hoikuen.csv の LazyFrame
         form: フィルター条件フォームデータ
     Returns:
         フィルターしたデータの DataFrame
     """
+    expr = compile_filter(form).expr
+    if expr is not None:
+        lf = lf.filter(expr)
+    for column, query in text_queries(form).items():
+        lf = lf.filter(str_contain_filter(pl.col(column), query))
+    return lf.collect(streaming=True)
 
-    def b_to_i(val: bool) -> int:
-        """
-        Converts a boolean value to 1 or 0
-        """
-        return 1 if val else 0
-
-    def time_to_tuple(val: datetime.time | None) -> tuple[int, int]:
-        if val is None:
-            return (0, 0)
-        return (val.hour, val.minute)
-
-    def codes_to_names(codes: list[str], code_dict: dict[str, str]):
-        return [code_dict[code] for code in codes if code in code_dict]
-
-    start_times = form.start_time.to_numbers()
-    end_times = form.end_time.to_numbers()
-    extended_end_times: list[int] = form.extended_end_time.to_numbers()
-
-    print(start_times)
-    print(end_times)
-    print(extended_end_times)
-
-    df = (
-        lf.filter(str_contain_filter(pl.col("名称"), form.nursery_name.data))
-        .filter(str_contain_filter(pl.col("所在地"), form.address.data))
-        .filter(
-            cond_holiday(
-                pl.col("利用可能曜日"),
-                b_to_i(form.saturday.data),
-                b_to_i(form.sunday.data),
-            )
-        )
-        .filter(
-            cond_list(
-                pl.col("種別"), codes_to_names(form.type.data or [], get_nursery_type())
-            )
-        )
-        .filter(start_time(pl.col("開始時間"), (start_times[2], start_times[3])))
-        .filter(end_time(pl.col("終了時間"), (end_times[0], end_times[1])))
-        .filter(
-            end_time(
-                pl.col("延長保育終了時間"),
-                (extended_end_times[0], extended_end_times[1]),
-            )
-        )
-        .filter(
-            vacancy_by_age(
-                codes_to_names(form.age_availability.data or [], get_age_availability())
-            )
-        )
-        .filter(has_or_not(pl.col("園庭の有無"), b_to_i(form.garden.data)))
-        .filter(has_or_not(pl.col("駐輪場の有無"), b_to_i(form.bicycle_parking.data)))
-        .filter(
-            has_or_not(
-                pl.col("ベビーカー置き場の有無"), b_to_i(form.stroller_area.data)
-            )
-        )
-        .filter(
-            has_or_not(
-                pl.col("障害児の受け入れ体制"), b_to_i(form.disability_acceptance.data)
-            )
-        )
-        .filter(
-            has_or_not(pl.col("病児保育事業の実施"), b_to_i(form.sick_child_care.data))
-        )
-        .filter(
-            between_num_filter(
-                pl.col("収容定員_合計"), form.capacity_min.data, form.capacity_max.data,
-                num_max_breaker=200, num_infinite=999
-            )
+
+def filter_form_key(form: FilterForm, exclude: set[str] = NON_FILTER_FIELDS) -> Hashable:
+    """
+    絞り込み条件を正規化したキー
+
+    絞り込みに影響しない項目 (exclude) は除き、種別・年齢のコードはソートする。
+    """
+
+    def normalize(value: Any) -> Hashable:
+        if isinstance(value, (list, tuple)):
+            return tuple(sorted(value))
+        return value
+
+    return tuple(
+        sorted(
+            (key, normalize(value))
+            for key, value in form.to_dict().items()
+            if key not in exclude
         )
-        .collect(streaming=True)
     )
 
+
+def filter_shape_key(form: FilterForm) -> Hashable:
+    """
+    条件式の形のキー (build_conditions のどの条件が常に真になるかを決める)
+
+    チェックボックスと年齢・種別のコードは値そのもの、それ以外は未入力・偽・真の3通り。
+    """
+
+    def shape(value: Any) -> Hashable:
+        if isinstance(value, (bool, list, tuple)):
+            return value if isinstance(value, bool) else tuple(sorted(value))
+        return None if value is None else bool(value)
+
+    exclude = NON_FILTER_FIELDS | NEARBY_FIELDS | TEXT_FIELDS.keys()
+    return tuple(
+        sorted((key, shape(value)) for key, value in form.to_dict().items() if key not in exclude)
+    )
+
+
+def nearby_query(form: FilterForm) -> NearbyQuery | None:
+    """
+    フォームの周辺検索の条件 (地点と半径・件数のどちらかがなければ None)
+
+    Raises:
+        ValueError: 緯度・経度・半径・件数が数値でない・範囲外の場合 (件数は 1 以上)
+    """
+    for field in (form.lat, form.lon, form.radius, form.k):
+        # 入力がなければ Optional で通る (NumberRange は nan を通すので別に確認する)
+        valid = field.validate(form)
+        if not valid or (field.data is not None and not math.isfinite(field.data)):
+            raise ValueError(f"invalid {field.name}: {', '.join(field.errors) or field.data}")
+    if form.lat.data is None or form.lon.data is None:
+        return None
+    if form.radius.data is None and form.k.data is None:
+        return None
+    return NearbyQuery(form.lat.data, form.lon.data, form.radius.data, form.k.data)
+
+
+def nearby_bbox(form: FilterForm) -> BBox | None:
+    """
+    周辺検索の範囲 (区の絞り込み用)。件数だけの場合は地点のみ
+
+    Raises:
+        ValueError: 周辺検索の条件が不正な場合
+    """
+    query = nearby_query(form)
+    if query is None:
+        return None
+    return BBox.around(query.lat, query.lon, query.radius_m or 0)
+
+
+def text_queries(form: FilterForm) -> dict[str, str]:
+    """
+    フォームの部分一致検索の条件 (カラム → 検索文字列)
+    """
+    return {
+        column: getattr(form, field).data
+        for field, column in TEXT_FIELDS.items()
+        if getattr(form, field).data
+    }
+
+
+def text_candidates(snapshot: HoikuenSnapshot, form: FilterForm) -> np.ndarray | None:
+    """
+    名称・所在地の部分一致検索に一致する行番号 (索引で引く、条件がなければ None)
+    """
+    return get_text_index(snapshot).search(text_queries(form))
+
+
+def check_spatial_joins(snapshot: HoikuenSnapshot, form: FilterForm) -> None:
+    """
+    空間結合のカラムで絞り込む場合に、スナップショットに空間結合があるか確かめる
+
+    Raises:
+        ValueError: 空間結合のキャッシュがない・古い (カラムがすべて null) 場合
+    """
+    if snapshot.has_spatial_joins:
+        return
+    fields = [name for name in SPATIAL_JOIN_FIELDS if getattr(form, name).data not in (None, "")]
+    if fields:
+        raise ValueError(f"spatial join columns are not available: {', '.join(fields)}")
+
+
+def filter_snapshot(
+    snapshot: HoikuenSnapshot, form: FilterForm, engine: str | None = None
+) -> pl.DataFrame:
+    """
+    スナップショットをフィルターした結果 (キャッシュ付き)
+
+    キーにデータのハッシュを含むので、CSV が更新されると古い結果は使われない
+    (区ごとのスナップショットの結果も混ざらない)。
+
+    Args:
+        snapshot: 保育園データのスナップショット
+        form: フィルター条件フォームデータ
+        engine: "polars" (LazyFrame) か "bitmap" (ビットマップ索引)。
+            省略時は環境変数 FILTER_ENGINE
+    Returns:
+        周辺検索の場合は距離の近い順 (「距離」のカラム付き)、それ以外は元の行順
+    Raises:
+        ValueError: 周辺検索の条件が不正な場合・空間結合のカラムで絞り込めない場合
+    """
+    engine = engine or FILTER_ENGINE
+    check_spatial_joins(snapshot, form)
+
+    def run() -> pl.DataFrame:
+        query = nearby_query(form)
+        if query is not None:
+            # 周辺の候補の行だけに他の条件を適用する
+            expr = compile_filter(form).expr
+            return filter_nearby(snapshot, query, expr, text_candidates(snapshot, form))
+        queries = text_queries(form)
+        if queries:
+            # 名称・所在地の索引で候補の行を絞ってから他の条件を適用する
+            df = search_text(snapshot, queries)
+            expr = compile_filter(form).expr
+            return df.filter(expr) if expr is not None else df
+        if engine == "bitmap":
+            return filter_bitmap(snapshot, filter_conditions(form))
+        return filter_data(snapshot.lazy(), form)
+
+    # エンジンごとに結果の表 (行順・型) が同じとは限らないのでキーに含める
+    key = (snapshot.digest, engine, filter_form_key(form))
+    return filter_cache.get_or_set(key, run)
+
+
+def filter_snapshots(
+    snapshots: list[HoikuenSnapshot], form: FilterForm, engine: str | None = None
+) -> pl.DataFrame:
+    """
+    複数の区のスナップショットをそれぞれフィルターして連結した結果
+
+    周辺検索の場合は連結してから距離の近い順に並べ、件数を k 件に絞る。
+    """
+    frames = [filter_snapshot(snapshot, form, engine) for snapshot in snapshots]
+    if len(frames) == 1:
+        return frames[0]
+    df = pl.concat(frames, how="vertical_relaxed")
+    query = nearby_query(form)
+    if query is not None:
+        df = df.sort(DISTANCE_COLUMN, maintain_order=True)
+        if query.k is not None:
+            df = df.head(query.k)
     return df
@@ -0,0 +1,267 @@
+import os
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple
+
+import polars as pl
+import xxhash
+
+from geo_sources import GEO_LAYER_FILES, source_versions
+from logger import get_logger
+from spatial_join import empty_spatial_joins, read_spatial_joins, spatial_joins_path
+from util import file_digest, load_hoikuen_table, xx58_str_to_hashstr
+from vacancy_delta import (
+    VacancyDeltaError,
+    apply_vacancy_delta,
+    read_vacancy_delta,
+    vacancy_delta_path,
+)
+
+DEFAULT_HOIKUEN_CSV = "data/hoikuen.csv"
+
+log = get_logger("store")
+
+
+class FileStamp(NamedTuple):
+    """
+    ファイル変更検知用のスタンプ
+    """
+
+    mtime_ns: int
+    size: int
+
+
+# (CSV, 空き状況の差分, 空間結合のキャッシュ (ファイルがなければ None) のスタンプ,
+#  空間結合に使った地図レイヤーの GeoJSON の mtime)
+StoreStamp = tuple[FileStamp, FileStamp | None, FileStamp | None, tuple]
+
+
+def file_stamp(filename: str) -> FileStamp:
+    st = os.stat(filename)
+    return FileStamp(st.st_mtime_ns, st.st_size)
+
+
+def optional_file_stamp(filename: str) -> FileStamp | None:
+    if not os.path.exists(filename):
+        return None
+    return file_stamp(filename)
+
+
+class NameIndex:
+    """
+    名称・名称ハッシュから行番号を引く索引
+
+    同じ名称が複数ある場合は最初の行を指す。
+    """
+
+    def __init__(self, names: List[str]):
+        self.hashes = [xx58_str_to_hashstr(name) for name in names]
+        self.by_name: Dict[str, int] = {}
+        self.by_hash: Dict[str, int] = {}
+        for row, (name, hashstr) in enumerate(zip(names, self.hashes)):
+            self.by_name.setdefault(name, row)
+            self.by_hash.setdefault(hashstr, row)
+
+    def hash_of(self, name: str) -> str:
+        """
+        名称のハッシュ文字列 (索引になければ計算する)
+        """
+        row = self.by_name.get(name)
+        if row is None:
+            return xx58_str_to_hashstr(name)
+        return self.hashes[row]
+
+
+class HoikuenSnapshot:
+    """
+    前処理済みの保育園データ
+
+    一度作成したら変更しない。リロード時は新しいスナップショットに差し替える。
+    has_spatial_joins が False の場合、空間結合のカラム (小学校区など) はすべて null。
+    """
+
+    def __init__(
+        self, df: pl.DataFrame, version: int, digest: str, has_spatial_joins: bool = True
+    ):
+        self.df = df
+        self.version = version
+        self.digest = digest
+        self.has_spatial_joins = has_spatial_joins
+        self.names = NameIndex(df.get_column("名称").to_list())
+        self._derived: Dict[str, Any] = {}
+        self._derived_lock = threading.Lock()
+
+    def derived(self, name: str, factory: Callable[["HoikuenSnapshot"], Any]) -> Any:
+        """
+        このスナップショットから作る索引などを一度だけ作って保持する
+
+        スナップショットが差し替われば作り直される。
+        """
+        value = self._derived.get(name)
+        if value is not None:
+            return value
+        with self._derived_lock:
+            if name not in self._derived:
+                self._derived[name] = factory(self)
+            return self._derived[name]
+
+    def lazy(self) -> pl.LazyFrame:
+        return self.df.lazy()
+
+    def row_frame(self, row: int | None) -> pl.DataFrame:
+        """
+        指定行だけの DataFrame (行がなければ 0 行)
+        """
+        if row is None:
+            return self.df.clear()
+        return self.df.slice(row, 1)
+
+    def find_by_name(self, name: str) -> pl.DataFrame:
+        return self.row_frame(self.names.by_name.get(name))
+
+    def find_by_hash(self, hashstr: str) -> pl.DataFrame:
+        return self.row_frame(self.names.by_hash.get(hashstr))
+
+
+class HoikuenStore:
+    """
+    保育園データのプロセス内キャッシュ
+
+    CSV・空き状況の差分ファイル・空間結合のキャッシュの mtime/サイズ (と地図レイヤーの
+    GeoJSON の mtime) が変わった時だけ内容ハッシュを確認し、内容が変わっていれば
+    新しいスナップショットを作って差し替える。
+    差分・空間結合だけが変わった場合は CSV は読み直さず、読み込み済みの表に適用する。
+    """
+
+    def __init__(
+        self,
+        filename: str = DEFAULT_HOIKUEN_CSV,
+        delta_filename: str | None = None,
+        geo_files: Dict[str, str] = GEO_LAYER_FILES,
+    ):
+        self.filename = filename
+        self.delta_filename = delta_filename or vacancy_delta_path(filename)
+        self.geo_files = geo_files  # 空間結合に使った地図レイヤーの GeoJSON (同じ区のもの)
+        self._lock = threading.Lock()
+        # (スナップショット, (CSV のスタンプ, 差分のスタンプ)) の組を一度に差し替える
+        self._current: tuple[HoikuenSnapshot, StoreStamp] | None = None
+        # CSV の表 (空間結合なし)・空間結合のカラム (キャッシュがない・古い場合は None)
+        self._table: pl.DataFrame | None = None
+        self._joins: pl.DataFrame | None = None
+        # CSV・差分・空間結合のキャッシュのハッシュ
+        self._digests: tuple[str, str | None, str | None] | None = None
+
+    @property
+    def version(self) -> int:
+        return self.get().version
+
+    def stamps(self) -> StoreStamp:
+        return (
+            file_stamp(self.filename),
+            optional_file_stamp(self.delta_filename),
+            optional_file_stamp(spatial_joins_path(self.filename)),
+            tuple(sorted(source_versions(self.geo_files).items())),
+        )
+
+    def get(self) -> HoikuenSnapshot:
+        """
+        最新のスナップショットを返す
+        """
+        current = self._current
+        if current is not None and current[1] == self.stamps():
+            return current[0]
+
+        with self._lock:
+            # 他のスレッドが既に読み込んでいる場合
+            stamps = self.stamps()
+            current = self._current
+            if current is not None and current[1] == stamps:
+                return current[0]
+            old_stamps = current[1] if current is not None else (None, None, None, None)
+            old_digests = self._digests or (None, None, None)
+            csv_digest = old_digests[0]
+            if stamps[0] != old_stamps[0]:
+                csv_digest = file_digest(self.filename)
+            delta_digest = old_digests[1]
+            if stamps[1] is None:
+                delta_digest = None
+            elif stamps[1] != old_stamps[1]:
+                delta_digest = file_digest(self.delta_filename)
+            if self._table is None or csv_digest != old_digests[0]:
+                self._table = load_hoikuen_table(self.filename, csv_digest)
+                self._joins = None
+            joins_digest = old_digests[2]
+            if csv_digest != old_digests[0] or stamps[2:] != old_stamps[2:]:
+                self._joins, joins_digest = self._load_joins(csv_digest, self._table.height)
+            digests = (csv_digest, delta_digest, joins_digest)
+            if current is not None and digests == self._digests:
+                # touch されただけ
+                self._current = (current[0], stamps)
+                return current[0]
+
+            joins = self._joins
+            if joins is None:
+                joins = empty_spatial_joins(self._table.height)
+            df = self._table.hstack(joins)
+            if delta_digest is not None:
+                try:
+                    df = apply_vacancy_delta(df, read_vacancy_delta(self.delta_filename))
+                except VacancyDeltaError as e:
+                    log.warning("空き状況の差分を適用できません: %s", e)
+                    unchanged = (csv_digest, joins_digest) == (old_digests[0], old_digests[2])
+                    if current is not None and unchanged:
+                        # 直せば再度読み込むので、それまでは今のスナップショットを使う
+                        self._current = (current[0], stamps)
+                        return current[0]
+                    delta_digest = None
+
+            self._digests = (csv_digest, delta_digest, joins_digest)
+            digest = csv_digest
+            if delta_digest is not None or joins_digest is not None:
+                digest = xxhash.xxh64(
+                    f"{csv_digest}:{delta_digest}:{joins_digest}".encode()
+                ).hexdigest()
+            version = 1 if current is None else current[0].version + 1
+            snapshot = HoikuenSnapshot(df, version, digest, self._joins is not None)
+            self._current = (snapshot, stamps)
+            return snapshot
+
+    def _load_joins(self, digest: str, height: int) -> tuple[pl.DataFrame | None, str | None]:
+        """
+        空間結合のキャッシュとそのハッシュ (キャッシュがない・古い場合は (None, None))
+        """
+        joins = read_spatial_joins(self.filename, digest, height, self.geo_files)
+        if joins is None:
+            # 空間結合はリクエスト中には計算しない (build_snapshots.py で作る)
+            log.warning(
+                "空間結合のキャッシュがないか古いので null にします: %s",
+                spatial_joins_path(self.filename),
+            )
+            return None, None
+        return joins, file_digest(spatial_joins_path(self.filename))
+
+
+_stores: Dict[str, HoikuenStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_hoikuen_store(
+    filename: str = DEFAULT_HOIKUEN_CSV, geo_files: Dict[str, str] = GEO_LAYER_FILES
+) -> HoikuenStore:
+    store = _stores.get(filename)
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(filename, HoikuenStore(filename, geo_files=geo_files))
+    return store
+
+
+def get_hoikuen_snapshot(
+    filename: str = DEFAULT_HOIKUEN_CSV, geo_files: Dict[str, str] = GEO_LAYER_FILES
+) -> HoikuenSnapshot:
+    """
+    保育園データの最新スナップショットを取得
+
+    Args:
+        filename: 保育園データ (区ごとの CSV)
+        geo_files: 空間結合に使った同じ区の地図レイヤーの GeoJSON (初めて読み込む時だけ使う)
+    """
+    return get_hoikuen_store(filename, geo_files).get()
@@ -0,0 +1,82 @@
+"""
+HTTP の条件付きリクエスト (ETag / If-None-Match)
+
+レスポンスはデータ (保育園データ・地図レイヤー)、アプリのバージョンと検索条件だけで決まるので、
+それらのハッシュを ETag にする。If-None-Match が一致すれば、絞り込みや描画をせずに 304 を返す。
+
+GET で検索する /view・/list と、検索結果を GET で取得する /markers・/viewport が対象。
+/search_result は検索フォームを POST するので (ブラウザは POST の結果を条件付きで取り直さない)、
+検索結果の 304 はブラウザ側描画モードの /markers・/viewport で返す。
+"""
+from typing import Any, List
+
+import xxhash
+from flask import Response, after_this_request, request
+
+from __version__ import VERSION
+from geo_sources import source_versions
+from wards import Ward, ward_snapshot
+
+# /view?h= (ハッシュでの固定リンク) のキャッシュ時間 [秒]
+PERMALINK_MAX_AGE = 300
+
+
+def make_etag(wards: List[Ward], route: str, key: Any) -> str:
+    """
+    データ・アプリのバージョン・ホスト (to_url で絶対URLを作るため)・ルート・検索条件のハッシュ
+
+    Args:
+        wards: 検索で読む区 (各区の保育園データと地図レイヤー)
+        route: ルート名
+        key: 正規化した検索条件 (filter_form_key など、repr が一意になるもの)
+    """
+    source = repr(
+        (
+            VERSION,
+            [ward_snapshot(ward).digest for ward in wards],
+            [sorted(source_versions(ward.geo_files).items()) for ward in wards],
+            request.host_url,
+            route,
+            key,
+        )
+    )
+    return xxhash.xxh64(source.encode()).hexdigest()
+
+
+def set_cache_headers(response: Response, etag: str, max_age: int | None = None) -> Response:
+    """
+    ETag と Cache-Control をつける
+
+    max_age を指定しなければ毎回 ETag で確認させる (no-cache)。
+    """
+    response.set_etag(etag)
+    if max_age is None:
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    return response
+
+
+def conditional(
+    wards: List[Ward], route: str, key: Any, max_age: int | None = None
+) -> Response | None:
+    """
+    If-None-Match が一致すれば 304 のレスポンス。一致しなければ None を返し、
+    このリクエストのレスポンスに ETag と Cache-Control をつける (GET / HEAD のみ)。
+
+    絞り込みや描画の前に呼ぶこと。
+    """
+    if request.method not in ("GET", "HEAD"):
+        return None
+    etag = make_etag(wards, route, key)
+    if request.if_none_match.contains_weak(etag):
+        return set_cache_headers(Response(status=304), etag, max_age)
+
+    @after_this_request
+    def add_headers(response: Response) -> Response:
+        if response.status_code == 200:
+            set_cache_headers(response, etag, max_age)
+        return response
+
+    return None
@@ -0,0 +1,161 @@
+"""
+views_hoikuen の import 時間を計測する
+
+    python importtime_report.py [--top 15] [--no-requests]
+
+`python -X importtime` の結果を集計し、時間のかかったモジュールを表示する。
+続けて合成データ (bench.generate) に対して Flask のテストクライアントで /hoikuen/list と
+/hoikuen/view を実行する。import の時点、またはこれらのリクエストの後に地図関連の
+モジュール (geopandas, folium, branca など) が読み込まれていたら終了コード 1 を返す。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import List, NamedTuple
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# /view・/list では読み込まないモジュール (トップレベルのパッケージ名)
+LAZY_MODULES = {
+    "geopandas",
+    "folium",
+    "branca",
+    "shapely",
+    "pyogrio",
+    "geodata",
+    "mapping",
+    "overlays",
+}
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+# import する前に __version__ (デプロイ時に作る) がなければ仮のものを入れる
+PRELUDE = "import bench.run; bench.run.ensure_version_module()"
+PRELUDE_MODULES = {"bench.run", "__version__"}
+
+
+def run_child(args: List[str]) -> subprocess.CompletedProcess:
+    """
+    子プロセスを実行する (失敗したら子プロセスの stderr を表示して終了する)
+    """
+    try:
+        return subprocess.run(args, capture_output=True, text=True, check=True, cwd=REPO_ROOT)
+    except subprocess.CalledProcessError as e:
+        sys.stderr.write(e.stderr)
+        print(f"NG: {' '.join(args[1:])} が終了コード {e.returncode} で失敗しました")
+        sys.exit(1)
+
+
+def measure(module: str = "views_hoikuen") -> List[ImportTime]:
+    """
+    新しいプロセスで module を import し、各モジュールの import 時間を返す
+
+    PRELUDE で読み込んだモジュール (とそこから読み込んだもの) は含めない。
+    """
+    result = run_child([sys.executable, "-X", "importtime", "-c", f"{PRELUDE}; import {module}"])
+    times = []
+    pending: List[ImportTime] = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        pending.append(ImportTime(name.strip(), int(self_us), int(cumulative_us)))
+        # 子のモジュールが先に出力され、最後にトップレベル (字下げが1つ) のモジュールが出る
+        if name.startswith("  "):
+            continue
+        if pending[-1].module not in PRELUDE_MODULES:
+            times.extend(pending)
+        pending = []
+    return times
+
+
+def request_worker(data_dir: str) -> None:
+    """
+    /hoikuen/list と /hoikuen/view を実行し、読み込まれた LAZY_MODULES を JSON で出力する
+    (新しいプロセスで実行する)
+    """
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(data_dir)
+    from bench.run import make_app
+    from hoikuen_store import get_hoikuen_snapshot
+
+    client = make_app().test_client()
+    snapshot = get_hoikuen_snapshot()
+    name = snapshot.df.get_column("名称")[0]
+    requests = [
+        ("/hoikuen/list", {"json": "y"}),
+        ("/hoikuen/list", {"q": name[:2], "json": "y", "pretty": "y"}),
+        ("/hoikuen/view", {"q": name, "json": "y"}),
+        ("/hoikuen/view", {"h": snapshot.names.hash_of(name), "json": "y"}),
+    ]
+    for path, args in requests:
+        response = client.get(path, query_string=args)
+        response.get_data()  # ストリーミングのレスポンスも最後まで読む
+        if response.status_code != 200:
+            raise RuntimeError(f"{path}: {response.status_code}")
+    loaded = sorted({m for m in sys.modules if m.split(".")[0] in LAZY_MODULES})
+    print(json.dumps(loaded))
+
+
+def check_requests(size: int = 100) -> List[str]:
+    """
+    合成データで /hoikuen/list・/hoikuen/view を実行した後に読み込まれていた LAZY_MODULES
+    """
+    from bench.generate import generate
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate(size, data_dir)
+        result = run_child(
+            [sys.executable, os.path.abspath(__file__), "--requests-worker", data_dir]
+        )
+    # 最後の行が結果 (それより前はアプリのログ)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="views_hoikuen の import 時間を計測する")
+    parser.add_argument("--module", default="views_hoikuen")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument(
+        "--no-requests", action="store_true", help="リクエストでの確認をしない"
+    )
+    parser.add_argument("--requests-worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.requests_worker is not None:
+        request_worker(args.requests_worker)
+        return
+
+    times = measure(args.module)
+    total_us = sum(t.self_us for t in times)
+    print(f"import {args.module}: {total_us / 1000:.1f} ms ({len(times)} modules)")
+    for t in sorted(times, key=lambda t: t.cumulative_us, reverse=True)[: args.top]:
+        print(f"{t.cumulative_us / 1000:10.1f} ms  {t.module}")
+
+    loaded = sorted({t.module for t in times if t.module.split(".")[0] in LAZY_MODULES})
+    if loaded:
+        print(f"NG: 地図関連のモジュールが読み込まれています: {', '.join(loaded)}")
+        sys.exit(1)
+    print("OK: 地図関連のモジュールは読み込まれていません")
+
+    if args.no_requests:
+        return
+    loaded = check_requests()
+    if loaded:
+        modules = ", ".join(loaded)
+        print(f"NG: /list・/view のリクエストで地図関連のモジュールが読み込まれました: {modules}")
+        sys.exit(1)
+    print("OK: /list・/view のリクエストで地図関連のモジュールは読み込まれていません")
+
+
+if __name__ == "__main__":
+    main()
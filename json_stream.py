@@ -0,0 +1,68 @@
+import json
+from typing import Iterator
+
+import polars as pl
+from flask import Response
+
+from metrics import timed_iter
+
+# 一度にエンコードする行数
+BATCH_SIZE = 500
+
+
+def iter_batches(df: pl.DataFrame, batch_size: int = BATCH_SIZE) -> Iterator[pl.DataFrame]:
+    """
+    DataFrame を batch_size 行ずつに分ける (時間型は文字列にする)
+    """
+    for offset in range(0, df.height, batch_size):
+        yield df.slice(offset, batch_size).with_columns(pl.col(pl.Time).cast(pl.String))
+
+
+def iter_ndjson(df: pl.DataFrame, batch_size: int = BATCH_SIZE) -> Iterator[str]:
+    """
+    1行1オブジェクトの NDJSON
+    """
+    for batch in iter_batches(df, batch_size):
+        yield batch.write_ndjson()
+
+
+def iter_json_array(df: pl.DataFrame, batch_size: int = BATCH_SIZE) -> Iterator[str]:
+    """
+    行オブジェクトの JSON 配列 (write_json と同じ形式)
+    """
+    yield "["
+    for i, batch in enumerate(iter_batches(df, batch_size)):
+        rows = batch.write_json()[1:-1]  # 外側の [] を外す
+        yield rows if i == 0 else "," + rows
+    yield "]"
+
+
+def iter_json_columns(df: pl.DataFrame, batch_size: int = BATCH_SIZE) -> Iterator[str]:
+    """
+    カラム名 → 値のリストの JSON オブジェクト (df.to_dict(as_series=False) と同じ形式)
+
+    カラムごとに batch_size 個ずつ書き出す。
+    """
+    df = df.with_columns(pl.col(pl.Time).cast(pl.String))
+    yield "{"
+    for i, series in enumerate(df.iter_columns()):
+        yield ("" if i == 0 else ",") + json.dumps(series.name, ensure_ascii=False) + ":["
+        for offset in range(0, df.height, batch_size):
+            values = json.dumps(series.slice(offset, batch_size).to_list(), ensure_ascii=False)
+            yield ("" if offset == 0 else ",") + values[1:-1]  # 外側の [] を外す
+        yield "]"
+    yield "}"
+
+
+def json_response(df: pl.DataFrame, ndjson: bool = False, columns: bool = False) -> Response:
+    """
+    DataFrame をストリーミングで返すレスポンス
+
+    既定は行オブジェクトの配列、columns=True でカラムごとのオブジェクト、
+    ndjson=True で NDJSON。
+    """
+    if ndjson:
+        return Response(timed_iter("json", iter_ndjson(df)), mimetype="application/x-ndjson")
+    if columns:
+        return Response(timed_iter("json", iter_json_columns(df)), mimetype="application/json")
+    return Response(timed_iter("json", iter_json_array(df)), mimetype="application/json")
@@ -0,0 +1,124 @@
+"""
+構造化ログ
+
+1行1レコードの JSON を標準出力に書く。リクエストのスレッドではレコードをキューに入れるだけで、
+JSON への変換と書き込みはバックグラウンドのスレッド (QueueListener) で行う。
+
+* LOG_LEVEL : 出力するレベル (既定 INFO)
+* LOG_FORM_SAMPLE : 検索フォームの内容を出力するリクエストの割合 (0〜1, 既定 0.01)
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import math
+import os
+import queue
+import random
+import sys
+import threading
+import warnings
+from typing import Any
+
+
+def env_rate(name: str, default: float) -> float:
+    """
+    環境変数の割合 (0〜1)。数値でない・範囲外の場合は警告を出して既定値を使う
+    """
+    text = os.environ.get(name)
+    if text is None:
+        return default
+    try:
+        rate = float(text)
+    except ValueError:
+        rate = math.nan
+    if not 0 <= rate <= 1:
+        warnings.warn(f"{name}={text!r} は 0〜1 の数値ではないので {default} を使います")
+        return default
+    return rate
+
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+FORM_SAMPLE_RATE = env_rate("LOG_FORM_SAMPLE", 0.01)
+
+# アプリのロガーの親 (ルートロガーとは別に出力する)
+ROOT_LOGGER = "hoikuen"
+
+_lock = threading.Lock()
+_listener: logging.handlers.QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    {"time", "level", "logger", "event", ...フィールド} の JSON
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        item = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        item.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            item["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(item, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    変換せずにキューに入れる QueueHandler
+
+    標準の QueueHandler は呼び出し元のスレッドでメッセージを文字列にするが、
+    キューは同じプロセス内なのでレコードをそのまま渡す。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _configure() -> None:
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(records, handler)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(LOG_LEVEL)
+        root.addHandler(_DeferredQueueHandler(records))
+        root.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    アプリのロガー (hoikuen.{name})
+    """
+    _configure()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields: Any) -> None:
+    """
+    イベント名とフィールドを出力する (レベルが無効なら何もしない)
+
+    フィールドは出力スレッドで JSON にするので、後から変更するオブジェクトは渡さないこと。
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def sampled(rate: float) -> bool:
+    """
+    rate の割合で True
+    """
+    return rate >= 1 or random.random() < rate
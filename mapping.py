@@ -1,9 +1,12 @@
-from typing import Any, Optional, Tuple, cast
+import html
+import os
+import string
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, cast
 
 import folium
 import folium.plugins
 import polars as pl
-from branca.element import Figure
+from branca.element import Element, Figure, MacroElement
 from folium import Icon
 from folium.template import Template
 from folium.utilities import image_to_url, remove_empty
@@ -13,35 +16,37 @@ from util import to_url
 
 class DispatcherIcon(Icon):
     """
-    Icon that also dispatches a JS event.
-    Works as a drop-in replacement of CustomIcon.
+    Icon shared by all markers in a FeatureGroup, which also dispatches a JS event.
+    Add it to the group before the markers, and add the markers as
+    SharedIconMarker with a `query` option.
+    The click handler is registered once on the group and reads the query
+    from the clicked marker's options.
     """
     # NOTE:
     # e = {
     #   containerPoint: { x: 141, y: 426 },
     #   latlng: { lat: 35.67221, lng: 139.6671 }, layerPoint: { x: 141, y: 426 },
-    #   originalEvent: eventObject, target: iconObject,
+    #   originalEvent: eventObject, target: groupObject, propagatedFrom: markerObject,
     #   ...
     # }
     _template = Template(
         """
         {% macro script(this, kwargs) %}
         let {{ this.get_name() }} = L.icon({{ this.options|tojavascript }});
-        {{ this._parent.get_name() }}.setIcon({{ this.get_name() }});
-        // let {{this.get_name()}} = L.popup();
         {{this._parent.get_name()}}.on('click', function (e) {
             const lat = e.latlng.lat;
             const lng = e.latlng.lng;
+            const marker = e.propagatedFrom || e.layer;
             {{ this._parent.get_name() }}._map.setView(new L.LatLng(lat, lng), 17);
-            let load = { detail: { text: '{{this.query}}' }, bubbles: true };
+            let load = { detail: { text: marker.options.query }, bubbles: true };
             window.parent.window.dispatchEvent(new CustomEvent('openview', load));
         });
         {% endmacro %}
         """
-    )  
+    )
+
     def __init__(
         self,
-        query: str,
         icon_image: Any,
         icon_size: Optional[Tuple[int, int]] = None,
         icon_anchor: Optional[Tuple[int, int]] = None,
@@ -61,30 +66,74 @@ class DispatcherIcon(Icon):
             shadow_anchor=shadow_anchor,
             popup_anchor=popup_anchor,
         )
-        self.query = query
+
+
+class SharedIconMarker(folium.Marker):
+    """
+    Marker that uses an icon already defined on its FeatureGroup
+    (DispatcherIcon, ClickToPanIcon), so no icon script is emitted per marker.
+    Extra keyword arguments (e.g. `query`) are stored in the marker options.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.marker(
+                {{ this.location|tojson }},
+                {icon: {{ this.shared_icon.get_name() }}
+                {%- for key, value in this.options.items() %}, {{ key|tojson }}: {{ value|tojson }}{% endfor %}}
+            ).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, location, shared_icon: Icon, popup=None, tooltip=None, **kwargs):
+        super().__init__(location=location, popup=popup, tooltip=tooltip, **kwargs)
+        self._name = "SharedIconMarker"
+        self.shared_icon = shared_icon
+
+
+NURSERY_TYPE_CODES = {
+    "区立保育園": "1",
+    "区立幼保一元化施設": "2",
+    "私立保育園": "3",
+    "認定こども園": "4",
+    "小規模保育施設": "5",
+    "区立保育室": "6",
+}
 
 
 def nursery_type_to_code(type: str) -> str:
-    return {
-        "区立保育園": "1",
-        "区立幼保一元化施設": "2",
-        "私立保育園": "3",
-        "認定こども園": "4",
-        "小規模保育施設": "5",
-        "区立保育室": "6",
-    }.get(type, "0")
+    return NURSERY_TYPE_CODES.get(type, "0")
+
+
+class MapArea(NamedTuple):
+    """
+    地図の初期表示の中心と地名検索の範囲 (区ごと)
+    """
+
+    center: Tuple[float, float]
+    viewbox: Tuple[float, float, float, float]  # 南, 西, 北, 東
 
 
-def make_map(center, zoom_start):
+SHIBUYA_CENTER = 35.66367, 139.69772  # 渋谷区役所
+SHIBUYA_AREA = MapArea(SHIBUYA_CENTER, (35.64223, 139.66327, 35.69244, 139.72876))
+
+# 地図を動かせる範囲 (南, 西, 北, 東)。区の範囲がはみ出す場合は広げる
+MAX_BOUNDS = (35.55, 139.49, 35.8, 139.85)
+
+
+def make_map(center, zoom_start, area: MapArea = SHIBUYA_AREA):
+    south, west, north, east = area.viewbox
     m = folium.Map(
         location=center,
         control_scale=True,
         zoom_start=zoom_start,
         min_zoom=13,
-        min_lat=35.55,
-        max_lat=35.8,
-        min_lon=139.49,
-        max_lon=139.85,
+        min_lat=min(MAX_BOUNDS[0], south),
+        max_lat=max(MAX_BOUNDS[2], north),
+        min_lon=min(MAX_BOUNDS[1], west),
+        max_lon=max(MAX_BOUNDS[3], east),
         max_bounds=True,
         zoomSnap=0.5,
         zoomDelta=0.5,
@@ -94,74 +143,24 @@ def make_map(center, zoom_start):
     return m
 
 
-def make_nursery_map(df: pl.DataFrame):
-    # 初期地図を作成
-    shibuya_center = 35.66367, 139.69772  # 渋谷区役所
-    nursery_map = make_map(shibuya_center, 14)
-
-    # データが0件の場合はその旨を表示(動作確認用/実際はフロント側で表示)
-    if df.height == 0:
-        folium.Marker(
-            location=shibuya_center,
-            popup=folium.Popup(
-                "条件に一致する保育園がありません", max_width=300, show=True
-            ),
-            icon=folium.Icon(color="red"),
-        ).add_to(nursery_map)
-        return nursery_map
-
-    # マップ表示中央点を調整
-    def to_f(floatish: Any) -> float:
-        return cast(float, floatish)
-
-    latitude_center = (
-        to_f(df.get_column("緯度").max()) + to_f(df.get_column("緯度").min())
-    ) / 2
-    longitude_center = (
-        to_f(df.get_column("経度").max()) + to_f(df.get_column("経度").min())
-    ) / 2
-    map_center = latitude_center, longitude_center
+def set_base_url(nursery_map: folium.Map, base_url: str) -> None:
+    """
+    地図の HTML の先頭に <base> を入れる
 
-    # マップのズームレベルを調整
-    latitude_diff = to_f(df.get_column("緯度").max()) - to_f(
-        df.get_column("緯度").min()
-    )
-    longitude_diff = to_f(df.get_column("経度").max()) - to_f(
-        df.get_column("経度").min()
+    _repr_html_ は data: の iframe になり相対 URL (キャッシュしたオーバーレイのアイコンなど)
+    が解決できないので、その場合に呼ぶ。
+    """
+    cast(Figure, nursery_map.get_root()).header.add_child(
+        Element(f'<base href="{html.escape(base_url)}">'), name="base", index=0
     )
 
-    if latitude_diff < 0.015 and longitude_diff < 0.019:
-        zoom_level = 15
-    elif latitude_diff < 0.027 and longitude_diff < 0.04:
-        zoom_level = 14.5
-    else:
-        zoom_level = 14
-
-    nursery_map = make_map(map_center, zoom_level)
-
-    # データフレームからマップに描画
-    for nursery_type in df.get_column("種別").unique():
-        for row in df.filter(pl.col("種別") == nursery_type).iter_rows(named=True):
-            folium.Marker(
-                location=(row["緯度"], row["経度"]),
-                # マウスオーバー時に名称を表示
-                tooltip=folium.Tooltip(
-                    text=f"{row['名称']}",
-                    sticky=True,
-                    style="background-color: white; font-size: 13px; font-weight: bold;",
-                ),
-                # 保育園種別によってアイコンを変更
-                icon=DispatcherIcon(
-                    query=f"{row['名称']}",
-                    icon_image=to_url(
-                        f"/asset/icon/{nursery_type_to_code(nursery_type)}.png"
-                    ),
-                    icon_size=(50, 50),
-                ),
-            ).add_to(nursery_map)
 
+def add_map_controls(nursery_map: folium.Map, area: MapArea = SHIBUYA_AREA) -> None:
+    """
+    クロスヘア・全画面ボタン・地名検索 (area の範囲) を追加
+    """
     # クロスヘアを表示(実装するかは相談)
-    crosshair = to_url("/asset/crosshair.png")
+    crosshair = "/asset/crosshair.png"
 
     center_marker_html = f"""
     <div
@@ -193,11 +192,12 @@ def make_nursery_map(df: pl.DataFrame):
     ).add_to(nursery_map)
 
     # Add a geocider search
+    south, west, north, east = area.viewbox
     folium.plugins.Geocoder(
         position="topleft",
         provider_options={
             "geocodingQueryParams": {
-                "viewbox": "139.66327,35.69244,139.72876,35.64223",
+                "viewbox": f"{west},{north},{east},{south}",
                 "accept-language": "ja",
                 "countrycodes": "jp",
                 "bounded": "1",
@@ -209,4 +209,539 @@ def make_nursery_map(df: pl.DataFrame):
         collapsed=True,
     ).add_to(nursery_map)
 
+
+def map_view(df: pl.DataFrame) -> Tuple[Tuple[float, float], float]:
+    """
+    データ全体が収まる地図の中央点とズームレベル
+    """
+
+    # マップ表示中央点を調整
+    def to_f(floatish: Any) -> float:
+        return cast(float, floatish)
+
+    latitude_center = (
+        to_f(df.get_column("緯度").max()) + to_f(df.get_column("緯度").min())
+    ) / 2
+    longitude_center = (
+        to_f(df.get_column("経度").max()) + to_f(df.get_column("経度").min())
+    ) / 2
+    map_center = latitude_center, longitude_center
+
+    # マップのズームレベルを調整
+    latitude_diff = to_f(df.get_column("緯度").max()) - to_f(
+        df.get_column("緯度").min()
+    )
+    longitude_diff = to_f(df.get_column("経度").max()) - to_f(
+        df.get_column("経度").min()
+    )
+
+    if latitude_diff < 0.015 and longitude_diff < 0.019:
+        zoom_level = 15
+    elif latitude_diff < 0.027 and longitude_diff < 0.04:
+        zoom_level = 14.5
+    else:
+        zoom_level = 14
+
+    return map_center, zoom_level
+
+
+def make_empty_map(area: MapArea = SHIBUYA_AREA):
+    """
+    データが0件の場合の地図 (その旨を表示)
+    """
+    # 動作確認用/実際はフロント側で表示
+    nursery_map = make_map(area.center, 14, area)
+    folium.Marker(
+        location=area.center,
+        popup=folium.Popup("条件に一致する保育園がありません", max_width=300, show=True),
+        icon=folium.Icon(color="red"),
+    ).add_to(nursery_map)
+    return nursery_map
+
+
+def make_nursery_map(df: pl.DataFrame, area: MapArea = SHIBUYA_AREA):
+    # データが0件の場合はその旨を表示
+    if df.height == 0:
+        return make_empty_map(area)
+
+    # 初期地図を作成
+    map_center, zoom_level = map_view(df)
+    nursery_map = make_map(map_center, zoom_level, area)
+
+    # データフレームからマップに描画 (種別ごとにアイコンとクリック処理を共有)
+    for nursery_type in df.get_column("種別").unique():
+        group = folium.FeatureGroup(name=nursery_type, control=False)
+        # 保育園種別によってアイコンを変更
+        icon = DispatcherIcon(
+            icon_image=to_url(f"/asset/icon/{nursery_type_to_code(nursery_type)}.png"),
+            icon_size=(50, 50),
+        ).add_to(group)
+        for row in df.filter(pl.col("種別") == nursery_type).iter_rows(named=True):
+            SharedIconMarker(
+                location=(row["緯度"], row["経度"]),
+                shared_icon=icon,
+                # マウスオーバー時に名称を表示
+                tooltip=folium.Tooltip(
+                    text=f"{row['名称']}",
+                    sticky=True,
+                    style="background-color: white; font-size: 13px; font-weight: bold;",
+                ),
+                query=f"{row['名称']}",
+            ).add_to(group)
+        group.add_to(nursery_map)
+
+    add_map_controls(nursery_map, area)
+
+    return nursery_map
+
+
+# 高速レンダラー用のテンプレート (DispatcherIcon/SharedIconMarker/Tooltip の出力と同じ)
+# 種別ごとのグループ・共有アイコン・クリック処理
+FAST_GROUP_TEMPLATE = """
+            var nursery_group_{code} = L.featureGroup(
+                {{}}
+            );
+        let nursery_icon_{code} = L.icon({{
+  "iconUrl": "{icon_url}",
+  "iconSize": [50, 50],
+}});
+        nursery_group_{code}.on('click', function (e) {{
+            const lat = e.latlng.lat;
+            const lng = e.latlng.lng;
+            const marker = e.propagatedFrom || e.layer;
+            nursery_group_{code}._map.setView(new L.LatLng(lat, lng), 17);
+            let load = {{ detail: {{ text: marker.options.query }}, bubbles: true }};
+            window.parent.window.dispatchEvent(new CustomEvent('openview', load));
+        }});
+            nursery_group_{code}.addTo({map});
+"""
+
+# マーカー ({name} は列 (または式) で置き換える)
+FAST_MARKER_TEMPLATE = """
+            var marker_{i} = L.marker(
+                [{lat}, {lon}],
+                {{icon: nursery_icon_{code}, "query": '{query}'}}
+            ).addTo(nursery_group_{code});
+            marker_{i}.bindTooltip(
+                `<div style="background-color: white; font-size: 13px; font-weight: bold;">
+                     {tooltip}
+                 </div>`,
+                {{
+  "sticky": true,
+}}
+            );
+"""
+
+
+def compile_template(template: str) -> Callable[[Dict[str, pl.Expr]], pl.Expr]:
+    """
+    str.format 形式のテンプレートを、列を連結する Polars の式に変換する関数にする
+    """
+    parts = list(string.Formatter().parse(template))
+
+    def build(fields: Dict[str, pl.Expr]) -> pl.Expr:
+        exprs: List[pl.Expr] = []
+        for literal, name, _, _ in parts:
+            if literal:
+                exprs.append(pl.lit(literal))
+            if name is not None:
+                exprs.append(fields[name])
+        return pl.concat_str(exprs)
+
+    return build
+
+
+build_marker_script = compile_template(FAST_MARKER_TEMPLATE)
+
+
+def js_string(column: pl.Expr, quote: str) -> pl.Expr:
+    """
+    JS の文字列リテラルに入れるためのエスケープ
+    """
+    escaped = column.str.replace_all("\\", "\\\\", literal=True).str.replace_all(
+        quote, "\\" + quote, literal=True
+    )
+    if quote == "`":
+        escaped = escaped.str.replace_all("${", "\\${", literal=True)
+    return escaped
+
+
+class FastNurseryMarkers(MacroElement):
+    """
+    保育園マーカーを Polars の列から一括で生成する (folium の Marker を作らない)
+
+    要素名は marker_0, marker_1, ... の連番。種別ごとのグループ・アイコンは nursery_group_<コード>, nursery_icon_<コード>。
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        {{ this.marker_script(this._parent.get_name()) }}
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, df: pl.DataFrame):
+        super().__init__()
+        self._name = "FastNurseryMarkers"
+        self.df = df
+
+    def marker_script(self, map_name: str) -> str:
+        df = self.df.with_columns(
+            pl.col("種別")
+            .replace_strict(NURSERY_TYPE_CODES, default="0", return_dtype=pl.String)
+            .alias("種別コード")
+        )
+        groups = [
+            FAST_GROUP_TEMPLATE.format(
+                code=code, icon_url=to_url(f"/asset/icon/{code}.png"), map=map_name
+            )
+            for code in df.get_column("種別コード").unique(maintain_order=True)
+        ]
+        markers = df.select(
+            build_marker_script(
+                {
+                    "i": pl.int_range(pl.len()).cast(pl.String),
+                    "lat": pl.col("緯度").cast(pl.String),
+                    "lon": pl.col("経度").cast(pl.String),
+                    "code": pl.col("種別コード"),
+                    "query": js_string(pl.col("名称"), "'"),
+                    "tooltip": js_string(pl.col("名称"), "`"),
+                }
+            )
+        ).to_series()
+        return "".join(groups) + "".join(markers.to_list())
+
+
+def make_nursery_map_fast(df: pl.DataFrame, area: MapArea = SHIBUYA_AREA):
+    """
+    make_nursery_map と同じ地図を、マーカー部分だけ直接生成して作る
+    """
+    if df.height == 0:
+        return make_empty_map(area)
+
+    map_center, zoom_level = map_view(df)
+    nursery_map = make_map(map_center, zoom_level, area)
+    FastNurseryMarkers(df).add_to(nursery_map)
+    add_map_controls(nursery_map, area)
+    return nursery_map
+
+
+# 地図レンダラー ("folium" または "fast")
+MAP_RENDERER = os.environ.get("MAP_RENDERER", "folium")
+
+MAP_RENDERERS = {
+    "folium": make_nursery_map,
+    "fast": make_nursery_map_fast,
+}
+
+
+def build_nursery_map(
+    df: pl.DataFrame, renderer: str | None = None, area: MapArea = SHIBUYA_AREA
+):
+    """
+    選択したレンダラーで保育園マップを作る (省略時は環境変数 MAP_RENDERER)
+    """
+    return MAP_RENDERERS[renderer or MAP_RENDERER](df, area)
+
+
+class ClientMarkerLayer(MacroElement):
+    """
+    保育園マーカーをブラウザ側で描画するレイヤー
+
+    地図 (シェル) の URL のクエリをそのまま data_url に渡してマーカーのデータを取得する。
+    データは nursery_markers() の列指向 JSON。
+    アイコンは種別ごとに共有し、クリック時の動作 (ズーム + openview イベント) は
+    DispatcherIcon と同じくレイヤーに一度だけ登録する。
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        (function () {
+            const map = {{ this._parent.get_name() }};
+            const layer = L.featureGroup().addTo(map);
+            const icons = {};
+            layer.on('click', function (e) {
+                const marker = e.propagatedFrom || e.layer;
+                map.setView(new L.LatLng(e.latlng.lat, e.latlng.lng), 17);
+                let load = { detail: { text: marker.options.query }, bubbles: true };
+                window.parent.window.dispatchEvent(new CustomEvent('openview', load));
+            });
+            function escapeHtml(text) {
+                const div = document.createElement('div');
+                div.textContent = text;
+                return div.innerHTML;
+            }
+            function getIcon(code) {
+                if (!(code in icons)) {
+                    icons[code] = L.icon({
+                        iconUrl: {{ this.icon_base_url|tojson }} + code + '.png',
+                        iconSize: [50, 50],
+                    });
+                }
+                return icons[code];
+            }
+            fetch({{ this.data_url|tojson }} + window.location.search)
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    const n = data.name.length;
+                    if (n === 0) {
+                        // データが0件の場合はその旨を表示
+                        L.marker({{ this.empty_location|tojson }})
+                            .bindPopup('条件に一致する保育園がありません', {maxWidth: 300})
+                            .addTo(layer)
+                            .openPopup();
+                        return;
+                    }
+                    // マップ表示中央点とズームレベルを調整 (make_nursery_map と同じ)
+                    const latMax = Math.max(...data.lat), latMin = Math.min(...data.lat);
+                    const lonMax = Math.max(...data.lon), lonMin = Math.min(...data.lon);
+                    const latDiff = latMax - latMin, lonDiff = lonMax - lonMin;
+                    let zoom = 14;
+                    if (latDiff < 0.015 && lonDiff < 0.019) {
+                        zoom = 15;
+                    } else if (latDiff < 0.027 && lonDiff < 0.04) {
+                        zoom = 14.5;
+                    }
+                    map.setView([(latMax + latMin) / 2, (lonMax + lonMin) / 2], zoom);
+                    for (let i = 0; i < n; i++) {
+                        const marker = L.marker(
+                            [data.lat[i], data.lon[i]],
+                            {icon: getIcon(data.type[i]), query: data.query[i]}
+                        );
+                        marker.bindTooltip(
+                            '<div style="background-color: white; font-size: 13px; font-weight: bold;">'
+                                + escapeHtml(data.name[i]) + '</div>',
+                            {sticky: true}
+                        );
+                        marker.addTo(layer);
+                    }
+                });
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, data_url: str, icon_base_url: str, empty_location: Tuple[float, float]):
+        super().__init__()
+        self._name = "ClientMarkerLayer"
+        self.data_url = data_url
+        self.icon_base_url = icon_base_url
+        self.empty_location = list(empty_location)
+
+
+class ViewportMarkerLayer(MacroElement):
+    """
+    表示範囲内の保育園・バス停・学校だけをブラウザ側で描画するレイヤー
+
+    地図を動かすたびに viewport_url に表示範囲 (bbox) とズームレベルを渡して取得し、
+    まだ描画していないものだけマーカーを追加する。表示範囲から大きく外れたマーカーは消す。
+    データは viewport.viewport_features() のレイヤーごとの列指向 JSON。
+    保育園のクリック時の動作は ClientMarkerLayer と同じ。
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        (function () {
+            const map = {{ this._parent.get_name() }};
+            const pointLayers = {{ this.point_layers|tojson }};
+            const layerNames = ['nursery'].concat(Object.keys(pointLayers));
+            const groups = {}, seen = {}, icons = {};
+            layerNames.forEach(function (name) {
+                groups[name] = L.featureGroup().addTo(map);
+                seen[name] = new Map();
+            });
+            groups.nursery.on('click', function (e) {
+                const marker = e.propagatedFrom || e.layer;
+                map.setView(new L.LatLng(e.latlng.lat, e.latlng.lng), 17);
+                let load = { detail: { text: marker.options.query }, bubbles: true };
+                window.parent.window.dispatchEvent(new CustomEvent('openview', load));
+            });
+            Object.keys(pointLayers).forEach(function (name) {
+                icons[name] = L.icon(pointLayers[name].icon);
+                groups[name].on('click', function (e) {
+                    map.setView(new L.LatLng(e.latlng.lat, e.latlng.lng), 17);
+                });
+            });
+            function escapeHtml(text) {
+                const div = document.createElement('div');
+                div.textContent = text;
+                return div.innerHTML;
+            }
+            function getNurseryIcon(code) {
+                const key = 'nursery' + code;
+                if (!(key in icons)) {
+                    icons[key] = L.icon({
+                        iconUrl: {{ this.icon_base_url|tojson }} + code + '.png',
+                        iconSize: [50, 50],
+                    });
+                }
+                return icons[key];
+            }
+            function popupText(name, data, i) {
+                if (name === 'bus_stop') {
+                    return "<p style='font-size: 15px;'>バス停名: " + escapeHtml(data.name[i])
+                        + '<br> バス事業者:' + escapeHtml(data.operator[i])
+                        + ' <br>路線番号: ' + escapeHtml(data.route[i]) + '</p>';
+                }
+                return "<p style='font-size: 15px;'>" + escapeHtml(data.name[i]) + '</p>';
+            }
+            function tooltip(text) {
+                return '<div style="background-color: white; font-size: 13px; font-weight: bold;">'
+                    + escapeHtml(text) + '</div>';
+            }
+            function addMarkers(name, data) {
+                for (let i = 0; i < data.name.length; i++) {
+                    const key = data.lat[i] + ',' + data.lon[i] + ',' + data.name[i];
+                    if (seen[name].has(key)) {
+                        continue;
+                    }
+                    let marker;
+                    if (name === 'nursery') {
+                        marker = L.marker(
+                            [data.lat[i], data.lon[i]],
+                            {icon: getNurseryIcon(data.type[i]), query: data.query[i]}
+                        ).bindTooltip(tooltip(data.name[i]), {sticky: true});
+                    } else {
+                        marker = L.marker([data.lat[i], data.lon[i]], {icon: icons[name]})
+                            .bindPopup(popupText(name, data, i), {maxWidth: 300, autoPan: false});
+                        if (name !== 'bus_stop') {
+                            marker.bindTooltip(tooltip(data.name[i]), {sticky: true});
+                        }
+                    }
+                    seen[name].set(key, marker.addTo(groups[name]));
+                }
+            }
+            function prune(bounds) {
+                layerNames.forEach(function (name) {
+                    seen[name].forEach(function (marker, key) {
+                        if (!bounds.contains(marker.getLatLng())) {
+                            groups[name].removeLayer(marker);
+                            seen[name].delete(key);
+                        }
+                    });
+                });
+            }
+            let controller = null;
+            function update() {
+                const bounds = map.getBounds();
+                const params = new URLSearchParams(window.location.search);
+                params.set('bbox', [
+                    bounds.getSouth(), bounds.getWest(), bounds.getNorth(), bounds.getEast()
+                ].map(function (v) { return v.toFixed(6); }).join(','));
+                params.set('zoom', Math.floor(map.getZoom()));
+                params.set('layers', layerNames.join(','));
+                if (controller) {
+                    controller.abort();
+                }
+                controller = new AbortController();
+                fetch({{ this.viewport_url|tojson }} + '?' + params.toString(), {signal: controller.signal})
+                    .then(function (response) { return response.json(); })
+                    .then(function (features) {
+                        prune(bounds.pad({{ this.keep_ratio|tojson }}));
+                        layerNames.forEach(function (name) {
+                            if (features[name] === null) {
+                                // ズームレベルが小さい間は表示しない
+                                map.removeLayer(groups[name]);
+                            } else if (features[name] !== undefined) {
+                                groups[name].addTo(map);
+                                addMarkers(name, features[name]);
+                            }
+                        });
+                    })
+                    .catch(function (error) {
+                        if (error.name !== 'AbortError') {
+                            throw error;
+                        }
+                    });
+            }
+            map.on('moveend', update);
+            update();
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(
+        self,
+        viewport_url: str,
+        icon_base_url: str,
+        point_layers: Dict[str, Dict[str, Any]],
+        keep_ratio: float = 1.0,
+    ):
+        super().__init__()
+        self._name = "ViewportMarkerLayer"
+        self.viewport_url = viewport_url
+        self.icon_base_url = icon_base_url
+        # オーバーレイ名 → {"icon": L.icon のオプション}
+        self.point_layers = point_layers
+        # 表示範囲の何倍の余白の外のマーカーを消すか
+        self.keep_ratio = keep_ratio
+
+
+def nursery_markers(df: pl.DataFrame) -> Dict[str, List[Any]]:
+    """
+    ブラウザ側で描画するマーカーのデータ (列指向)
+
+    * name : 名称 (ツールチップ)
+    * lat/lon : 緯度/経度
+    * type : 種別コード (アイコン)
+    * query : openview イベントで渡す文字列
+    """
+    markers = df.select(
+        pl.col("名称").alias("name"),
+        pl.col("緯度").round(6).alias("lat"),
+        pl.col("経度").round(6).alias("lon"),
+        pl.col("種別")
+        .replace_strict(NURSERY_TYPE_CODES, default="0", return_dtype=pl.String)
+        .alias("type"),
+        pl.col("名称").alias("query"),
+    )
+    return markers.to_dict(as_series=False)
+
+
+# 表示範囲モードでブラウザ側で描画するポイントレイヤーのアイコン (overlays と同じ)
+VIEWPORT_POINT_ICONS = {
+    "bus_stop": ("/asset/bus.png", (45, 45)),
+    "elementary_school": ("/asset/elementary.png", (50, 50)),
+    "kindergarten": ("/asset/kindergarten.png", (50, 50)),
+}
+
+
+def make_map_shell(
+    data_url: str,
+    viewport_overlays: List[str] | None = None,
+    area: MapArea = SHIBUYA_AREA,
+):
+    """
+    マーカーを含まない地図 (検索条件に依存しないのでキャッシュできる)
+
+    URL はすべて相対 URL (シェルは iframe の src で読むのでそのまま解決できる)。
+
+    マーカーは ClientMarkerLayer がブラウザ側で data_url から取得して描画する。
+    viewport_overlays を指定した場合 (表示範囲モード) は ViewportMarkerLayer が
+    data_url から表示範囲内の保育園と指定したポイントレイヤーを取得する。
+    """
+    nursery_map = make_map(area.center, 14, area)
+    if viewport_overlays is None:
+        ClientMarkerLayer(
+            data_url=data_url,
+            icon_base_url="/asset/icon/",
+            empty_location=area.center,
+        ).add_to(nursery_map)
+    else:
+        point_layers = {}
+        for name in viewport_overlays:
+            icon_url, icon_size = VIEWPORT_POINT_ICONS[name]
+            point_layers[name] = {
+                "icon": {"iconUrl": icon_url, "iconSize": list(icon_size)}
+            }
+        ViewportMarkerLayer(
+            viewport_url=data_url,
+            icon_base_url="/asset/icon/",
+            point_layers=point_layers,
+        ).add_to(nursery_map)
+    add_map_controls(nursery_map, area)
     return nursery_map
@@ -0,0 +1,221 @@
+"""
+リクエストの段階ごとの計測
+
+段階 (データの読み込み・フィルター・地図の作成など) ごとの処理時間のヒストグラムと、
+返した件数・キャッシュのヒット数を集計し、Prometheus のテキスト形式で出力する。
+環境変数 SERVER_TIMING=1 の場合はレスポンスに Server-Timing ヘッダーをつける。
+集計は環境変数 METRICS_TOKEN を設定した場合だけ /metrics で返す (既定は返さない)。
+"""
+import functools
+import hmac
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from flask import g, has_request_context, make_response
+
+from cache import LRUCache
+
+# Server-Timing ヘッダーをつけるか
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+# /metrics のトークン (未設定・空の場合は /metrics を公開しない)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN") or None
+
+# 処理時間のバケット [秒]
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 件数のバケット
+ROWS_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values
+    )
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """
+    ラベルごとのヒストグラム
+    """
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labelnames: Labels = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        # ラベル → (バケットごとの件数, 合計, 件数)
+        self._values: Dict[Labels, List] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            values = {labels: (list(c), s, n) for labels, (c, s, n) in self._values.items()}
+        for labels, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                label_text = _format_labels(
+                    self.labelnames + ("le",), labels + (_format_value(bound),)
+                )
+                yield f"{self.name}_bucket{label_text} {cumulative}"
+            label_text = _format_labels(self.labelnames + ("le",), labels + ("+Inf",))
+            yield f"{self.name}_bucket{label_text} {count}"
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {total!r}"
+            yield f"{self.name}_count{label_text} {count}"
+
+
+stage_seconds = Histogram(
+    "hoikuen_stage_seconds", "Time spent in each stage of a request.", SECONDS_BUCKETS, ("stage",)
+)
+request_seconds = Histogram(
+    "hoikuen_request_seconds", "Time spent in each route.", SECONDS_BUCKETS, ("route",)
+)
+rows_returned = Histogram(
+    "hoikuen_rows_returned", "Number of nurseries returned.", ROWS_BUCKETS, ("route",)
+)
+
+# 名前 → キャッシュ (ヒット数などを出力する)
+_caches: Dict[str, LRUCache] = {}
+
+
+def register_cache(name: str, cache: LRUCache) -> LRUCache:
+    _caches[name] = cache
+    return cache
+
+
+def _record_timing(name: str, seconds: float) -> None:
+    stage_seconds.observe(seconds, name)
+    if has_request_context():
+        timings = g.setdefault("stage_timings", [])
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    with stage("filter"): ... の処理時間を記録する
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_timing(name, time.perf_counter() - start)
+
+
+def timed_iter(name: str, chunks: Iterable[str]) -> Iterator[str]:
+    """
+    ストリーミングのレスポンスの生成時間を記録する (送信を待つ時間は含まない)
+    """
+    elapsed = 0.0
+    iterator = iter(chunks)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            yield chunk
+    finally:
+        stage_seconds.observe(elapsed, name)
+
+
+def observe_rows(route: str, rows: int) -> None:
+    rows_returned.observe(rows, route)
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    """
+    Server-Timing ヘッダーの値 (同じ段階は合計する)
+    """
+    totals: Dict[str, float] = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items())
+
+
+def metrics_authorized(authorization: str | None) -> bool:
+    """
+    Authorization ヘッダーが "Bearer {METRICS_TOKEN}" か (トークンが未設定なら常に False)
+    """
+    if METRICS_TOKEN is None or authorization is None:
+        return False
+    scheme, _, credentials = authorization.partition(" ")
+    if scheme.lower() != "bearer":
+        return False
+    return hmac.compare_digest(credentials.strip().encode(), METRICS_TOKEN.encode())
+
+
+def timed_route(route: str) -> Callable:
+    """
+    ビュー関数全体の処理時間を記録するデコレーター
+
+    SERVER_TIMING=1 の場合は段階ごとの時間を Server-Timing ヘッダーにつける。
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            g.stage_timings = []
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            request_seconds.observe(elapsed, route)
+            if not SERVER_TIMING:
+                return result
+            response = make_response(result)
+            timings = g.stage_timings + [("total", elapsed)]
+            response.headers["Server-Timing"] = server_timing_header(timings)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def render_metrics() -> str:
+    """
+    Prometheus のテキスト形式
+    """
+    lines: List[str] = []
+    for histogram in (request_seconds, stage_seconds, rows_returned):
+        lines.extend(histogram.render())
+    caches = sorted(_caches.items())
+    for metric, key, kind, help in [
+        ("hoikuen_cache_hits_total", "hits", "counter", "Cache hits."),
+        ("hoikuen_cache_misses_total", "misses", "counter", "Cache misses."),
+        ("hoikuen_cache_size", "size", "gauge", "Number of cached entries."),
+    ]:
+        lines.append(f"# HELP {metric} {help}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, cache in caches:
+            lines.append(f"{metric}{_format_labels(('cache',), (name,))} {cache.stats()[key]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,253 @@
+from typing import Callable, Collection, Dict, NamedTuple, Tuple, cast
+
+import folium
+from branca.element import Element, Figure
+from folium.features import CustomIcon
+from folium.map import Icon, Layer
+from folium.template import Template
+from folium.utilities import remove_empty
+
+from cache import LRUCache
+from form_filter import FilterForm
+from geodata import GeoLayers, geodata
+from mapping import SharedIconMarker
+from metrics import register_cache, stage
+
+
+class ClickToPanIcon(CustomIcon):
+    """
+    Icon shared by all markers in a FeatureGroup, with one click handler on the
+    group to pan to the clicked marker.
+    Add it to the group before the markers, and add the markers as SharedIconMarker.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.icon({{ this.options|tojavascript }});
+        {{this._parent.get_name()}}.on('click', function (e) {
+            const lat = e.latlng.lat;
+            const lng = e.latlng.lng;
+            {{ this._parent.get_name() }}._map.setView(new L.LatLng(lat, lng), 17);
+        });
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, icon_url: str, icon_size: Tuple[int, int] | None = None):
+        # CustomIcon は URL でない文字列 (相対 URL) をファイルとして読むので使わない。
+        # 相対 URL にしておけばレンダリング結果がホストによらずキャッシュできる
+        super(Icon, self).__init__()
+        self._name = "icon"
+        self.options = remove_empty(icon_url=icon_url, icon_size=icon_size)
+
+
+def build_bus_stop_group(layers: GeoLayers) -> folium.FeatureGroup:
+    """
+    バス停
+    """
+    bus_group = folium.FeatureGroup(name="バス停")
+    bus_icon = ClickToPanIcon(
+        icon_url="/asset/bus.png",
+        icon_size=(45, 45),
+    ).add_to(bus_group)
+
+    def create_bus_stop_marker(row):
+        popup_text = f"<p style='font-size: 15px;'>バス停名: {row['bus_stop_name']}<br> バス事業者:{row['bus_operator']} <br>路線番号: {row['route_number']}</p>"
+        SharedIconMarker(
+            location=[row["緯度"], row["経度"]],
+            shared_icon=bus_icon,
+            popup=folium.Popup(popup_text, max_width=300, autoPan=False),
+        ).add_to(bus_group)
+
+    layers.get("bus_stop").apply(create_bus_stop_marker, axis=1)
+    return bus_group
+
+
+def build_bus_route_group(layers: GeoLayers) -> folium.FeatureGroup:
+    """
+    バスルート
+    """
+    bus_route_group = folium.FeatureGroup(name="バスルート")
+    folium.GeoJson(layers.get("bus_route")).add_to(bus_route_group)
+    return bus_route_group
+
+
+def create_school_marker(row, icon, group):
+    popup_text = f"<p style='font-size: 15px;'>{row['school_name']}</p>"
+    SharedIconMarker(
+        location=[row["緯度"], row["経度"]],
+        shared_icon=icon,
+        popup=folium.Popup(popup_text, max_width=300, autoPan=False),
+        tooltip=folium.Tooltip(
+            text=f"{row['school_name']}",
+            sticky=True,
+            style="background-color: white; font-size: 13px; font-weight: bold;",
+        ),
+    ).add_to(group)
+
+
+def build_elementary_group(layers: GeoLayers) -> folium.FeatureGroup:
+    """
+    小学校
+    """
+    elementary_group = folium.FeatureGroup(name="小学校")
+    layers.school_class("小学校").apply(
+        create_school_marker,
+        icon=ClickToPanIcon(
+            icon_url="/asset/elementary.png",
+            icon_size=(50, 50),
+        ).add_to(elementary_group),
+        group=elementary_group,
+        axis=1,
+    )
+    return elementary_group
+
+
+def build_kindergarten_group(layers: GeoLayers) -> folium.FeatureGroup:
+    """
+    幼稚園
+    """
+    kindergarten_group = folium.FeatureGroup(name="幼稚園")
+    layers.school_class("幼稚園").apply(
+        create_school_marker,
+        icon=ClickToPanIcon(
+            icon_url="/asset/kindergarten.png",
+            icon_size=(50, 50),
+        ).add_to(kindergarten_group),
+        group=kindergarten_group,
+        axis=1,
+    )
+    return kindergarten_group
+
+
+def build_school_district_group(layers: GeoLayers) -> folium.FeatureGroup:
+    """
+    小学校区
+    """
+    school_area_group = folium.FeatureGroup(name="小学校区")
+
+    def style_function(feature):
+        return {
+            "color": "#34D15F",
+            "fillOpacity": 0.1,
+            "weight": 3,
+        }
+
+    folium.GeoJson(
+        layers.get("school_area"),
+        style_function=style_function,
+        popup=folium.GeoJsonPopup(fields=["school_name"], labels=False),
+    ).add_to(school_area_group)
+    return school_area_group
+
+
+class OverlaySpec(NamedTuple):
+    build: Callable[[GeoLayers], folium.FeatureGroup]
+    layer: str  # 元データのレイヤー名 (geodata)
+
+
+# フォームのチェックボックス名 → オーバーレイ (表示順)
+OVERLAYS: Dict[str, OverlaySpec] = {
+    "bus_stop": OverlaySpec(build_bus_stop_group, "bus_stop"),
+    "bus_route": OverlaySpec(build_bus_route_group, "bus_route"),
+    "elementary_school": OverlaySpec(build_elementary_group, "school"),
+    "kindergarten": OverlaySpec(build_kindergarten_group, "school"),
+    "school_district": OverlaySpec(build_school_district_group, "school_area"),
+}
+
+
+class OverlayFragment(NamedTuple):
+    """
+    レンダリング済みのオーバーレイ
+    """
+
+    group_id: str  # FeatureGroup の _id (JS の変数名)
+    layer_name: str  # レイヤーコントロールでの表示名
+    headers: Dict[str, str]  # <head> に入れる要素
+    script: str  # 地図の変数名は map_name になっている
+    map_name: str
+
+
+def render_overlay(group: folium.FeatureGroup) -> OverlayFragment:
+    """
+    FeatureGroup を使い捨ての地図上でレンダリングし、スクリプト部分を取り出す
+    """
+    placeholder_map = folium.Map(location=(0, 0))
+    figure = cast(Figure, placeholder_map.get_root())
+    group.add_to(placeholder_map)
+    header_names = set(figure.header._children)
+    group.render()
+    headers = {
+        name: element.render()
+        for name, element in figure.header._children.items()
+        if name not in header_names
+    }
+    script = "".join(element.render() for element in figure.script._children.values())
+    return OverlayFragment(
+        group._id, group.layer_name, headers, script, placeholder_map.get_name()
+    )
+
+
+class CachedOverlay(Layer):
+    """
+    レンダリング済みのオーバーレイを地図に差し込む
+
+    元の FeatureGroup と同じ変数名を持つので LayerControl にもそのまま載る。
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        {{ this.fragment.script.replace(this.fragment.map_name, this._parent.get_name()) }}
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, fragment: OverlayFragment):
+        # addTo はスクリプトに含まれているので show=False
+        super().__init__(name=fragment.layer_name, overlay=True, show=False)
+        self._name = "FeatureGroup"
+        self._id = fragment.group_id
+        self.fragment = fragment
+
+    def render(self, **kwargs):
+        figure = cast(Figure, self.get_root())
+        for name, header in self.fragment.headers.items():
+            figure.header.add_child(Element(header), name=name)
+        super().render(**kwargs)
+
+
+# レンダリング済みオーバーレイのキャッシュ
+overlay_cache = register_cache("overlay", LRUCache(maxsize=64))
+
+
+def get_overlay(name: str, layers: GeoLayers = geodata) -> CachedOverlay:
+    """
+    オーバーレイを取得 (区と元ファイルの mtime ごとに一度だけレンダリングする)
+
+    アイコンは相対 URL なのでホストによらない (data: の iframe では set_base_url が必要)。
+    """
+    spec = OVERLAYS[name]
+    key = (name, layers.name, tuple(sorted(layers.source_versions().items())))
+
+    def build() -> OverlayFragment:
+        with stage("overlay_build"):
+            return render_overlay(spec.build(layers))
+
+    fragment = overlay_cache.get_or_set(key, build)
+    return CachedOverlay(fragment)
+
+
+def add_overlays(
+    nursery_map: folium.Map,
+    form: FilterForm,
+    exclude: Collection[str] = (),
+    layers: GeoLayers = geodata,
+) -> None:
+    """
+    チェックの入ったオーバーレイを地図に追加する (exclude のものは除く)
+    """
+    for name in OVERLAYS:
+        if name not in exclude and getattr(form, name).data:
+            get_overlay(name, layers).add_to(nursery_map)
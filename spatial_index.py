@@ -0,0 +1,371 @@
+import math
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+import polars as pl
+
+from hoikuen_store import HoikuenSnapshot
+
+# 地球の平均半径 (m)
+EARTH_RADIUS_M = 6371008.8
+# 緯度1度あたりの距離 (m)
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+# グリッドのセルの一辺 (m)
+CELL_SIZE_M = 250.0
+# 距離のカラム名 (m)
+DISTANCE_COLUMN = "距離"
+
+
+def haversine_m(
+    lat: float, lon: float, lats: np.ndarray, lons: np.ndarray
+) -> np.ndarray:
+    """
+    (lat, lon) から各点までの大円距離 (m)
+    """
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class NearbyQuery(NamedTuple):
+    """
+    地点の周辺検索の条件
+    """
+
+    lat: float
+    lon: float
+    radius_m: float | None = None  # この距離以内
+    k: int | None = None  # 近い順に k 件
+
+
+class BBox(NamedTuple):
+    """
+    緯度/経度の矩形 (地図の表示範囲)
+    """
+
+    south: float
+    west: float
+    north: float
+    east: float
+
+    def expand(self, ratio: float) -> "BBox":
+        """
+        縦横それぞれ ratio 倍の余白をつけた矩形
+        """
+        dlat = (self.north - self.south) * ratio
+        dlon = (self.east - self.west) * ratio
+        return BBox(self.south - dlat, self.west - dlon, self.north + dlat, self.east + dlon)
+
+    def intersects(self, other: "BBox") -> bool:
+        return not (
+            other.south > self.north
+            or other.north < self.south
+            or other.west > self.east
+            or other.east < self.west
+        )
+
+    def distance_m(self, lat: float, lon: float) -> float:
+        """
+        (lat, lon) から矩形までの距離 (m、矩形内なら 0)
+        """
+        nearest_lat = min(max(lat, self.south), self.north)
+        nearest_lon = min(max(lon, self.west), self.east)
+        return float(
+            haversine_m(lat, lon, np.array([nearest_lat]), np.array([nearest_lon]))[0]
+        )
+
+    @classmethod
+    def around(cls, lat: float, lon: float, radius_m: float) -> "BBox":
+        """
+        (lat, lon) を中心とする半径 radius_m の円を含む矩形
+        """
+        dlat = radius_m / METERS_PER_DEGREE
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        return cls(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+
+
+def union_bbox(bboxes: List[BBox]) -> BBox:
+    """
+    すべての矩形を含む矩形
+    """
+    return BBox(
+        min(b.south for b in bboxes),
+        min(b.west for b in bboxes),
+        max(b.north for b in bboxes),
+        max(b.east for b in bboxes),
+    )
+
+
+def parse_bbox(text: str) -> BBox:
+    """
+    "south,west,north,east" (Leaflet の toBBoxString は west,south,east,north なので注意)
+
+    Raises:
+        ValueError: 4つの数値でない・south > north・west > east の場合
+    """
+    values = [float(v) for v in text.split(",")]
+    if len(values) != 4 or not all(math.isfinite(v) for v in values):
+        raise ValueError(f"invalid bbox: {text}")
+    bbox = BBox(*values)
+    if bbox.south > bbox.north or bbox.west > bbox.east:
+        raise ValueError(f"invalid bbox: {text}")
+    return bbox
+
+
+class GridIndex:
+    """
+    緯度/経度の一様グリッド索引
+
+    点をセル (約 cell_size_m 四方) ごとにまとめ、検索では近くのセルの点だけ
+    大円距離を計算する。緯度/経度のない行は含まない。
+    """
+
+    def __init__(
+        self, lats: np.ndarray, lons: np.ndarray, cell_size_m: float = CELL_SIZE_M
+    ):
+        valid = ~(np.isnan(lats) | np.isnan(lons))
+        self.rows = np.flatnonzero(valid)
+        self.lats = lats[valid]
+        self.lons = lons[valid]
+        self.cells: Dict[Tuple[int, int], np.ndarray] = {}
+        if len(self.rows) == 0:
+            return
+
+        # 経度方向のセル幅は中心の緯度で決める
+        self.lat_step = cell_size_m / METERS_PER_DEGREE
+        center_lat = float(np.mean(self.lats))
+        self.lon_step = self.lat_step / math.cos(math.radians(center_lat))
+
+        ix = np.floor(self.lons / self.lon_step).astype(np.int64)
+        iy = np.floor(self.lats / self.lat_step).astype(np.int64)
+        self.ix_range = (int(ix.min()), int(ix.max()))
+        self.iy_range = (int(iy.min()), int(iy.max()))
+        order = np.lexsort((iy, ix))
+        keys = np.stack([ix[order], iy[order]], axis=1)
+        starts = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+        for points in np.split(order, starts):
+            self.cells[(int(ix[points[0]]), int(iy[points[0]]))] = points
+
+    def cell_of(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (math.floor(lon / self.lon_step), math.floor(lat / self.lat_step))
+
+    def points_in(self, ix: range, iy: range) -> np.ndarray:
+        """
+        範囲内のセルにある点 (self.lats などの添字)
+        """
+        ix = range(max(ix.start, self.ix_range[0]), min(ix.stop, self.ix_range[1] + 1))
+        iy = range(max(iy.start, self.iy_range[0]), min(iy.stop, self.iy_range[1] + 1))
+        found = [self.cells[c] for c in ((x, y) for x in ix for y in iy) if c in self.cells]
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def ring(self, lat: float, lon: float, r: int) -> np.ndarray:
+        """
+        (lat, lon) のセルからチェビシェフ距離でちょうど r 離れたセルにある点
+        """
+        cx, cy = self.cell_of(lat, lon)
+        if r == 0:
+            return self.points_in(range(cx, cx + 1), range(cy, cy + 1))
+        xs, ys = range(cx - r, cx + r + 1), range(cy - r, cy + r + 1)
+        return np.concatenate(
+            [
+                self.points_in(xs, range(cy - r, cy - r + 1)),
+                self.points_in(xs, range(cy + r, cy + r + 1)),
+                self.points_in(range(cx - r, cx - r + 1), range(cy - r + 1, cy + r)),
+                self.points_in(range(cx + r, cx + r + 1), range(cy - r + 1, cy + r)),
+            ]
+        )
+
+    def covered(self, lat: float, lon: float, r: int) -> bool:
+        """
+        半径 r のリングまででグリッド全体を見終わったか
+        """
+        cx, cy = self.cell_of(lat, lon)
+        return (
+            cx - r <= self.ix_range[0]
+            and cx + r >= self.ix_range[1]
+            and cy - r <= self.iy_range[0]
+            and cy + r >= self.iy_range[1]
+        )
+
+    def ring_distance(self, lat: float, lon: float) -> int:
+        """
+        (lat, lon) のセルから点のあるセルの範囲までのチェビシェフ距離 (範囲内なら 0)
+
+        これより内側のリングに点はない。
+        """
+        cx, cy = self.cell_of(lat, lon)
+        return max(
+            self.ix_range[0] - cx,
+            cx - self.ix_range[1],
+            self.iy_range[0] - cy,
+            cy - self.iy_range[1],
+            0,
+        )
+
+    def safe_radius_m(self, lat: float, r: int) -> float:
+        """
+        リング r まで見れば取りこぼしのない距離 (m)
+        """
+        lon_side = self.lon_step * METERS_PER_DEGREE * math.cos(math.radians(lat))
+        lat_side = self.lat_step * METERS_PER_DEGREE
+        # 平面近似の誤差を見込んで少し小さめにする
+        return r * min(lon_side, lat_side) * 0.99
+
+    def in_bbox(self, bbox: BBox) -> np.ndarray:
+        """
+        矩形内の点の行番号 (昇順)
+        """
+        if len(self.rows) == 0:
+            return np.empty(0, dtype=np.int64)
+        x0, y0 = self.cell_of(bbox.south, bbox.west)
+        x1, y1 = self.cell_of(bbox.north, bbox.east)
+        points = self.points_in(range(x0, x1 + 1), range(y0, y1 + 1))
+        lats, lons = self.lats[points], self.lons[points]
+        inside = (
+            (lats >= bbox.south)
+            & (lats <= bbox.north)
+            & (lons >= bbox.west)
+            & (lons <= bbox.east)
+        )
+        return np.sort(self.rows[points[inside]])
+
+    def within(self, lat: float, lon: float, radius_m: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        radius_m 以内の点
+
+        Returns:
+            (行番号, 距離) を距離の昇順で
+        """
+        if len(self.rows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        dlat = radius_m / METERS_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(abs(lat) + dlat)), 1e-6)
+        dlon = dlat / cos_lat
+        x0, y0 = self.cell_of(lat - dlat, lon - dlon)
+        x1, y1 = self.cell_of(lat + dlat, lon + dlon)
+        points = self.points_in(range(x0, x1 + 1), range(y0, y1 + 1))
+        distances = haversine_m(lat, lon, self.lats[points], self.lons[points])
+        inside = distances <= radius_m
+        return self._sorted(points[inside], distances[inside])
+
+    def nearest(
+        self, lat: float, lon: float, k: int, accept=None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        近い順に k 点
+
+        セルをリング状に広げながら探し、見つかった k 点目までの距離が
+        まだ見ていないセルより近ければ終える。グリッドの外の地点では、
+        点のあるセルの範囲に届くリングから始める (リングの数はグリッドの大きさまで)。
+
+        Args:
+            accept: 行番号の配列を受け取り、残す行の真偽値配列を返す関数 (省略時はすべて)
+        Returns:
+            (行番号, 距離) を距離の昇順で
+        """
+        found_points: List[np.ndarray] = []
+        found_distances: List[np.ndarray] = []
+        if len(self.rows) == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        r = self.ring_distance(lat, lon)
+        while True:
+            points = self.ring(lat, lon, r)
+            if len(points):
+                if accept is not None:
+                    points = points[accept(self.rows[points])]
+                found_points.append(points)
+                found_distances.append(
+                    haversine_m(lat, lon, self.lats[points], self.lons[points])
+                )
+            if self.covered(lat, lon, r):
+                break
+            distances = np.concatenate(found_distances) if found_distances else np.empty(0)
+            if np.count_nonzero(distances <= self.safe_radius_m(lat, r)) >= k:
+                break
+            r += 1
+        points, distances = self._sorted(
+            np.concatenate(found_points), np.concatenate(found_distances)
+        )
+        return points[:k], distances[:k]
+
+    def _sorted(self, points: np.ndarray, distances: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        order = np.argsort(distances, kind="stable")
+        return self.rows[points[order]], distances[order]
+
+
+def get_grid_index(snapshot: HoikuenSnapshot) -> GridIndex:
+    return snapshot.derived(
+        "grid_index",
+        lambda s: GridIndex(
+            s.df.get_column("緯度").cast(pl.Float64).fill_null(np.nan).to_numpy(),
+            s.df.get_column("経度").cast(pl.Float64).fill_null(np.nan).to_numpy(),
+        ),
+    )
+
+
+def filter_bbox(
+    snapshot: HoikuenSnapshot,
+    bbox: BBox,
+    expr: pl.Expr | None = None,
+    candidates: np.ndarray | None = None,
+) -> pl.DataFrame:
+    """
+    矩形内の保育園 (元の行順)
+
+    Args:
+        expr: 他のフィルター条件 (compile_filter の expr)。矩形内の行だけに適用する
+        candidates: 残してよい行番号 (昇順、部分一致検索の索引の結果など)。None ならすべて
+    """
+    rows = get_grid_index(snapshot).in_bbox(bbox)
+    if candidates is not None:
+        rows = np.intersect1d(rows, candidates, assume_unique=True)
+    df = snapshot.df[rows]
+    if expr is not None:
+        df = df.filter(expr)
+    return df
+
+
+def filter_nearby(
+    snapshot: HoikuenSnapshot,
+    query: NearbyQuery,
+    expr: pl.Expr | None = None,
+    candidates: np.ndarray | None = None,
+) -> pl.DataFrame:
+    """
+    地点の周辺の保育園を近い順に (距離のカラムを追加する)
+
+    Args:
+        snapshot: 保育園データのスナップショット
+        query: 地点と距離・件数
+        expr: 他のフィルター条件 (compile_filter の expr)。候補の行だけに適用する
+        candidates: 残してよい行番号 (部分一致検索の索引の結果など)。None ならすべて
+    Returns:
+        距離の昇順の DataFrame
+    """
+    index = get_grid_index(snapshot)
+
+    def accept(rows: np.ndarray) -> np.ndarray:
+        keep = np.ones(len(rows), dtype=bool)
+        if candidates is not None:
+            keep &= np.isin(rows, candidates)
+        if expr is not None and keep.any():
+            selected = snapshot.df[rows[keep]].select(expr.fill_null(False)).to_series()
+            keep[keep] = selected.to_numpy()
+        return keep
+
+    if query.radius_m is not None:
+        rows, distances = index.within(query.lat, query.lon, query.radius_m)
+        keep = accept(rows)
+        rows, distances = rows[keep], distances[keep]
+        if query.k is not None:
+            rows, distances = rows[: query.k], distances[: query.k]
+    else:
+        rows, distances = index.nearest(query.lat, query.lon, query.k or 0, accept)
+
+    return snapshot.df[rows].with_columns(
+        pl.Series(DISTANCE_COLUMN, np.round(distances), dtype=pl.Float64)
+    )
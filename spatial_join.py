@@ -0,0 +1,182 @@
+"""
+保育園と地図レイヤーの空間結合 (小学校区・最寄りのバス停・最寄りの小学校)
+
+計算は build_snapshots.py でだけ行い (geopandas, shapely を使う)、結果は
+data/hoikuen_joins.arrow に書き出す。アプリはこのキャッシュを読むだけで、キャッシュがない・
+古い (保育園 CSV のハッシュや GeoJSON の mtime が違う) 場合は空間結合のカラムを null にする。
+"""
+import json
+import os
+from typing import TYPE_CHECKING, Callable, Dict
+
+import polars as pl
+import xxhash
+
+from geo_sources import GEO_LAYER_FILES, source_versions
+
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+    from geodata import GeoDataRegistry, GeoLayers
+
+# 計算方法を変えたら上げる
+SPATIAL_JOIN_VERSION = "1"
+
+# 距離の計算に使う平面直角座標系 (第IX系, 東京都) [m]
+METRIC_CRS = "EPSG:6677"
+
+SCHOOL_DISTRICT_COLUMN = "小学校区"
+NEAREST_BUS_STOP_COLUMN = "最寄りバス停"
+NEAREST_BUS_STOP_DISTANCE_COLUMN = "最寄りバス停までの距離"
+NEAREST_SCHOOL_COLUMN = "最寄り小学校"
+NEAREST_SCHOOL_DISTANCE_COLUMN = "最寄り小学校までの距離"
+
+JOIN_SCHEMA = {
+    SCHOOL_DISTRICT_COLUMN: pl.String,
+    NEAREST_BUS_STOP_COLUMN: pl.String,
+    NEAREST_BUS_STOP_DISTANCE_COLUMN: pl.Int64,
+    NEAREST_SCHOOL_COLUMN: pl.String,
+    NEAREST_SCHOOL_DISTANCE_COLUMN: pl.Int64,
+}
+
+
+def spatial_joins_path(filename: str) -> str:
+    """
+    保育園データに対応する空間結合のキャッシュのパス
+    """
+    return os.path.splitext(filename)[0] + "_joins.arrow"
+
+
+def spatial_join_key(digest: str, geo_files: Dict[str, str] = GEO_LAYER_FILES) -> str:
+    """
+    空間結合の入力 (保育園データと各レイヤーの元ファイル) のハッシュ
+    """
+    text = json.dumps(
+        [SPATIAL_JOIN_VERSION, digest, sorted(source_versions(geo_files).items())]
+    )
+    return xxhash.xxh64(text.encode("utf-8")).hexdigest()
+
+
+def empty_spatial_joins(height: int) -> pl.DataFrame:
+    """
+    すべて null の空間結合のカラム
+    """
+    return pl.DataFrame(
+        [pl.Series(name, [None] * height, dtype=dtype) for name, dtype in JOIN_SCHEMA.items()]
+    )
+
+
+def _read_layer(read: Callable[[], "gpd.GeoDataFrame"]) -> "gpd.GeoDataFrame | None":
+    """
+    レイヤーを読む (GeoJSON がなければ None)
+    """
+    try:
+        return read()
+    except FileNotFoundError:
+        return None
+
+
+def compute_spatial_joins(df: pl.DataFrame, layers: "GeoLayers") -> pl.DataFrame:
+    """
+    各行の小学校区・最寄りのバス停・最寄りの小学校 (距離は m)
+
+    点と多角形・最近傍の判定は STRtree で行う。緯度/経度のない行と、
+    GeoJSON がないレイヤーのカラムは null。
+    レイヤーは保育園データと同じ区のもの (区をまたいだ最寄りは探さない)。
+
+    Returns:
+        df と同じ行順の JOIN_SCHEMA の DataFrame
+    """
+    import geopandas as gpd
+    import numpy as np
+    from shapely import STRtree
+
+    lats = df.get_column("緯度").cast(pl.Float64).to_numpy()
+    lons = df.get_column("経度").cast(pl.Float64).to_numpy()
+    valid = ~(np.isnan(lats) | np.isnan(lons))
+    rows = np.flatnonzero(valid)
+    points = gpd.GeoSeries(
+        gpd.points_from_xy(lons[valid], lats[valid]), crs="EPSG:4326"
+    ).to_crs(METRIC_CRS)
+
+    columns: dict[str, list] = {name: [None] * df.height for name in JOIN_SCHEMA}
+
+    # 小学校区 (複数に含まれる場合は最初の区域)
+    districts = _read_layer(lambda: layers.get("school_area"))
+    if districts is not None and len(districts) and len(points):
+        districts = districts.to_crs(METRIC_CRS)
+        tree = STRtree(districts.geometry.values)
+        point_idx, district_idx = tree.query(points.values, predicate="within")
+        names = districts["school_name"].to_numpy()
+        for p, d in zip(point_idx[::-1], district_idx[::-1]):
+            columns[SCHOOL_DISTRICT_COLUMN][rows[p]] = names[d]
+
+    def nearest(layer, name_column: str, name_key: str, distance_key: str) -> None:
+        if layer is None or len(layer) == 0 or len(points) == 0:
+            return
+        layer = layer.to_crs(METRIC_CRS)
+        tree = STRtree(layer.geometry.values)
+        (point_idx, layer_idx), distances = tree.query_nearest(
+            points.values, return_distance=True, all_matches=False
+        )
+        names = layer[name_column].to_numpy()
+        for p, i, distance in zip(point_idx, layer_idx, distances):
+            columns[name_key][rows[p]] = names[i]
+            columns[distance_key][rows[p]] = int(round(distance))
+
+    nearest(
+        _read_layer(lambda: layers.get("bus_stop")),
+        "bus_stop_name",
+        NEAREST_BUS_STOP_COLUMN,
+        NEAREST_BUS_STOP_DISTANCE_COLUMN,
+    )
+    nearest(
+        _read_layer(lambda: layers.school_class("小学校")),
+        "school_name",
+        NEAREST_SCHOOL_COLUMN,
+        NEAREST_SCHOOL_DISTANCE_COLUMN,
+    )
+    return pl.DataFrame(columns, schema=JOIN_SCHEMA)
+
+
+def build_spatial_joins(
+    df: pl.DataFrame, filename: str, digest: str, layers: "GeoDataRegistry"
+) -> pl.DataFrame:
+    """
+    空間結合を計算してキャッシュ (非圧縮の Arrow IPC) に書き出す (build_snapshots.py)
+    """
+    import pyarrow as pa
+
+    joins = compute_spatial_joins(df, layers)
+    table = joins.to_arrow().replace_schema_metadata(
+        {"join_key": spatial_join_key(digest, layers.files)}
+    )
+    path = spatial_joins_path(filename)
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return joins
+
+
+def read_spatial_joins(
+    filename: str, digest: str, height: int, geo_files: Dict[str, str] = GEO_LAYER_FILES
+) -> pl.DataFrame | None:
+    """
+    有効なキャッシュがあれば読み込む (入力のハッシュや行数が違えば None)
+    """
+    import pyarrow as pa
+
+    path = spatial_joins_path(filename)
+    if not os.path.exists(path):
+        return None
+    with pa.memory_map(path) as source:
+        schema = pa.ipc.open_file(source).schema
+    metadata = {k.decode(): v.decode() for k, v in (schema.metadata or {}).items()}
+    if metadata.get("join_key") != spatial_join_key(digest, geo_files):
+        return None
+    joins = pl.read_ipc(path, memory_map=True)
+    if joins.height != height or dict(joins.schema) != JOIN_SCHEMA:
+        return None
+    return joins
@@ -0,0 +1,128 @@
+import unicodedata
+from typing import Dict, Iterable, List
+
+import numpy as np
+import polars as pl
+
+from hoikuen_store import HoikuenSnapshot
+
+# 索引を作るカラム
+TEXT_INDEX_COLUMNS = ("名称", "所在地")
+
+# ひらがな → カタカナ
+_HIRAGANA_TO_KATAKANA = {code: code + 0x60 for code in range(0x3041, 0x3097)}
+
+
+def normalize_text(text: str | None) -> str:
+    """
+    検索用の正規化
+
+    全角/半角 (NFKC)・大文字/小文字・ひらがな/カタカナの違いをなくし、空白を取り除く。
+    """
+    if text is None:
+        return ""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = text.translate(_HIRAGANA_TO_KATAKANA)
+    return "".join(text.split())
+
+
+def normalize_series(series: pl.Series) -> pl.Series:
+    return series.map_elements(normalize_text, return_dtype=pl.String, skip_nulls=False)
+
+
+def text_contains(column: pl.Expr, query: str) -> pl.Expr:
+    """
+    正規化した文字列に正規化した query が含まれるか (正規表現としては扱わない)
+    """
+    return column.map_batches(normalize_series, return_dtype=pl.String).str.contains(
+        normalize_text(query), literal=True
+    )
+
+
+class BigramIndex:
+    """
+    正規化した文字列の 2-gram 転置索引
+
+    検索は query の 2-gram の出現行 (ポスティングリスト) を積集合で絞り込み、
+    候補の行だけ部分文字列として含むか確かめる。
+    """
+
+    def __init__(self, texts: Iterable[str | None]):
+        self.texts = [normalize_text(text) for text in texts]
+        postings: Dict[str, List[int]] = {}
+        for row, text in enumerate(self.texts):
+            grams = {text[i : i + 2] for i in range(len(text) - 1)}
+            # 1文字の検索用
+            grams.update(text)
+            for gram in grams:
+                postings.setdefault(gram, []).append(row)
+        self.postings = {
+            gram: np.array(rows, dtype=np.int64) for gram, rows in postings.items()
+        }
+
+    def search(self, query: str) -> np.ndarray | None:
+        """
+        正規化した query を含む行番号 (昇順)。query が空ならすべての行なので None
+        """
+        query = normalize_text(query)
+        if not query:
+            return None
+        if len(query) == 1:
+            grams = {query}
+        else:
+            grams = {query[i : i + 2] for i in range(len(query) - 1)}
+        lists = []
+        for gram in grams:
+            rows = self.postings.get(gram)
+            if rows is None:
+                return np.empty(0, dtype=np.int64)
+            lists.append(rows)
+        lists.sort(key=len)
+        candidates = lists[0]
+        for rows in lists[1:]:
+            candidates = np.intersect1d(candidates, rows, assume_unique=True)
+            if len(candidates) == 0:
+                return candidates
+        if len(query) <= 2:
+            return candidates
+        return np.array(
+            [row for row in candidates if query in self.texts[row]], dtype=np.int64
+        )
+
+
+class TextIndex:
+    """
+    保育園データの名称・所在地の索引
+    """
+
+    def __init__(self, df: pl.DataFrame, columns: Iterable[str] = TEXT_INDEX_COLUMNS):
+        self.height = df.height
+        self.columns = {
+            column: BigramIndex(df.get_column(column).to_list()) for column in columns
+        }
+
+    def search(self, queries: Dict[str, str]) -> np.ndarray | None:
+        """
+        カラムごとの検索文字列をすべて満たす行番号 (昇順)。条件がなければ None
+        """
+        result = None
+        for column, query in queries.items():
+            rows = self.columns[column].search(query)
+            if rows is None:
+                continue
+            result = rows if result is None else np.intersect1d(result, rows)
+        return result
+
+
+def get_text_index(snapshot: HoikuenSnapshot) -> TextIndex:
+    return snapshot.derived("text_index", lambda s: TextIndex(s.df))
+
+
+def search_text(snapshot: HoikuenSnapshot, queries: Dict[str, str]) -> pl.DataFrame:
+    """
+    名称・所在地の部分一致検索 (元の行順)
+    """
+    rows = get_text_index(snapshot).search(queries)
+    if rows is None:
+        return snapshot.df
+    return snapshot.df[rows]
@@ -1,6 +1,7 @@
 # This file will contain utility functions
 import polars as pl
 import datetime
+import os
 import base58
 import xxhash
 from flask import request
@@ -111,38 +112,40 @@ def xx58_hashstr_to_hashbyte(hashstr: str) -> bytes:
     return base58.b58decode(hashstr)
 
 
-def load_hoikuen_csv(filename: str = "data/hoikuen.csv") -> pl.LazyFrame:
+# 空き状況のカラム (年齢ごと)
+VACANCY_AGE_COLUMNS = ["0歳児", "1歳児", "2歳児", "3歳児", "4歳児", "5歳児"]
+# 空き状況のカラム (年齢をまとめたもの)
+VACANCY_RANGE_COLUMNS = ["3歳児から5歳児", "4歳児から5歳児"]
+
+
+def parse_vacancy_columns(lf: pl.LazyFrame) -> pl.LazyFrame:
     """
-    保育園データのロード
+    空き状況を数値型に変換
     """
-    lf = pl.scan_csv(filename)
+    return lf.with_columns(
+        pl.col("0歳児").replace({"（なし）": None}).cast(pl.Int64),
+        pl.col("1歳児").replace({"（なし）": None}).cast(pl.Int64),
+        pl.col("2歳児").replace({"（なし）": None}).cast(pl.Int64),
+        pl.col("3歳児").replace({"（なし）": None}).cast(pl.Int64),
+        pl.col("4歳児").replace({"（なし）": None}).cast(pl.Int64),
+        pl.col("5歳児").replace({"（なし）": None}).cast(pl.Int64),
+        pl.col("3歳児から5歳児")
+        .replace({"（なし）": None})
+        .cast(pl.Float64)
+        .cast(pl.Int64),
+        pl.col("4歳児から5歳児")
+        .replace({"（なし）": None})
+        .cast(pl.Float64)
+        .cast(pl.Int64),
+    )
 
-    # データの前処理
-    lf = (
+
+def fill_vacancy_by_range(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    年齢ごとの空き状況を、年齢をまとめた空き状況で補完
+    """
+    return (
         lf
-        # 時間の型を変換
-        .with_columns(
-            pl.col("開始時間").str.to_time("%H:%M"),
-            pl.col("終了時間").str.to_time("%H:%M"),
-            pl.col("延長保育終了時間").str.to_time("%H:%M"),
-        )
-        # 空き状況を数値型に変換
-        .with_columns(
-            pl.col("0歳児").replace({"（なし）": None}).cast(pl.Int64),
-            pl.col("1歳児").replace({"（なし）": None}).cast(pl.Int64),
-            pl.col("2歳児").replace({"（なし）": None}).cast(pl.Int64),
-            pl.col("3歳児").replace({"（なし）": None}).cast(pl.Int64),
-            pl.col("4歳児").replace({"（なし）": None}).cast(pl.Int64),
-            pl.col("5歳児").replace({"（なし）": None}).cast(pl.Int64),
-            pl.col("3歳児から5歳児")
-            .replace({"（なし）": None})
-            .cast(pl.Float64)
-            .cast(pl.Int64),
-            pl.col("4歳児から5歳児")
-            .replace({"（なし）": None})
-            .cast(pl.Float64)
-            .cast(pl.Int64),
-        )
         # 3歳児から5歳児の空き状況を補完
         .with_columns(
             pl.when(pl.col("3歳児から5歳児").is_not_null())
@@ -159,4 +162,142 @@ def load_hoikuen_csv(filename: str = "data/hoikuen.csv") -> pl.LazyFrame:
         )
     )
 
+
+def load_hoikuen_csv(filename: str = "data/hoikuen.csv") -> pl.LazyFrame:
+    """
+    保育園データのロード
+    """
+    lf = pl.scan_csv(filename)
+
+    # データの前処理
+    lf = (
+        lf
+        # 時間の型を変換
+        .with_columns(
+            pl.col("開始時間").str.to_time("%H:%M"),
+            pl.col("終了時間").str.to_time("%H:%M"),
+            pl.col("延長保育終了時間").str.to_time("%H:%M"),
+        )
+        # 空き状況を数値型に変換
+        .pipe(parse_vacancy_columns)
+        # 3歳児から5歳児・4歳児から5歳児の空き状況を補完
+        .pipe(fill_vacancy_by_range)
+    )
+
     return lf
+
+
+# 前処理を変えたら上げる (古いスナップショットを使わないように)
+HOIKUEN_PREPROCESS_VERSION = "1"
+
+
+def file_digest(filename: str) -> str:
+    """
+    ファイル内容のハッシュ (xxHash64, 16進文字列)
+    """
+    hasher = xxhash.xxh64()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def hoikuen_snapshot_path(filename: str) -> str:
+    """
+    保育園データのスナップショット (Arrow IPC) のパス
+    """
+    return os.path.splitext(filename)[0] + ".arrow"
+
+
+def schema_fingerprint(schema: pl.Schema) -> str:
+    """
+    前処理のバージョンとスキーマ (列名・型) のハッシュ
+    """
+    text = HOIKUEN_PREPROCESS_VERSION + "|" + ",".join(
+        f"{name}:{dtype}" for name, dtype in schema.items()
+    )
+    return xxhash.xxh64(text.encode("utf-8")).hexdigest()
+
+
+def expected_schema(filename: str) -> pl.Schema:
+    """
+    CSV を前処理した結果のスキーマ (load_hoikuen_csv の型。データは読まない)
+    """
+    return load_hoikuen_csv(filename).collect_schema()
+
+
+def build_hoikuen_snapshot(
+    filename: str = "data/hoikuen.csv", digest: str | None = None
+) -> str:
+    """
+    前処理済みの保育園データをスナップショット (非圧縮の Arrow IPC) に書き出す
+
+    メタデータに前処理後のスキーマのフィンガープリントと元 CSV のハッシュを入れる。
+
+    Returns:
+        書き出したファイルのパス
+    """
+    import pyarrow as pa
+
+    if digest is None:
+        digest = file_digest(filename)
+    df = load_hoikuen_csv(filename).collect()
+    metadata = {
+        "schema_fingerprint": schema_fingerprint(expected_schema(filename)),
+        "source_digest": digest,
+    }
+    table = df.to_arrow()
+    table = table.replace_schema_metadata(metadata)
+
+    path = hoikuen_snapshot_path(filename)
+    tmp_path = path + ".tmp"
+    # メモリマップで読めるように圧縮しない
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_hoikuen_snapshot(filename: str, digest: str | None = None) -> pl.DataFrame | None:
+    """
+    有効なスナップショットがあればメモリマップで読み込む
+
+    スナップショットがない・CSV より古い・元 CSV のハッシュがない/一致しない・
+    フィンガープリントや列の型が今の前処理 (expected_schema) と一致しない場合は None を返す。
+    """
+    import pyarrow as pa
+
+    path = hoikuen_snapshot_path(filename)
+    if not os.path.exists(path):
+        return None
+    if os.stat(path).st_mtime_ns < os.stat(filename).st_mtime_ns:
+        return None
+
+    with pa.memory_map(path) as source:
+        schema = pa.ipc.open_file(source).schema
+    metadata = {k.decode(): v.decode() for k, v in (schema.metadata or {}).items()}
+    if digest is None:
+        digest = file_digest(filename)
+    if metadata.get("source_digest") != digest:
+        return None
+    expected = expected_schema(filename)
+    if metadata.get("schema_fingerprint") != schema_fingerprint(expected):
+        return None
+
+    df = pl.read_ipc(path, memory_map=True)
+    if df.schema != expected:
+        return None
+    return df
+
+
+def load_hoikuen_table(filename: str = "data/hoikuen.csv", digest: str | None = None) -> pl.DataFrame:
+    """
+    前処理済みの保育園データ
+
+    有効なスナップショットがあればそれを、なければ CSV を読み込む。
+    """
+    df = read_hoikuen_snapshot(filename, digest)
+    if df is None:
+        df = load_hoikuen_csv(filename).collect()
+    return df
@@ -0,0 +1,156 @@
+"""
+空き状況の差分ファイル
+
+    python vacancy_delta.py [data/hoikuen_vacancy.csv]
+
+空き状況 (0歳児〜5歳児, 3歳児から5歳児, 4歳児から5歳児) だけを更新する CSV。
+キーは「名称」か「ハッシュ」(/view?h= のハッシュ) のどちらかのカラム。
+差分に含まれる保育園は、空き状況のカラムをすべて差分の値で置き換える
+(差分にないカラム・空欄は「（なし）」と同じ)。
+
+data/hoikuen.csv と同じ場所に置くと、アプリは再起動なしで取り込む (HoikuenStore)。
+置く前にこのスクリプトで検証できる。書き込み途中のファイルを読まないように、
+別名で書いてから mv で置き換えること。
+"""
+import argparse
+import os
+import re
+import sys
+from typing import List
+
+import polars as pl
+
+from util import (
+    VACANCY_AGE_COLUMNS,
+    VACANCY_RANGE_COLUMNS,
+    fill_vacancy_by_range,
+    load_hoikuen_table,
+    parse_vacancy_columns,
+    xx58_str_to_hashstr,
+)
+
+# キーにできるカラム
+DELTA_KEY_COLUMNS = ("名称", "ハッシュ")
+VACANCY_COLUMNS = VACANCY_AGE_COLUMNS + VACANCY_RANGE_COLUMNS
+
+# 空き状況の値 (年齢をまとめたカラムは元の CSV と同じく "2.0" も可)
+_AGE_VALUE = re.compile(r"\d+|（なし）")
+_RANGE_VALUE = re.compile(r"\d+(\.0)?|（なし）")
+
+
+class VacancyDeltaError(ValueError):
+    """
+    差分ファイルの内容が不正
+    """
+
+
+def vacancy_delta_path(filename: str) -> str:
+    """
+    保育園データに対応する差分ファイルのパス
+    """
+    return os.path.splitext(filename)[0] + "_vacancy.csv"
+
+
+def read_vacancy_delta(filename: str) -> pl.DataFrame:
+    """
+    差分ファイルを読み込んで検証する
+
+    Returns:
+        キーのカラムと VACANCY_COLUMNS (数値型) の DataFrame
+    Raises:
+        VacancyDeltaError: カラム・キー・値が不正な場合
+    """
+    try:
+        delta = pl.read_csv(filename, infer_schema=False)
+    except (OSError, pl.exceptions.PolarsError) as e:
+        raise VacancyDeltaError(f"{filename}: {e}") from e
+
+    keys = [c for c in delta.columns if c in DELTA_KEY_COLUMNS]
+    if len(keys) != 1:
+        raise VacancyDeltaError(f"{filename}: キーは 名称 か ハッシュ のどちらか1つ")
+    key = keys[0]
+    unknown = [c for c in delta.columns if c != key and c not in VACANCY_COLUMNS]
+    if unknown:
+        raise VacancyDeltaError(f"{filename}: 空き状況以外のカラム: {', '.join(unknown)}")
+    if len(delta.columns) == 1:
+        raise VacancyDeltaError(f"{filename}: 空き状況のカラムがない")
+
+    errors: List[str] = []
+    if delta.get_column(key).null_count():
+        errors.append(f"{key} が空の行がある")
+    duplicated = delta.filter(pl.col(key).is_duplicated()).get_column(key).unique()
+    if len(duplicated):
+        errors.append(f"{key} の重複: {', '.join(duplicated.drop_nulls().to_list())}")
+    for column in delta.columns:
+        if column == key:
+            continue
+        pattern = _RANGE_VALUE if column in VACANCY_RANGE_COLUMNS else _AGE_VALUE
+        invalid = [
+            value
+            for value in delta.get_column(column).drop_nulls().unique().to_list()
+            if not pattern.fullmatch(value)
+        ]
+        if invalid:
+            errors.append(f"{column} の値が不正: {', '.join(invalid)}")
+    if errors:
+        raise VacancyDeltaError(f"{filename}: " + " / ".join(errors))
+
+    return (
+        delta.lazy()
+        .with_columns(
+            pl.lit(None, dtype=pl.String).alias(c)
+            for c in VACANCY_COLUMNS
+            if c not in delta.columns
+        )
+        .pipe(parse_vacancy_columns)
+        .select(key, *VACANCY_COLUMNS)
+        .collect()
+    )
+
+
+def apply_vacancy_delta(df: pl.DataFrame, delta: pl.DataFrame) -> pl.DataFrame:
+    """
+    差分を適用した新しい DataFrame (df は変更しない)
+
+    年齢ごとの空き状況は load_hoikuen_csv と同じく年齢をまとめた空き状況で補完する。
+
+    Raises:
+        VacancyDeltaError: データにない名称・ハッシュがある場合
+    """
+    names = df.get_column("名称")
+    if "ハッシュ" in delta.columns:
+        by_hash = {xx58_str_to_hashstr(name): name for name in names.unique().to_list()}
+        missing = [h for h in delta.get_column("ハッシュ").to_list() if h not in by_hash]
+        delta = delta.with_columns(
+            pl.col("ハッシュ").replace_strict(by_hash, default=None).alias("名称")
+        ).drop("ハッシュ")
+    else:
+        missing = delta.filter(~pl.col("名称").is_in(names)).get_column("名称").to_list()
+    if missing:
+        raise VacancyDeltaError(f"データにない保育園: {', '.join(missing)}")
+
+    updated = df.update(delta, on="名称", how="left", include_nulls=True)
+    return (
+        fill_vacancy_by_range(updated.lazy())
+        .select(df.columns)
+        .collect()
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="空き状況の差分ファイルを検証する")
+    parser.add_argument("delta", nargs="?", default=vacancy_delta_path("data/hoikuen.csv"))
+    parser.add_argument("--csv", default="data/hoikuen.csv")
+    args = parser.parse_args()
+
+    try:
+        delta = read_vacancy_delta(args.delta)
+        apply_vacancy_delta(load_hoikuen_table(args.csv), delta)
+    except VacancyDeltaError as e:
+        print(f"NG: {e}")
+        sys.exit(1)
+    print(f"OK: {args.delta} ({delta.height} 件)")
+
+
+if __name__ == "__main__":
+    main()
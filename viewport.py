@@ -0,0 +1,135 @@
+"""
+地図の表示範囲 (ビューポート) 内の地物を返す
+
+保育園はスナップショットのグリッド索引、バス停・学校はレイヤーごとのグリッド索引で引く。
+区 (パーティション) は表示範囲に重なるものだけを読む。
+"""
+from typing import Any, Dict, List, NamedTuple
+
+import numpy as np
+import polars as pl
+
+from cache import LRUCache
+from geodata import GeoLayers
+from hoiku import check_spatial_joins, compile_filter, text_candidates
+from metrics import register_cache
+from form_filter import FilterForm
+from spatial_index import BBox, GridIndex, filter_bbox
+from wards import Ward, get_ward, select_wards, ward_layers, ward_snapshot
+
+# 表示範囲の外側にも取得する余白 (縦横それぞれ表示範囲の何倍か)
+VIEWPORT_MARGIN = 0.25
+
+
+class PointLayerSpec(NamedTuple):
+    layer: str  # 元データのレイヤー名 (geodata)
+    school_class: str | None  # 学校レイヤーの種類
+    columns: Dict[str, str]  # 元のカラム名 → 返すキー
+    min_zoom: int  # これより引いた地図では返さない (点が多すぎる)
+
+
+# オーバーレイ名 (FilterForm のチェックボックス名) → ポイントレイヤー
+POINT_OVERLAYS: Dict[str, PointLayerSpec] = {
+    "bus_stop": PointLayerSpec(
+        "bus_stop",
+        None,
+        {"bus_stop_name": "name", "bus_operator": "operator", "route_number": "route"},
+        15,
+    ),
+    "elementary_school": PointLayerSpec("school", "小学校", {"school_name": "name"}, 13),
+    "kindergarten": PointLayerSpec("school", "幼稚園", {"school_name": "name"}, 13),
+}
+
+# (オーバーレイ名, 区, レイヤーのバージョン) → (地物の DataFrame, グリッド索引)
+_layer_indexes = register_cache("viewport_layer", LRUCache(maxsize=64))
+
+
+def get_point_layer_index(name: str, geo: GeoLayers) -> tuple[pl.DataFrame, GridIndex]:
+    """
+    ポイントレイヤーの地物 (返すカラムと緯度/経度のみ) とグリッド索引
+    """
+    spec = POINT_OVERLAYS[name]
+
+    def build() -> tuple[pl.DataFrame, GridIndex]:
+        if spec.school_class is None:
+            layer = geo.get(spec.layer)
+        else:
+            layer = geo.school_class(spec.school_class)
+        df = pl.DataFrame(
+            {
+                **{key: layer[column].astype(str).tolist() for column, key in spec.columns.items()},
+                "lat": layer["緯度"].to_numpy(dtype=np.float64),
+                "lon": layer["経度"].to_numpy(dtype=np.float64),
+            }
+        )
+        index = GridIndex(df["lat"].to_numpy(), df["lon"].to_numpy())
+        return df.with_columns(pl.col("lat", "lon").round(6)), index
+
+    key = (name, geo.name, geo.version(spec.layer))
+    return _layer_indexes.get_or_set(key, build)
+
+
+def point_layer_features(name: str, bbox: BBox, geo: GeoLayers) -> pl.DataFrame:
+    """
+    矩形内のポイントレイヤーの地物
+    """
+    df, index = get_point_layer_index(name, geo)
+    return df[index.in_bbox(bbox)]
+
+
+def viewport_wards(form: FilterForm, bbox: BBox) -> List[Ward]:
+    """
+    表示範囲 (余白つき) に重なる区。区の指定があればその区だけ
+
+    どの区にも重ならなければ渋谷区 (空の結果を同じ形で返す)。
+
+    Raises:
+        ValueError: 存在しない区の場合
+    """
+    return select_wards(form.ward.data, bbox.expand(VIEWPORT_MARGIN)) or [get_ward(None)]
+
+
+def viewport_features(
+    form: FilterForm,
+    bbox: BBox,
+    zoom: int,
+    layers: List[str],
+) -> Dict[str, Dict[str, List[Any]] | None]:
+    """
+    表示範囲 (余白つき) 内の地物をレイヤーごとに
+
+    Args:
+        form: フィルター条件フォームデータ (保育園に適用する)。区の指定があればその区だけ
+        bbox: 地図の表示範囲
+        zoom: 地図のズームレベル
+        layers: "nursery" と POINT_OVERLAYS の名前
+    Returns:
+        レイヤー名 → 列指向のデータ。ズームレベルが小さすぎるレイヤーは None
+    Raises:
+        ValueError: 存在しない区の場合・空間結合のカラムで絞り込めない場合
+    """
+    from mapping import nursery_markers
+
+    wards = viewport_wards(form, bbox)
+    bbox = bbox.expand(VIEWPORT_MARGIN)
+    features: Dict[str, Dict[str, List[Any]] | None] = {}
+    for name in layers:
+        if name == "nursery":
+            expr = compile_filter(form).expr
+            snapshots = [ward_snapshot(ward) for ward in wards]
+            for snapshot in snapshots:
+                check_spatial_joins(snapshot, form)
+            frames = [
+                filter_bbox(snapshot, bbox, expr, text_candidates(snapshot, form))
+                for snapshot in snapshots
+            ]
+            features[name] = nursery_markers(pl.concat(frames, how="vertical_relaxed"))
+        elif name in POINT_OVERLAYS:
+            if zoom < POINT_OVERLAYS[name].min_zoom:
+                features[name] = None
+            else:
+                frames = [
+                    point_layer_features(name, bbox, ward_layers([ward])) for ward in wards
+                ]
+                features[name] = pl.concat(frames).to_dict(as_series=False)
+    return features
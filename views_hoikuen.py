@@ -1,66 +1,116 @@
 import json
+import logging
 import polars as pl
-from typing import cast, Any, List, Dict
-from compact_json import Formatter, EolStyle
-from flask import render_template, request
+from functools import cache
+from typing import TYPE_CHECKING, cast, Any, List, Dict
+from urllib.parse import urlencode
+from flask import Response, render_template, request
 
 from flask_wtf import FlaskForm  # type: ignore
 from wtforms import BooleanField, StringField
 from wtforms.validators import Optional as WtfOptional
 
 from __version__ import VERSION
-from hoiku import filter_data
+from autocomplete import suggest_names
+from cache import LRUCache
+from hoiku import filter_form_key, filter_snapshots, nearby_bbox, nearby_query
+from hoikuen_store import HoikuenSnapshot
+from http_cache import PERMALINK_MAX_AGE, conditional
+from json_stream import json_response
+from logger import FORM_SAMPLE_RATE, get_logger, log_event, sampled
+from metrics import (
+    METRICS_TOKEN,
+    metrics_authorized,
+    observe_rows,
+    register_cache,
+    render_metrics,
+    stage,
+    timed_route,
+)
+from spatial_index import DISTANCE_COLUMN, parse_bbox
+from text_index import search_text, text_contains
 from util import (
-    load_hoikuen_csv,
     shorten_address,
-    xx58_str_to_hashstr,
     to_url,
     is_enrollable,
     time_to_HHMM_ja,
 )
 
-# Below are requried by fn_hoikuen_search_result()
-from branca.element import Figure
-import folium
-from folium.features import CustomIcon
-from folium.template import Template
-import geopandas as gpd
-from mapping import make_nursery_map
 from form_filter import FilterForm
-
-# JSON 整形用ユーティリティ
-json_formatter = Formatter(
-    ensure_ascii=False,
-    indent_spaces=2,
-    json_eol_style=EolStyle.LF,
-    east_asian_string_widths=True,
+from wards import (
+    Ward,
+    get_ward,
+    select_wards,
+    ward_area,
+    ward_layers,
+    ward_of_hash,
+    ward_snapshot,
+    wards_by_distance,
 )
-json_formatter.init_internals()
+
+# 地図関連 (geopandas, folium, branca) は起動を遅くするので、必要になった時に読み込む
+# (/view, /list では読み込まない)。python importtime_report.py で確認できる。
+if TYPE_CHECKING:
+    from compact_json import Formatter
 
 
-class ClickToPanIcon(CustomIcon):
+@cache
+def get_json_formatter() -> "Formatter":
     """
-    Icon with click event to pan.
-    Works as a drop-in replacement of CustomIcon.
+    JSON 整形用ユーティリティ
     """
+    from compact_json import Formatter, EolStyle
 
-    _template = Template(
-        """
-        {% macro script(this, kwargs) %}
-        var {{ this.get_name() }} = L.icon({{ this.options|tojavascript }});
-        {{ this._parent.get_name() }}.setIcon({{ this.get_name() }});
-        {{this._parent.get_name()}}.on('click', function (e) {
-            const lat = e.latlng.lat;
-            const lng = e.latlng.lng;
-            {{ this._parent.get_name() }}._map.setView(new L.LatLng(lat, lng), 17);
-        });
-        {% endmacro %}
-        """
+    json_formatter = Formatter(
+        ensure_ascii=False,
+        indent_spaces=2,
+        json_eol_style=EolStyle.LF,
+        east_asian_string_widths=True,
     )
+    json_formatter.init_internals()
+    return json_formatter
+
+
+log = get_logger("views")
 
 
-def info(message: Any) -> None:
-    print(message)
+def log_form(route: str, data: Dict[str, Any]) -> None:
+    """
+    検索フォームの内容 (LOG_FORM_SAMPLE の割合のリクエストだけ)
+    """
+    if sampled(FORM_SAMPLE_RATE):
+        log_event(log, logging.INFO, "form", route=route, form=data)
+
+
+def form_wards(form: FilterForm) -> List[Ward]:
+    """
+    検索で読む区 (区の指定、なければ周辺検索の範囲に重なる区、どちらもなければ渋谷区)
+
+    件数だけの周辺検索は範囲が決まらないので、地点に近い区から順に絞り込み、
+    k 件目までの距離より近い区がなくなるまで区を増やす (区の境界の向こうの施設や、
+    どの区にも入らない地点も取りこぼさない)。絞り込みの結果はキャッシュされるので、
+    呼び出し側でもう一度 filter_snapshots しても二重には計算しない。
+
+    Raises:
+        ValueError: 存在しない区の場合・周辺検索の条件が不正な場合
+    """
+    query = nearby_query(form)
+    if form.ward.data or query is None or query.radius_m is not None or query.k is None:
+        return select_wards(form.ward.data, nearby_bbox(form)) or [get_ward(None)]
+
+    wards: List[Ward] = []
+    for distance, ward in wards_by_distance(query.lat, query.lon):
+        if wards:
+            df = filter_snapshots([ward_snapshot(w) for w in wards], form)
+            # 見つかった k 件目よりこの区 (とそれより遠い区) の範囲が遠ければ終わり
+            if df.height >= query.k and df.get_column(DISTANCE_COLUMN)[-1] <= distance:
+                break
+        wards.append(ward)
+    return wards
+
+
+def bad_request(e: Exception) -> Response:
+    return Response(str(e), status=400, mimetype="text/plain")
 
 
 class IndexForm(FlaskForm):
@@ -81,142 +131,85 @@ def fn_hoikuen_index() -> str:
     return render_template("hoikuen/index.html", **context)
 
 
-def fn_hoikuen_search_result() -> str:
+@timed_route("search_result")
+def fn_hoikuen_search_result() -> str | Response:
     """
     /search_result : 保育園マップ 検索インターフェース
     """
-    # time_start = time.time()
-
-    # バス関連のデータの読み込み
-    bus_stop = gpd.read_file("data/geojson/shibuya_busstop.geojson")
-    bus_stop["経度"] = bus_stop.geometry.x
-    bus_stop["緯度"] = bus_stop.geometry.y
-    bus_route = gpd.read_file("data/geojson/shibuya_busline.geojson")
-
-    # 幼稚園・小学校関連のデータの読み込み
-    school = gpd.read_file("data/geojson/shibuya_school.geojson")
-    school["経度"] = school.geometry.x
-    school["緯度"] = school.geometry.y
-    school_area = gpd.read_file("data/geojson/shibuya_schoolarea.geojson")
-
-    # 保育園データのロード
-    lf = load_hoikuen_csv()
+    # Below are requried by fn_hoikuen_search_result()
+    from branca.element import Figure
+    import folium
+    from overlays import add_overlays
+    from mapping import MapArea, build_nursery_map, set_base_url
 
     # メッセージ
     messages: list[str] = []
 
     # リクエストから、フィルターを取得
     form = FilterForm()
-    # if app.debug:
-    formatted_json = json_formatter.format_dict(0, form.to_dict()).value
-    info(f"form: {formatted_json}")
-    # else:
-    # info(f"form: {form.data}")
-
-    # フィルター後のデータを取得
-    filtered_data = filter_data(lf, form)
-
-    # 地図を作成
-    nursery_map = make_nursery_map(filtered_data)
-
-    # バス停の出し分け
-    if form.bus_stop.data:
-        bus_group = folium.FeatureGroup(name="バス停")
-        bus_icon_image = to_url("/asset/bus.png")
-
-        def create_bus_stop_marker(row):
-            popup_text = f"<p style='font-size: 15px;'>バス停名: {row['bus_stop_name']}<br> バス事業者:{row['bus_operator']} <br>路線番号: {row['route_number']}</p>"
-            folium.Marker(
-                location=[row["緯度"], row["経度"]],
-                popup=folium.Popup(popup_text, max_width=300, autoPan=False),
-                icon=ClickToPanIcon(
-                    icon_image=bus_icon_image,
-                    icon_size=(45, 45),
-                ),
-            ).add_to(bus_group)
-
-        bus_stop.apply(create_bus_stop_marker, axis=1)
-        bus_group.add_to(nursery_map)
-
-    # バスルートの出し分け
-    if form.bus_route.data:
-        bus_route_group = folium.FeatureGroup(name="バスルート")
-        folium.GeoJson(bus_route).add_to(bus_route_group)
-        bus_route_group.add_to(nursery_map)
-
-    # 小学校/幼稚園の出し分け
-    if form.elementary_school.data or form.kindergarten.data:
-        # マーカー用関数
-        def create_school_marker(row, icon_image, group):
-            popup_text = f"<p style='font-size: 15px;'>{row['school_name']}</p>"
-            folium.Marker(
-                location=[row["緯度"], row["経度"]],
-                popup=folium.Popup(popup_text, max_width=300, autoPan=False),
-                icon=ClickToPanIcon(
-                    icon_image=icon_image,
-                    icon_size=(50, 50),
-                ),
-                tooltip=folium.Tooltip(
-                    text=f"{row['school_name']}",
-                    sticky=True,
-                    style="background-color: white; font-size: 13px; font-weight: bold;",
-                ),
-            ).add_to(group)
-
-        if form.elementary_school.data:
-            elementary_group = folium.FeatureGroup(name="小学校")
-            (
-                school.query('school_class == "小学校"').apply(
-                    create_school_marker,
-                    icon_image=to_url("/asset/elementary.png"),
-                    group=elementary_group,
-                    axis=1,
-                )
-            )
-            elementary_group.add_to(nursery_map)
-
-        if form.kindergarten.data:
-            kindergarten_group = folium.FeatureGroup(name="幼稚園")
-            (
-                school.query('school_class == "幼稚園"').apply(
-                    create_school_marker,
-                    icon_image=to_url("/asset/kindergarten.png"),
-                    group=kindergarten_group,
-                    axis=1,
-                )
-            )
-            kindergarten_group.add_to(nursery_map)
-
-    # 小学校区の出し分け
-    if form.school_district.data:
-        school_area_group = folium.FeatureGroup(name="小学校区")
-
-        def style_function(feature):
-            return {
-                "color": "#34D15F",
-                "fillOpacity": 0.1,
-                "weight": 3,
-            }
+    log_form("search_result", form.to_dict())
+
+    # 保育園データのロード (検索する区のみ、プロセス内キャッシュ)
+    try:
+        wards = form_wards(form)
+    except ValueError as e:
+        return bad_request(e)
+    with stage("data_load"):
+        snapshots = [ward_snapshot(ward) for ward in wards]
+
+    # フィルター後のデータを取得 (同じ条件の結果はキャッシュから)
+    with stage("filter"):
+        try:
+            filtered_data = filter_snapshots(snapshots, form)
+        except ValueError as e:
+            return bad_request(e)
+    observe_rows("search_result", filtered_data.height)
+
+    # JSON 出力の場合 (地図は作らない)
+    # 既定は行ごとのストリーミング (ndjson=1 で NDJSON)、pretty=1 で整形済みの JSON
+    is_json = request.args.get("json")
+    if is_json:
+        if request.args.get("pretty"):
+            with stage("json"):
+                df = filtered_data.with_columns(pl.col(pl.Time).cast(pl.String))
+                return get_json_formatter().serialize(json.loads(df.write_json()))
+        return json_response(filtered_data, ndjson=bool(request.args.get("ndjson")))
+
+    # ブラウザ側描画モード: 地図はシェルを iframe で読み込み、マーカーは /markers から取得
+    is_client = request.args.get("client")
+    if is_client:
+        params = [(k, v) for k, v in request.form.items(multi=True) if k != "csrf_token"]
+        if request.args.get("viewport"):
+            # 表示範囲モード: 表示範囲内のマーカーだけ取得する
+            params.append(("viewport", "1"))
+        query = urlencode(params)
+        map_html = (
+            f'<iframe src="{to_url("/hoikuen/map_shell")}?{query}" '
+            'style="width: 100%; height: 100%; border: none;"></iframe>'
+        )
+    else:
+        # 地図を作成
+        with stage("map_build"):
+            area = MapArea(*ward_area(wards))
+            nursery_map = build_nursery_map(filtered_data, area=area)
 
-        folium.GeoJson(
-            school_area,
-            style_function=style_function,
-            popup=folium.GeoJsonPopup(fields=["school_name"], labels=False),
-        ).add_to(school_area_group)
-        school_area_group.add_to(nursery_map)
+        # バス停・バスルート・小学校/幼稚園・小学校区の出し分け (レンダリング済みのものを差し込む)
+        with stage("overlays"):
+            add_overlays(nursery_map, form, layers=ward_layers(wards))
 
-    # レイヤーコントロールを追加(確認用)
-    folium.LayerControl().add_to(nursery_map)
+        # レイヤーコントロールを追加(確認用)
+        folium.LayerControl().add_to(nursery_map)
 
-    # Folium height fix: https://stackoverflow.com/questions/79051048
-    cast(Figure, nursery_map.get_root()).height = "100%"
+        # Folium height fix: https://stackoverflow.com/questions/79051048
+        cast(Figure, nursery_map.get_root()).height = "100%"
 
-    # htmlに変換
-    map_html = nursery_map._repr_html_()
+        # htmlに変換 (data: の iframe になるので相対 URL の基準を入れる)
+        set_base_url(nursery_map, to_url("/"))
+        with stage("repr_html"):
+            map_html = nursery_map._repr_html_()
 
     # メッセージを用意
     data_count = filtered_data.height
-    info(f"filtered_data.height: {data_count}")
     if data_count == 0:
         messages.append("マッチする保育園はありません")
     else:
@@ -225,12 +218,6 @@ def fn_hoikuen_search_result() -> str:
     # フィルター後のデータを取得
     df: pl.DataFrame = filtered_data.with_columns(pl.col(pl.Time).cast(pl.String))
 
-    # JSON 出力の場合
-    is_json = request.args.get("json")
-    if is_json:
-        df = df.with_columns(pl.col(pl.Time).cast(pl.String))
-        return json_formatter.serialize(json.loads(df.write_json()))
-
     # Render the template with the map and data
     context = {
         "df": df,
@@ -245,12 +232,143 @@ def fn_hoikuen_search_result() -> str:
     }
     is_map = request.args.get("map")
     template_html = "hoikuen/search_result.html" if not is_map else "hoikuen/map.html"
-    response = render_template(template_html, **context)
+    with stage("template"):
+        response = render_template(template_html, **context)
+    return response
+
+
+@timed_route("markers")
+def fn_hoikuen_markers() -> Response:
+    """
+    /markers : 保育園マーカーのデータ (ブラウザ側描画モード用)
+
+    クエリは FilterForm と同じ項目。名称・緯度経度・種別コード・クエリを列指向の JSON で返す。
+    """
+    from mapping import MAP_RENDERER, nursery_markers
+
+    form = FilterForm(request.args or None)
+    try:
+        wards = form_wards(form)
+    except ValueError as e:
+        return bad_request(e)
+    not_modified = conditional(wards, "markers", (filter_form_key(form), MAP_RENDERER))
+    if not_modified is not None:
+        return not_modified
+    with stage("data_load"):
+        snapshots = [ward_snapshot(ward) for ward in wards]
+    with stage("filter"):
+        try:
+            filtered_data = filter_snapshots(snapshots, form)
+        except ValueError as e:
+            return bad_request(e)
+    observe_rows("markers", filtered_data.height)
+    with stage("json"):
+        data = json.dumps(
+            nursery_markers(filtered_data), ensure_ascii=False, separators=(",", ":")
+        )
+    return Response(data, mimetype="application/json")
+
+
+@timed_route("viewport")
+def fn_hoikuen_viewport() -> Response:
+    """
+    /viewport : 地図の表示範囲内の地物 (表示範囲モード用)
 
+    * bbox : 表示範囲 "south,west,north,east" (必須)
+    * zoom : ズームレベル
+    * layers : "nursery" とポイントレイヤー (bus_stop, elementary_school, kindergarten) のカンマ区切り
+    * その他 : FilterForm と同じ項目 (保育園に適用)
+
+    レイヤーごとに列指向の JSON を返す。ズームレベルが小さすぎるレイヤーは null。
+    区 (ward) の指定がなければ表示範囲に重なる区のものを返す。
+    """
+    from mapping import MAP_RENDERER
+    from viewport import viewport_features, viewport_wards
+
+    try:
+        bbox = parse_bbox(request.args.get("bbox", ""))
+        zoom = int(request.args.get("zoom", "14"))
+    except ValueError as e:
+        return bad_request(e)
+    layers = [name for name in request.args.get("layers", "nursery").split(",") if name]
+
+    form = FilterForm(request.args or None)
+    try:
+        wards = viewport_wards(form, bbox)
+    except ValueError as e:
+        return bad_request(e)
+    key = (filter_form_key(form), tuple(bbox), zoom, layers, MAP_RENDERER)
+    not_modified = conditional(wards, "viewport", key)
+    if not_modified is not None:
+        return not_modified
+    with stage("filter"):
+        try:
+            features = viewport_features(form, bbox, zoom, layers)
+        except ValueError as e:
+            return bad_request(e)
+    if features.get("nursery") is not None:
+        observe_rows("viewport", len(features["nursery"]["name"]))
+    with stage("json"):
+        data = json.dumps(features, ensure_ascii=False, separators=(",", ":"))
+    return Response(data, mimetype="application/json")
+
+
+# 地図シェルのキャッシュ (区, 表示するオーバーレイ, 表示範囲モード, 地図レイヤーの mtime) → HTML
+map_shell_cache = register_cache("map_shell", LRUCache(maxsize=64))
+
+
+@timed_route("map_shell")
+def fn_hoikuen_map_shell() -> Response:
     """
-    time_end = time.time()
-    info(f"Response is built in {(time_end - time_start) * 1000}ms")
+    /map_shell : 保育園マーカーなしの地図 (ブラウザ側描画モード用)
+
+    マーカーは地図の中から /markers に同じクエリで取得する。
+    viewport=1 の場合は /viewport から表示範囲内の保育園とバス停・学校を取得する。
+    絞り込み条件に依存しないので、区・オーバーレイの組み合わせごとに一度だけ作る
+    (URL は相対 URL なのでホストによらない。地図レイヤーが更新されれば作り直す)。
     """
+    from branca.element import Figure
+    import folium
+    from overlays import OVERLAYS, add_overlays
+    from mapping import MapArea, make_map_shell
+    from viewport import POINT_OVERLAYS
+
+    form = FilterForm(request.args or None)
+    try:
+        wards = form_wards(form)
+    except ValueError as e:
+        return bad_request(e)
+    overlays = tuple(name for name in OVERLAYS if getattr(form, name).data)
+    is_viewport = bool(request.args.get("viewport"))
+    layers = ward_layers(wards)
+    key = (
+        tuple(ward.code for ward in wards),
+        overlays,
+        is_viewport,
+        tuple(sorted(layers.source_versions().items())),
+    )
+
+    def build() -> str:
+        area = MapArea(*ward_area(wards))
+        if is_viewport:
+            # ポイントレイヤーは表示範囲内のものだけブラウザ側で描画する
+            point_overlays = [name for name in overlays if name in POINT_OVERLAYS]
+            shell = make_map_shell(
+                "/hoikuen/viewport", viewport_overlays=point_overlays, area=area
+            )
+            add_overlays(shell, form, exclude=point_overlays, layers=layers)
+        else:
+            shell = make_map_shell("/hoikuen/markers", area=area)
+            add_overlays(shell, form, layers=layers)
+        folium.LayerControl().add_to(shell)
+        # Folium height fix: https://stackoverflow.com/questions/79051048
+        cast(Figure, shell.get_root()).height = "100%"
+        with stage("repr_html"):
+            return shell.get_root().render()
+
+    response = Response(map_shell_cache.get_or_set(key, build), mimetype="text/html")
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
     return response
 
 
@@ -260,6 +378,9 @@ class NameSearchForm(FlaskForm):
     x = StringField("Partial", validators=[WtfOptional()])  # x = html fragment
     h = StringField("ハッシュ", validators=[WtfOptional()])  # h = hash
     json = BooleanField("JSON", validators=[WtfOptional()])
+    ndjson = BooleanField("NDJSON", validators=[WtfOptional()])  # JSON を NDJSON で
+    pretty = BooleanField("整形", validators=[WtfOptional()])  # JSON を整形して一括で
+    ward = StringField("区", validators=[WtfOptional()])  # wards.py のコード
 
     def __init__(self, *args, **kwargs):
         super().__init__(meta={"csrf": False}, *args, **kwargs)
@@ -269,11 +390,31 @@ def get_view_perma_url(item: Dict[str, Any]) -> str:
     """
     Get Perma URL for `/view`
     """
-    hashstr = xx58_str_to_hashstr(item["名称"])
+    hashstr = ward_snapshot(get_ward(None)).names.hash_of(item["名称"])
     return f"{to_url('/hoikuen/view')} + ?h={hashstr}"
 
 
-def fn_hoikuen_view() -> str:
+def find_view_rows(snapshot: HoikuenSnapshot, form: NameSearchForm) -> pl.DataFrame:
+    """
+    /view の検索 (ハッシュ・完全一致は索引で引く)
+    """
+    q, h = form.q.data, form.h.data
+    if h:
+        df = snapshot.find_by_hash(h)
+        if q:
+            expr = pl.col("名称").eq(q) if form.qex.data else text_contains(pl.col("名称"), q)
+            df = df.filter(expr)
+        return df
+    if q:
+        if form.qex.data:
+            return snapshot.find_by_name(q)
+        # 部分一致は名称の索引で引く (正規化した文字列として)
+        return search_text(snapshot, {"名称": q})
+    return snapshot.df
+
+
+@timed_route("view")
+def fn_hoikuen_view() -> str | Response:
     """
     /view : 保育園閲覧
 
@@ -284,6 +425,7 @@ def fn_hoikuen_view() -> str:
     * qex : 厳密マッチか？
     * x : 部分HTML出力
     * json : JSON出力
+    * ward : 区 (省略時は h= は区の索引で引き、q= は渋谷区)
     """
 
     def render_error(messages: List[str], context: Dict | None = None) -> str:
@@ -291,30 +433,38 @@ def fn_hoikuen_view() -> str:
             context = {}
         return render_template("hoikuen/view_error.html", messages=messages, **context)
 
-    lf = load_hoikuen_csv()
-
     form = NameSearchForm(request.args)
-    info(form.data)
+    log_form("view", form.data)
+
+    # 固定リンクには区が含まれないので、区の指定がなければハッシュの索引で区を引く
+    # (ほかの区のデータは読まない)
+    try:
+        if form.ward.data:
+            ward = get_ward(form.ward.data)
+        elif form.h.data:
+            ward = ward_of_hash(form.h.data)
+        else:
+            ward = get_ward(None)
+    except ValueError as e:
+        return bad_request(e)
+
+    # ハッシュでの固定リンクは一定時間キャッシュさせる
+    key = sorted(form.data.items())
+    max_age = PERMALINK_MAX_AGE if form.h.data else None
+    not_modified = conditional([ward], "view", key, max_age)
+    if not_modified is not None:
+        return not_modified
 
     # フィルター後のデータを取得
     q, h = form.q.data, form.h.data
-    if q or h:
-        # 検索クエリを構築
-        if q:
-            qex = form.qex.data
-            expr = pl.col("名称").eq(q) if qex else pl.col("名称").str.contains(q)
-            lf = lf.filter(expr)
-        if h:
-            # hashbyte = xx58_hashstr_to_hashbyte(h)
-            # NOQA: This's fu-king inefficient. 元データにハッシュ列があるべき
-            expr = (
-                pl.col("名称").map_elements(lambda txt: xx58_str_to_hashstr(txt)).eq(h)
-            )
-            lf = lf.filter(expr)
-    else:
+    if not (q or h):
         # エラー: クエリなし
         query = q or h
         render_error(["クエリを指定してください"])
+    with stage("data_load"):
+        snapshot = ward_snapshot(ward)
+    with stage("filter"):
+        lf = find_view_rows(snapshot, form).lazy()
 
     is_json = form.json.data
     if is_json:
@@ -322,7 +472,7 @@ def fn_hoikuen_view() -> str:
         if df.height == 0:
             return "{}"
         item = df.row(0, named=True)
-        data = json_formatter.format_dict(3, item).value
+        data = get_json_formatter().format_dict(3, item).value
         return data
 
     df = lf.with_columns(
@@ -336,19 +486,21 @@ def fn_hoikuen_view() -> str:
     item = df.row(0, named=True)
     context = {
         "row": item,
-        "xx58_str_to_hashstr": xx58_str_to_hashstr,
+        "xx58_str_to_hashstr": snapshot.names.hash_of,
         "is_enrollable": is_enrollable,
         "to_hhmm": time_to_HHMM_ja,
         "to_url": to_url,
     }
 
     x = form.x.data
-    return render_template(
-        "hoikuen/view.html" if x else "hoikuen/view_full.html", **context
-    )
+    with stage("template"):
+        return render_template(
+            "hoikuen/view.html" if x else "hoikuen/view_full.html", **context
+        )
 
 
-def fn_hoikuen_list() -> str:
+@timed_route("list")
+def fn_hoikuen_list() -> str | Response:
     """
     /view : 保育園一覧
 
@@ -356,32 +508,101 @@ def fn_hoikuen_list() -> str:
     * q : 検索文字列
     * qex : 厳密マッチか？
     * x : 部分HTML出力
-    * json : JSON出力
+    * json : JSON出力 (カラムごとの形式、ストリーミング)
+    * ndjson : JSON出力を行ごとの NDJSON に
+    * pretty : JSON出力を整形して一括で
+    * ward : 区 (省略時は渋谷区)
     """
-    lf = load_hoikuen_csv()
-
     form = NameSearchForm(request.args)
-    # app.logger.info(f"form: {form.to_dict()}")
-    info(form.data)
+    log_form("list", form.data)
 
-    # フィルター後のデータを取得
+    try:
+        ward = get_ward(form.ward.data)
+    except ValueError as e:
+        return bad_request(e)
+    not_modified = conditional([ward], "list", sorted(form.data.items()))
+    if not_modified is not None:
+        return not_modified
+
+    with stage("data_load"):
+        snapshot = ward_snapshot(ward)
+    lf = snapshot.lazy()
+
+    # フィルター後のデータを取得 (部分一致は名称の索引で引く)
     q = form.q.data
     if q:
         qex = form.qex.data
-        expr = pl.col("名称").eq(q) if qex else pl.col("名称").str.contains(q)
-        lf = lf.filter(expr)
+        if qex:
+            lf = lf.filter(pl.col("名称").eq(q))
+        else:
+            lf = search_text(snapshot, {"名称": q}).lazy()
+    with stage("filter"):
+        df = lf.collect()
+    observe_rows("list", df.height)
 
     is_json = form.json.data
     if is_json:
-        df = lf.with_columns(pl.col(pl.Time).cast(pl.String)).collect()
-        data = json_formatter.format_dict(3, df.to_dict(as_series=False)).value
+        if not form.pretty.data:
+            return json_response(df, ndjson=form.ndjson.data, columns=True)
+        with stage("json"):
+            df = df.with_columns(pl.col(pl.Time).cast(pl.String))
+            data = get_json_formatter().format_dict(3, df.to_dict(as_series=False)).value
         return data
 
     context = {
-        "df": lf.collect(),
+        "df": df,
         "shorten_address": shorten_address,
     }
     x = form.x.data
-    return render_template(
-        "hoikuen/list.html" if x else "hoikuen/list_full.html", **context
-    )
+    with stage("template"):
+        return render_template(
+            "hoikuen/list.html" if x else "hoikuen/list_full.html", **context
+        )
+
+
+@timed_route("suggest")
+def fn_hoikuen_suggest() -> Response:
+    """
+    /suggest : 名称の入力補完
+
+    * q : 入力途中の文字列 (名称・別名・読み仮名の前方一致)
+    * n : 件数 (既定 10, 最大 20)
+
+    [{"name": 名称, "h": ハッシュ}, ...] を返す。
+    """
+    q = request.args.get("q", "")
+    try:
+        n = int(request.args.get("n", "10"))
+    except ValueError:
+        n = 10
+    try:
+        ward = get_ward(request.args.get("ward"))
+    except ValueError as e:
+        return bad_request(e)
+    with stage("filter"):
+        suggestions = suggest_names(ward_snapshot(ward), q, n)
+    observe_rows("suggest", len(suggestions))
+    data = json.dumps(suggestions, ensure_ascii=False, separators=(",", ":"))
+    response = Response(data, mimetype="application/json")
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response
+
+
+def fn_hoikuen_metrics() -> Response:
+    """
+    /metrics : 段階ごとの処理時間・件数・キャッシュのヒット数 (Prometheus のテキスト形式)
+
+    キャッシュの大きさやリクエスト数が見えるので、環境変数 METRICS_TOKEN を設定した場合だけ
+    "Authorization: Bearer {トークン}" のリクエストに返す (未設定なら 404、違えば 401)。
+    """
+    if METRICS_TOKEN is None:
+        return Response("Not Found", status=404, mimetype="text/plain")
+    if not metrics_authorized(request.headers.get("Authorization")):
+        return Response(
+            "Unauthorized",
+            status=401,
+            mimetype="text/plain",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
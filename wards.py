@@ -0,0 +1,236 @@
+"""
+区ごとのデータ (パーティション)
+
+渋谷区は従来どおり data/hoikuen.csv と data/geojson/shibuya_*.geojson。
+ほかの区は data/wards/{区のコード}/ に同じ構成で置く:
+
+    data/wards/shinjuku/ward.json      {"name": "新宿区", "center": [緯度, 経度],
+                                        "bounds": [南, 西, 北, 東]}
+    data/wards/shinjuku/hoikuen.csv
+    data/wards/shinjuku/geojson/{busstop,busline,school,schoolarea}.geojson
+
+区ごとにスナップショット・索引・地図レイヤー・空間結合を持ち、検索では指定の区か
+地図の範囲に重なる区だけを読む (区を増やしても1つの区の検索は遅くならない)。
+区の一覧は起動時に一度だけ読む。
+
+固定リンク (/view?h=) には区が含まれないので、名称ハッシュ → 区のコードの索引
+(data/ward_hashes.json) を build_snapshots.py で作っておく。
+"""
+import json
+import os
+import threading
+from functools import cache
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Tuple, cast
+
+from geo_sources import GEO_LAYER_FILES
+from hoikuen_store import (
+    DEFAULT_HOIKUEN_CSV,
+    FileStamp,
+    HoikuenSnapshot,
+    file_stamp,
+    get_hoikuen_snapshot,
+)
+from spatial_index import BBox, union_bbox
+
+if TYPE_CHECKING:
+    from geodata import GeoLayers
+
+WARDS_DIR = "data/wards"
+DEFAULT_WARD = "shibuya"
+# 名称ハッシュ → 区のコード (固定リンクの区を引く)
+WARD_HASH_INDEX = "data/ward_hashes.json"
+
+# 区のディレクトリ内の地図レイヤーのファイル名
+WARD_GEO_FILES = {
+    "bus_stop": "geojson/busstop.geojson",
+    "bus_route": "geojson/busline.geojson",
+    "school": "geojson/school.geojson",
+    "school_area": "geojson/schoolarea.geojson",
+}
+
+
+class Ward(NamedTuple):
+    """
+    区 (パーティション)
+    """
+
+    code: str  # ディレクトリ名 (URL の ward=)
+    name: str
+    center: Tuple[float, float]  # 地図の初期表示の中心 (区役所)
+    bounds: BBox  # 区の範囲 (パーティションの絞り込み・地名検索の範囲)
+    csv: str
+    geo_files: Dict[str, str]
+
+
+SHIBUYA = Ward(
+    DEFAULT_WARD,
+    "渋谷区",
+    (35.66367, 139.69772),
+    BBox(35.64223, 139.66327, 35.69244, 139.72876),
+    DEFAULT_HOIKUEN_CSV,
+    GEO_LAYER_FILES,
+)
+
+
+def read_ward(ward_dir: str) -> Ward:
+    """
+    区のディレクトリの ward.json を読む
+
+    Raises:
+        ValueError: ward.json の内容が不正な場合
+    """
+    code = os.path.basename(os.path.normpath(ward_dir))
+    with open(os.path.join(ward_dir, "ward.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    try:
+        center = (float(meta["center"][0]), float(meta["center"][1]))
+        bounds = BBox(*(float(v) for v in meta["bounds"]))
+    except (KeyError, TypeError, IndexError) as e:
+        raise ValueError(f"{ward_dir}/ward.json: {e!r}") from e
+    if bounds.south > bounds.north or bounds.west > bounds.east:
+        raise ValueError(f"{ward_dir}/ward.json: invalid bounds")
+    return Ward(
+        code,
+        meta.get("name", code),
+        center,
+        bounds,
+        os.path.join(ward_dir, "hoikuen.csv"),
+        {name: os.path.join(ward_dir, path) for name, path in WARD_GEO_FILES.items()},
+    )
+
+
+def load_wards(wards_dir: str = WARDS_DIR) -> Dict[str, Ward]:
+    """
+    区のコード → 区 (渋谷区が先頭、ほかはコード順)
+    """
+    wards = {DEFAULT_WARD: SHIBUYA}
+    if os.path.isdir(wards_dir):
+        for code in sorted(os.listdir(wards_dir)):
+            ward_dir = os.path.join(wards_dir, code)
+            if os.path.exists(os.path.join(ward_dir, "ward.json")):
+                wards[code] = read_ward(ward_dir)
+    return wards
+
+
+@cache
+def get_wards() -> Dict[str, Ward]:
+    return load_wards()
+
+
+def get_ward(code: str | None) -> Ward:
+    """
+    区を取得 (省略時は渋谷区)
+
+    Raises:
+        ValueError: 存在しない区の場合
+    """
+    wards = get_wards()
+    ward = wards.get(code or DEFAULT_WARD)
+    if ward is None:
+        raise ValueError(f"unknown ward: {code}")
+    return ward
+
+
+def select_wards(code: str | None = None, bbox: BBox | None = None) -> List[Ward]:
+    """
+    検索で読む区 (パーティションの絞り込み)
+
+    区の指定があればその区、なければ bbox に重なる区、どちらもなければ渋谷区。
+
+    Raises:
+        ValueError: 存在しない区の場合
+    """
+    if code or bbox is None:
+        return [get_ward(code)]
+    return [ward for ward in get_wards().values() if ward.bounds.intersects(bbox)]
+
+
+def wards_by_distance(lat: float, lon: float) -> List[Tuple[float, Ward]]:
+    """
+    (lat, lon) から区の範囲までの距離 (m) と区を近い順に (範囲内の区は 0)
+    """
+    wards = [(ward.bounds.distance_m(lat, lon), ward) for ward in get_wards().values()]
+    return sorted(wards, key=lambda item: item[0])
+
+
+def ward_area(wards: List[Ward]) -> Tuple[Tuple[float, float], BBox]:
+    """
+    地図の初期表示の中心 (最初の区) と範囲 (すべての区を含む矩形)
+    """
+    return wards[0].center, union_bbox([ward.bounds for ward in wards])
+
+
+# 区のコード (の組) → 地図レイヤー
+_layers: Dict[Tuple[str, ...], "GeoLayers"] = {}
+_layers_lock = threading.Lock()
+
+
+def ward_layers(wards: List[Ward]) -> "GeoLayers":
+    """
+    区の地図レイヤー (複数の区の場合は連結したもの)
+
+    geodata は地図を描く時だけ必要なので、ここで初めて読み込む。
+    """
+    from geodata import GeoDataRegistry, MergedGeoData, geodata
+
+    key = tuple(ward.code for ward in wards)
+    layers = _layers.get(key)
+    if layers is not None:
+        return layers
+    if key == (DEFAULT_WARD,):
+        layers = geodata
+    elif len(wards) == 1:
+        layers = GeoDataRegistry(wards[0].geo_files, wards[0].code)
+    else:
+        layers = MergedGeoData([cast(GeoDataRegistry, ward_layers([ward])) for ward in wards])
+    with _layers_lock:
+        return _layers.setdefault(key, layers)
+
+
+def ward_snapshot(ward: Ward) -> HoikuenSnapshot:
+    """
+    区の保育園データの最新スナップショット
+    """
+    return get_hoikuen_snapshot(ward.csv, ward.geo_files)
+
+
+def build_ward_hash_index(path: str = WARD_HASH_INDEX) -> str:
+    """
+    すべての区の名称ハッシュ → 区のコードの索引を書き出す (同じハッシュは先の区)
+
+    Returns:
+        書き出したファイルのパス
+    """
+    index: Dict[str, str] = {}
+    for ward in get_wards().values():
+        for hashstr in ward_snapshot(ward).names.hashes:
+            index.setdefault(hashstr, ward.code)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    return path
+
+
+# (索引ファイルのスタンプ, 名称ハッシュ → 区のコード)
+_hash_index: Tuple[FileStamp | None, Dict[str, str]] = (None, {})
+_hash_index_lock = threading.Lock()
+
+
+def ward_of_hash(hashstr: str, path: str = WARD_HASH_INDEX) -> Ward:
+    """
+    名称ハッシュの区 (索引にない・索引がない場合は渋谷区)
+
+    索引はファイルが更新されたら読み直す。区のデータは読み込まない。
+    """
+    global _hash_index
+    stamp = file_stamp(path) if os.path.exists(path) else None
+    if _hash_index[0] != stamp:
+        with _hash_index_lock:
+            if _hash_index[0] != stamp:
+                index: Dict[str, str] = {}
+                if stamp is not None:
+                    with open(path, encoding="utf-8") as f:
+                        index = json.load(f)
+                _hash_index = (stamp, index)
+    return get_wards().get(_hash_index[1].get(hashstr, DEFAULT_WARD)) or get_ward(None)